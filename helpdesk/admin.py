@@ -2,7 +2,7 @@ from django.contrib import admin
 from helpdesk.models import Queue, Ticket, FollowUp, PreSetReply, KBCategory
 from helpdesk.models import EscalationExclusion, EmailTemplate, KBItem
 from helpdesk.models import TicketChange, Attachment, IgnoreEmail
-from helpdesk.models import CustomField
+from helpdesk.models import CustomField, APIToken, SpamLabel
 
 class QueueAdmin(admin.ModelAdmin):
     list_display = ('title', 'slug', 'email_address', 'locale')
@@ -32,6 +32,19 @@ class EmailTemplateAdmin(admin.ModelAdmin):
     list_display = ('template_name', 'heading', 'locale')
     list_filter = ('locale', )
 
+class APITokenAdmin(admin.ModelAdmin):
+    list_display = ('name', 'user', 'created', 'active')
+    list_filter = ('active', )
+
+    def has_add_permission(self, request):
+        # Tokens are created with the create_api_token management command,
+        # which is the only time the unhashed token is available.
+        return False
+
+class SpamLabelAdmin(admin.ModelAdmin):
+    list_display = ('ticket_id', 'is_spam', 'created')
+    list_filter = ('is_spam', )
+
 admin.site.register(Ticket, TicketAdmin)
 admin.site.register(Queue, QueueAdmin)
 admin.site.register(FollowUp, FollowUpAdmin)
@@ -42,3 +55,5 @@ admin.site.register(KBCategory)
 admin.site.register(KBItem, KBItemAdmin)
 admin.site.register(IgnoreEmail)
 admin.site.register(CustomField, CustomFieldAdmin)
+admin.site.register(APIToken, APITokenAdmin)
+admin.site.register(SpamLabel, SpamLabelAdmin)
@@ -0,0 +1,309 @@
+"""
+django-helpdesk - A Django powered ticket tracker for small enterprise.
+
+(c) Copyright 2008 Jutda. All Rights Reserved. See LICENSE for details.
+
+events.py - Ticket events (created, updated, assigned, closed) published
+            when tickets and follow-ups are saved, and read back by the
+            staff event stream (see views.staff.event_stream) so that pages
+            can be updated as tickets change rather than by reloading them.
+
+The broker that stores events is set by settings.HELPDESK_EVENT_BROKER.
+"""
+
+import threading
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction, IntegrityError
+from django.utils import simplejson
+from django.utils.importlib import import_module
+
+from helpdesk import settings as helpdesk_settings
+
+
+class InMemoryBroker(object):
+    """
+    Keeps the most recent events in a list in this process. Events are not
+    shared between processes, so get_broker() won't use it; it is for
+    tests, which can install it with set_broker().
+    """
+
+    shared = False
+
+    def __init__(self, max_events=1000):
+        self.max_events = max_events
+        self.events = []
+        self.last_id = 0
+        self.condition = threading.Condition()
+
+    def publish(self, event):
+        """
+        Store an event (a dictionary), giving it the next event ID, and wake
+        up anybody waiting for it.
+        """
+        self.condition.acquire()
+        try:
+            self.last_id += 1
+            event['id'] = self.last_id
+            self.events.append(event)
+            del self.events[:-self.max_events]
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+        return event
+
+    def latest_id(self):
+        return self.last_id
+
+    def events_after(self, event_id, timeout=0):
+        """
+        Return the events with an ID greater than 'event_id', oldest first,
+        waiting for up to 'timeout' seconds for one if there aren't any yet.
+        """
+        self.condition.acquire()
+        try:
+            if timeout and self.last_id <= event_id:
+                self.condition.wait(timeout)
+            return [e for e in self.events if e['id'] > event_id]
+        finally:
+            self.condition.release()
+
+
+class DatabaseBroker(object):
+    """
+    Stores events in the TicketEvent table, so they are shared between
+    server processes and kept as a log that integrations can read (see the
+    ticket_events management command and API method). Waiting for events
+    polls the table every 'poll_interval' seconds, once for all of the
+    streams waiting in this process (see events_after()).
+
+    Events are saved in the same transaction as the change they describe
+    (see publish()), so an event is logged if and only if its change is
+    committed. The events' ID's don't tell readers what order they were
+    committed in, so readers see them by sequence number instead, given
+    by relay() once they are committed.
+    """
+
+    shared = True
+    transactional = True
+
+    def __init__(self, poll_interval=1, max_events=1000):
+        self.poll_interval = poll_interval
+        self.max_events = max_events
+        self.condition = threading.Condition()
+        # The latest events polled, oldest first: all of those with a
+        # sequence number above polled_from, up to polled_to.
+        self.recent = []
+        self.polled_from = None
+        self.polled_to = None
+        self.polling = False
+        self.next_poll = 0
+
+    def publish(self, event):
+        from helpdesk.models import TicketEvent
+        TicketEvent.objects.create(
+            ticket_id=event['ticket'],
+            event_type=event['type'],
+            data=simplejson.dumps(event),
+            )
+        return event
+
+    def relay(self, limit=1000):
+        """
+        Give up to 'limit' committed events which have no sequence number
+        yet the next numbers, in ID order.
+
+        Only committed events can be seen here, and each is numbered after
+        every event numbered before it, so a reader going through events in
+        sequence order never skips one which commits late. Relays running
+        at the same time may try to hand out the same numbers: the unique
+        'sequence' column stops all but one, and the events left over are
+        numbered by the next run. A run stops as soon as it can't number an
+        event, so the numbers handed out never have gaps that a late run
+        could fill in behind a reader. (So it mustn't be run by a
+        transaction which has published events of its own.)
+        """
+        if transaction.is_managed():
+            _relay(limit)
+        else:
+            _relay_in_transaction(limit)
+
+    def latest_id(self):
+        from django.db.models import Max
+        from helpdesk.models import TicketEvent
+        self.relay()
+        return TicketEvent.objects.aggregate(Max('sequence'))['sequence__max'] or 0
+
+    def events_after(self, event_id, timeout=0, limit=500):
+        """
+        Return up to 'limit' events with a sequence number greater than
+        'event_id', oldest first, waiting for up to 'timeout' seconds for
+        one if there aren't any yet.
+
+        Callers that wait (the event streams) share one poll of the table:
+        whichever of them is due to poll next reads the new events into
+        'recent', and the rest are handed them from there, so the number of
+        queries doesn't grow with the number of open streams.
+        """
+        if not timeout:
+            return self._read(event_id, limit)
+        finish = time.time() + timeout
+        self.condition.acquire()
+        try:
+            while True:
+                if self.polled_from is not None:
+                    if event_id >= self.polled_from:
+                        events = [e for e in self.recent if e['id'] > event_id]
+                        if events:
+                            return events[:limit]
+                    else:
+                        # Further back than the events kept here.
+                        self.condition.release()
+                        try:
+                            events = self._read(event_id, limit)
+                        finally:
+                            self.condition.acquire()
+                        if events:
+                            return events
+                        event_id = self.polled_from
+                        continue
+                remaining = finish - time.time()
+                if remaining <= 0:
+                    return []
+                if not self.polling and time.time() >= self.next_poll:
+                    self._poll()
+                else:
+                    self.condition.wait(min(remaining, max(self.next_poll - time.time(), 0.1)))
+        finally:
+            self.condition.release()
+
+    def _poll(self):
+        """
+        Read the events since the last poll into 'recent', and wake up the
+        callers waiting for them. Called, and returns, with the condition
+        held, but releases it while reading.
+        """
+        self.polling = True
+        self.condition.release()
+        try:
+            if self.polled_to is None:
+                start, events = self.latest_id(), []
+            else:
+                start, events = self.polled_to, self._read(self.polled_to, self.max_events)
+        finally:
+            self.condition.acquire()
+            self.polling = False
+            self.next_poll = time.time() + self.poll_interval
+            self.condition.notifyAll()
+        if self.polled_from is None:
+            self.polled_from = start
+        self.recent.extend(events)
+        if events:
+            self.polled_to = events[-1]['id']
+        else:
+            self.polled_to = start
+        if len(self.recent) > self.max_events:
+            self.polled_from = self.recent[-self.max_events - 1]['id']
+            del self.recent[:-self.max_events]
+
+    def _read(self, event_id, limit):
+        from helpdesk.models import TicketEvent
+        self.relay()
+        return [e.as_event() for e in TicketEvent.objects.sequenced().filter(sequence__gt=event_id).order_by('sequence')[:limit]]
+
+
+_broker = None
+
+def get_broker():
+    """
+    Returns the broker named by settings.HELPDESK_EVENT_BROKER, creating it
+    the first time it is needed. The broker must share events between
+    server processes (its 'shared' attribute), as a browser's stream
+    may be served by a different process each time it reconnects.
+    """
+    global _broker
+    if _broker is None:
+        path = helpdesk_settings.HELPDESK_EVENT_BROKER
+        module_name, class_name = path.rsplit('.', 1)
+        try:
+            broker_class = getattr(import_module(module_name), class_name)
+        except (ImportError, AttributeError), e:
+            raise ImproperlyConfigured('Error loading helpdesk event broker %s: %s' % (path, e))
+        if not getattr(broker_class, 'shared', False):
+            raise ImproperlyConfigured('The helpdesk event broker %s does not share events between '
+                'server processes; use helpdesk.events.DatabaseBroker' % path)
+        _broker = broker_class()
+    return _broker
+
+
+def set_broker(broker):
+    """
+    Replace the broker in use, eg with a fresh InMemoryBroker in tests.
+    """
+    global _broker
+    _broker = broker
+
+
+def ticket_event(event_type, ticket, **extra):
+    """
+    Build the event describing a change to a ticket.
+    """
+    event = {
+        'type': event_type,
+        'ticket': ticket.id,
+        'queue': ticket.queue_id,
+        'title': ticket.title,
+        'status': ticket.status,
+        'assigned_to': ticket.assigned_to_id,
+        'time': time.time(),
+        }
+    event.update(extra)
+    return event
+
+
+def _relay(limit):
+    from django.db.models import Max
+    from helpdesk.models import TicketEvent
+
+    event_ids = list(TicketEvent.objects.filter(sequence__isnull=True).order_by('id').values_list('id', flat=True)[:limit])
+    if not event_ids:
+        return
+    sequence = TicketEvent.objects.aggregate(Max('sequence'))['sequence__max'] or 0
+    sid = transaction.savepoint()
+    try:
+        for event_id in event_ids:
+            sequence += 1
+            if not TicketEvent.objects.filter(id=event_id, sequence__isnull=True).update(sequence=sequence):
+                # Numbered by another relay since we looked.
+                break
+    except IntegrityError:
+        transaction.savepoint_rollback(sid)
+    else:
+        transaction.savepoint_commit(sid)
+_relay_in_transaction = transaction.commit_on_success(_relay)
+
+
+def publish(event):
+    """
+    Publish an event about a change. A broker which keeps events in the
+    database ('transactional', like the DatabaseBroker) is given it at once,
+    so the event is saved, or rolled back, with the change. Other brokers
+    are only given it once the change has been committed, so nobody hears
+    about a change that is rolled back.
+    """
+    if helpdesk_settings.HELPDESK_EVENTS_ENABLED:
+        broker = get_broker()
+        if getattr(broker, 'transactional', False):
+            broker.publish(event)
+        else:
+            from helpdesk.lib import on_commit
+            on_commit(broker.publish, event)
+
+
+def event_log_enabled():
+    """
+    True if events are being kept in the TicketEvent log, for the
+    ticket_events command and API method to read.
+    """
+    return helpdesk_settings.HELPDESK_EVENTS_ENABLED and isinstance(get_broker(), DatabaseBroker)
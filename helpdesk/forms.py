@@ -14,13 +14,110 @@ from django import forms
 from django.forms import extras
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.utils.encoding import smart_unicode
 from django.utils.translation import ugettext as _
 
-from helpdesk.lib import send_templated_mail, safe_template_context
+from helpdesk.lib import send_templated_mail, safe_template_context, custom_field_specs, user_choices, save_attachment, TICKET_LIST_COLUMNS
 from helpdesk.models import Ticket, Queue, FollowUp, Attachment, IgnoreEmail, TicketCC, CustomField, TicketCustomFieldValue, TicketDependency
 from helpdesk.settings import HAS_TAG_SUPPORT
 from helpdesk import settings as helpdesk_settings
 
+
+def _custom_field_args(spec):
+    """
+    Extra keyword arguments for the form field built for a custom field,
+    depending on its data type.
+    """
+    data_type = spec['data_type']
+    if data_type == 'varchar':
+        return {'max_length': spec['max_length']}
+    elif data_type == 'text':
+        return {'widget': forms.Textarea, 'max_length': spec['max_length']}
+    elif data_type == 'decimal':
+        return {'decimal_places': spec['decimal_places'], 'max_digits': spec['max_length']}
+    elif data_type == 'list':
+        return {'choices': spec['choices']}
+    return {}
+
+
+CUSTOM_FIELD_CLASSES = {
+    'varchar': forms.CharField,
+    'text': forms.CharField,
+    'integer': forms.IntegerField,
+    'decimal': forms.DecimalField,
+    'list': forms.ChoiceField,
+    'boolean': forms.BooleanField,
+    'date': forms.DateField,
+    'time': forms.TimeField,
+    'datetime': forms.DateTimeField,
+    'email': forms.EmailField,
+    'url': forms.URLField,
+    'ipaddress': forms.IPAddressField,
+    'slug': forms.SlugField,
+    }
+
+
+def add_custom_fields(form, include_staff_only=True, initial=None, date_widget=None):
+    """
+    Add a 'custom_<name>' field to the form for each CustomField, built from
+    the cached field specs (see helpdesk.lib.custom_field_specs). 'initial'
+    is an optional dictionary of values keyed by CustomField ID.
+    """
+    for spec in custom_field_specs():
+        if spec['staff_only'] and not include_staff_only:
+            continue
+        fieldclass = CUSTOM_FIELD_CLASSES.get(spec['data_type'])
+        if fieldclass is None:
+            continue
+        instanceargs = {
+                'label': spec['label'],
+                'help_text': spec['help_text'],
+                'required': spec['required'],
+                }
+        if initial is not None:
+            instanceargs['initial'] = initial.get(spec['id'])
+        instanceargs.update(_custom_field_args(spec))
+        if spec['data_type'] == 'date' and date_widget:
+            instanceargs['widget'] = date_widget
+
+        form.fields['custom_%s' % spec['name']] = fieldclass(**instanceargs)
+
+
+def save_custom_fields(ticket, cleaned_data, existing=None):
+    """
+    Store the submitted 'custom_<name>' values against a ticket. 'existing'
+    maps CustomField ID's to the ticket's current TicketCustomFieldValue
+    objects; unchanged values are left alone and new ones are inserted in
+    a single query where the database API allows it.
+    """
+    if existing is None:
+        existing = {}
+    field_ids = dict([(spec['name'], spec['id']) for spec in custom_field_specs()])
+
+    new_values = []
+    for field, value in cleaned_data.items():
+        if not field.startswith('custom_'):
+            continue
+        field_id = field_ids.get(field.replace('custom_', '', 1))
+        if field_id is None:
+            continue
+        if value is not None:
+            value = smart_unicode(value)
+        if field_id in existing:
+            cfv = existing[field_id]
+            if cfv.value != value:
+                TicketCustomFieldValue.objects.filter(id=cfv.id).update(value=value)
+                cfv.value = value
+        else:
+            new_values.append(TicketCustomFieldValue(ticket=ticket, field_id=field_id, value=value))
+
+    if hasattr(TicketCustomFieldValue.objects, 'bulk_create'):
+        TicketCustomFieldValue.objects.bulk_create(new_values)
+    else:
+        for cfv in new_values:
+            cfv.save()
+
+
 class EditTicketForm(forms.ModelForm):
     class Meta:
         model = Ticket
@@ -32,69 +129,16 @@ class EditTicketForm(forms.ModelForm):
         """
         super(EditTicketForm, self).__init__(*args, **kwargs)
 
-        for field in CustomField.objects.all():
-            try:
-                current_value = TicketCustomFieldValue.objects.get(ticket=self.instance, field=field)
-                initial_value = current_value.value
-            except TicketCustomFieldValue.DoesNotExist:
-                initial_value = None
-            instanceargs = {
-                    'label': field.label,
-                    'help_text': field.help_text,
-                    'required': field.required,
-                    'initial': initial_value,
-                    }
-            if field.data_type == 'varchar':
-                fieldclass = forms.CharField
-                instanceargs['max_length'] = field.max_length
-            elif field.data_type == 'text':
-                fieldclass = forms.CharField
-                instanceargs['widget'] = forms.Textarea
-                instanceargs['max_length'] = field.max_length
-            elif field.data_type == 'integer':
-                fieldclass = forms.IntegerField
-            elif field.data_type == 'decimal':
-                fieldclass = forms.DecimalField
-                instanceargs['decimal_places'] = field.decimal_places
-                instanceargs['max_digits'] = field.max_length
-            elif field.data_type == 'list':
-                fieldclass = forms.ChoiceField
-                choices = field.choices_as_array
-                if field.empty_selection_list:
-                    choices.insert(0, ('','---------' ) )
-                instanceargs['choices'] = choices
-            elif field.data_type == 'boolean':
-                fieldclass = forms.BooleanField
-            elif field.data_type == 'date':
-                fieldclass = forms.DateField
-            elif field.data_type == 'time':
-                fieldclass = forms.TimeField
-            elif field.data_type == 'datetime':
-                fieldclass = forms.DateTimeField
-            elif field.data_type == 'email':
-                fieldclass = forms.EmailField
-            elif field.data_type == 'url':
-                fieldclass = forms.URLField
-            elif field.data_type == 'ipaddress':
-                fieldclass = forms.IPAddressField
-            elif field.data_type == 'slug':
-                fieldclass = forms.SlugField
-            
-            self.fields['custom_%s' % field.name] = fieldclass(**instanceargs)
+        self.custom_values = {}
+        if self.instance.pk:
+            self.custom_values = dict([(v.field_id, v) for v in TicketCustomFieldValue.objects.filter(ticket=self.instance)])
+        initial = dict([(i, v.value) for i, v in self.custom_values.items()])
+        add_custom_fields(self, initial=initial)
 
 
     def save(self, *args, **kwargs):
         
-        for field, value in self.cleaned_data.items():
-            if field.startswith('custom_'):
-                field_name = field.replace('custom_', '')
-                customfield = CustomField.objects.get(name=field_name)
-                try:
-                    cfv = TicketCustomFieldValue.objects.get(ticket=self.instance, field=customfield)
-                except:
-                    cfv = TicketCustomFieldValue(ticket=self.instance, field=customfield)
-                cfv.value = value
-                cfv.save()
+        save_custom_fields(self.instance, self.cleaned_data, self.custom_values)
         
         return super(EditTicketForm, self).save(*args, **kwargs)
 
@@ -188,55 +232,15 @@ class TicketForm(forms.Form):
         Add any custom fields that are defined to the form
         """
         super(TicketForm, self).__init__(*args, **kwargs)
-        for field in CustomField.objects.all():
-            instanceargs = {
-                    'label': field.label,
-                    'help_text': field.help_text,
-                    'required': field.required,
-                    }
-            if field.data_type == 'varchar':
-                fieldclass = forms.CharField
-                instanceargs['max_length'] = field.max_length
-            elif field.data_type == 'text':
-                fieldclass = forms.CharField
-                instanceargs['widget'] = forms.Textarea
-                instanceargs['max_length'] = field.max_length
-            elif field.data_type == 'integer':
-                fieldclass = forms.IntegerField
-            elif field.data_type == 'decimal':
-                fieldclass = forms.DecimalField
-                instanceargs['decimal_places'] = field.decimal_places
-                instanceargs['max_digits'] = field.max_length
-            elif field.data_type == 'list':
-                fieldclass = forms.ChoiceField
-                choices = field.choices_as_array
-                if field.empty_selection_list:
-                    choices.insert(0, ('','---------' ) )
-                instanceargs['choices'] = choices
-            elif field.data_type == 'boolean':
-                fieldclass = forms.BooleanField
-            elif field.data_type == 'date':
-                fieldclass = forms.DateField
-                instanceargs['widget'] = extras.SelectDateWidget
-            elif field.data_type == 'time':
-                fieldclass = forms.TimeField
-            elif field.data_type == 'datetime':
-                fieldclass = forms.DateTimeField
-            elif field.data_type == 'email':
-                fieldclass = forms.EmailField
-            elif field.data_type == 'url':
-                fieldclass = forms.URLField
-            elif field.data_type == 'ipaddress':
-                fieldclass = forms.IPAddressField
-            elif field.data_type == 'slug':
-                fieldclass = forms.SlugField
-            
-            self.fields['custom_%s' % field.name] = fieldclass(**instanceargs)
-
-
-    def save(self, user):
+        add_custom_fields(self, date_widget=extras.SelectDateWidget)
+
+
+    def save(self, user, notify=True, send_mail=send_templated_mail):
         """
-        Writes and returns a Ticket() object
+        Writes and returns a Ticket() object. If 'notify' is False, no
+        e-mails are sent about the new ticket; otherwise each one is sent
+        by calling 'send_mail' with the arguments of send_templated_mail(),
+        so the caller can hold them back until the ticket is committed.
         """
 
         q = Queue.objects.get(id=int(self.cleaned_data['queue']))
@@ -262,14 +266,7 @@ class TicketForm(forms.Form):
                 t.assigned_to = None
         t.save()
         
-        for field, value in self.cleaned_data.items():
-            if field.startswith('custom_'):
-                field_name = field.replace('custom_', '')
-                customfield = CustomField.objects.get(name=field_name)
-                cfv = TicketCustomFieldValue(ticket=t,
-                            field=customfield,
-                            value=value)
-                cfv.save()
+        save_custom_fields(t, self.cleaned_data)
 
         f = FollowUp(   ticket = t,
                         title = _('Ticket Opened'),
@@ -287,22 +284,11 @@ class TicketForm(forms.Form):
         
         files = []
         if self.cleaned_data['attachment']:
-            import mimetypes
             file = self.cleaned_data['attachment']
-            filename = file.name.replace(' ', '_')
-            a = Attachment(
-                followup=f,
-                filename=filename,
-                mime_type=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
-                size=file.size,
-                )
-            a.file.save(file.name, file, save=False)
-            a.save()
-            
-            if file.size < getattr(settings, 'MAX_EMAIL_ATTACHMENT_SIZE', 512000):
-                # Only files smaller than 512kb (or as defined in 
-                # settings.MAX_EMAIL_ATTACHMENT_SIZE) are sent via email.
-                files.append(a.file.path)
+            files.append(save_attachment(f, file, file.name.replace(' ', '_')))
+
+        if not notify:
+            return t
 
         context = safe_template_context(t)
         context['comment'] = f.comment
@@ -310,7 +296,7 @@ class TicketForm(forms.Form):
         messages_sent_to = []
 
         if t.submitter_email:
-            send_templated_mail(
+            send_mail(
                 'newticket_submitter',
                 context,
                 recipients=t.submitter_email,
@@ -321,7 +307,7 @@ class TicketForm(forms.Form):
             messages_sent_to.append(t.submitter_email)
 
         if t.assigned_to and t.assigned_to != user and getattr(t.assigned_to.usersettings.settings, 'email_on_ticket_assign', False) and t.assigned_to.email and t.assigned_to.email not in messages_sent_to:
-            send_templated_mail(
+            send_mail(
                 'assigned_owner',
                 context,
                 recipients=t.assigned_to.email,
@@ -332,7 +318,7 @@ class TicketForm(forms.Form):
             messages_sent_to.append(t.assigned_to.email)
 
         if q.new_ticket_cc and q.new_ticket_cc not in messages_sent_to:
-            send_templated_mail(
+            send_mail(
                 'newticket_cc',
                 context,
                 recipients=q.new_ticket_cc,
@@ -343,7 +329,7 @@ class TicketForm(forms.Form):
             messages_sent_to.append(q.new_ticket_cc)
 
         if q.updated_ticket_cc and q.updated_ticket_cc != q.new_ticket_cc and q.updated_ticket_cc not in messages_sent_to:
-            send_templated_mail(
+            send_mail(
                 'newticket_cc',
                 context,
                 recipients=q.updated_ticket_cc,
@@ -408,53 +394,12 @@ class PublicTicketForm(forms.Form):
         Add any custom fields that are defined to the form
         """
         super(PublicTicketForm, self).__init__(*args, **kwargs)
-        for field in CustomField.objects.filter(staff_only=False):
-            instanceargs = {
-                    'label': field.label,
-                    'help_text': field.help_text,
-                    'required': field.required,
-                    }
-            if field.data_type == 'varchar':
-                fieldclass = forms.CharField
-                instanceargs['max_length'] = field.max_length
-            elif field.data_type == 'text':
-                fieldclass = forms.CharField
-                instanceargs['widget'] = forms.Textarea
-                instanceargs['max_length'] = field.max_length
-            elif field.data_type == 'integer':
-                fieldclass = forms.IntegerField
-            elif field.data_type == 'decimal':
-                fieldclass = forms.DecimalField
-                instanceargs['decimal_places'] = field.decimal_places
-                instanceargs['max_digits'] = field.max_length
-            elif field.data_type == 'list':
-                fieldclass = forms.ChoiceField
-                choices = field.choices_as_array
-                if field.empty_selection_list:
-                    choices.insert(0, ('','---------' ) )
-                instanceargs['choices'] = choices
-            elif field.data_type == 'boolean':
-                fieldclass = forms.BooleanField
-            elif field.data_type == 'date':
-                fieldclass = forms.DateField
-            elif field.data_type == 'time':
-                fieldclass = forms.TimeField
-            elif field.data_type == 'datetime':
-                fieldclass = forms.DateTimeField
-            elif field.data_type == 'email':
-                fieldclass = forms.EmailField
-            elif field.data_type == 'url':
-                fieldclass = forms.URLField
-            elif field.data_type == 'ipaddress':
-                fieldclass = forms.IPAddressField
-            elif field.data_type == 'slug':
-                fieldclass = forms.SlugField
-            
-            self.fields['custom_%s' % field.name] = fieldclass(**instanceargs)
-
-    def save(self):
+        add_custom_fields(self, include_staff_only=False)
+
+    def save(self, notify=True, on_hold=False):
         """
-        Writes and returns a Ticket() object
+        Writes and returns a Ticket() object. With notify=False no e-mails
+        are sent (see notify_new_public_ticket()).
         """
 
         q = Queue.objects.get(id=int(self.cleaned_data['queue']))
@@ -468,18 +413,12 @@ class PublicTicketForm(forms.Form):
             description = self.cleaned_data['body'],
             priority = self.cleaned_data['priority'],
             due_date = self.cleaned_data['due_date'],
+            on_hold = on_hold,
             )
 
         t.save()
 
-        for field, value in self.cleaned_data.items():
-            if field.startswith('custom_'):
-                field_name = field.replace('custom_', '')
-                customfield = CustomField.objects.get(name=field_name)
-                cfv = TicketCustomFieldValue(ticket=t,
-                            field=customfield,
-                            value=value)
-                cfv.save()
+        save_custom_fields(t, self.cleaned_data)
 
         f = FollowUp(
             ticket = t,
@@ -493,59 +432,55 @@ class PublicTicketForm(forms.Form):
 
         files = []
         if self.cleaned_data['attachment']:
-            import mimetypes
             file = self.cleaned_data['attachment']
-            filename = file.name.replace(' ', '_')
-            a = Attachment(
-                followup=f,
-                filename=filename,
-                mime_type=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
-                size=file.size,
-                )
-            a.file.save(file.name, file, save=False)
-            a.save()
-            
-            if file.size < getattr(settings, 'MAX_EMAIL_ATTACHMENT_SIZE', 512000):
-                # Only files smaller than 512kb (or as defined in 
-                # settings.MAX_EMAIL_ATTACHMENT_SIZE) are sent via email.
-                files.append(a.file.path)
+            files.append(save_attachment(f, file, file.name.replace(' ', '_')))
 
-        context = safe_template_context(t)
+        if notify:
+            notify_new_public_ticket(t, files)
 
-        messages_sent_to = []
+        return t
+
+
+def notify_new_public_ticket(t, files=None):
+    """
+    Send the e-mails for a new ticket from the public form: to the
+    submitter and to the queue's CC addresses.
+    """
+    q = t.queue
+    context = safe_template_context(t)
+
+    messages_sent_to = []
 
+    send_templated_mail(
+        'newticket_submitter',
+        context,
+        recipients=t.submitter_email,
+        sender=q.from_address,
+        fail_silently=True,
+        files=files,
+        )
+    messages_sent_to.append(t.submitter_email)
+
+    if q.new_ticket_cc and q.new_ticket_cc not in messages_sent_to:
         send_templated_mail(
-            'newticket_submitter',
+            'newticket_cc',
             context,
-            recipients=t.submitter_email,
+            recipients=q.new_ticket_cc,
             sender=q.from_address,
             fail_silently=True,
             files=files,
             )
-        messages_sent_to.append(t.submitter_email)
-
-        if q.new_ticket_cc and q.new_ticket_cc not in messages_sent_to:
-            send_templated_mail(
-                'newticket_cc',
-                context,
-                recipients=q.new_ticket_cc,
-                sender=q.from_address,
-                fail_silently=True,
-                files=files,
-                )
-            messages_sent_to.append(q.new_ticket_cc)
-
-        if q.updated_ticket_cc and q.updated_ticket_cc != q.new_ticket_cc and q.updated_ticket_cc not in messages_sent_to:
-            send_templated_mail(
-                'newticket_cc',
-                context,
-                recipients=q.updated_ticket_cc,
-                sender=q.from_address,
-                fail_silently=True,
-                files=files,
-                )
+        messages_sent_to.append(q.new_ticket_cc)
 
-        return t
+    if q.updated_ticket_cc and q.updated_ticket_cc != q.new_ticket_cc and q.updated_ticket_cc not in messages_sent_to:
+        send_templated_mail(
+            'newticket_cc',
+            context,
+            recipients=q.updated_ticket_cc,
+            sender=q.from_address,
+            fail_silently=True,
+            files=files,
+            )
 
 
 class UserSettingsForm(forms.Form):
@@ -587,6 +522,14 @@ class UserSettingsForm(forms.Form):
         required=False,
         )
 
+    ticket_list_columns = forms.MultipleChoiceField(
+        label=_('Columns to show on the Ticket List'),
+        help_text=_('Which columns do you want to see on the Ticket List page? If you choose none, the usual columns are shown.'),
+        choices=[(name, description) for name, heading, description, fields in TICKET_LIST_COLUMNS],
+        required=False,
+        widget=forms.CheckboxSelectMultiple,
+        )
+
 class EmailIgnoreForm(forms.ModelForm):
     class Meta:
         model = IgnoreEmail
@@ -594,11 +537,14 @@ class EmailIgnoreForm(forms.ModelForm):
 class TicketCCForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         super(TicketCCForm, self).__init__(*args, **kwargs)
-        if helpdesk_settings.HELPDESK_STAFF_ONLY_TICKET_CC:
-            users = User.objects.filter(is_active=True, is_staff=True).order_by('username')
-        else:
-            users = User.objects.filter(is_active=True).order_by('username')
-        self.fields['user'].queryset = users 
+        staff_only = helpdesk_settings.HELPDESK_STAFF_ONLY_TICKET_CC
+        users = User.objects.filter(is_active=True)
+        if staff_only:
+            users = users.filter(is_staff=True)
+        self.fields['user'].queryset = users
+        # Render the drop-down from the cached list; the queryset above is
+        # only used to validate the submitted choice.
+        self.fields['user'].choices = [('', '---------')] + user_choices(staff_only=staff_only)
     class Meta:
         model = TicketCC
         exclude = ('ticket',)
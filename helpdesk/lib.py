@@ -20,7 +20,18 @@ except ImportError:
 import logging
 logger = logging.getLogger('helpdesk')
 
+import Queue
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import transaction
 from django.utils.encoding import smart_str
+from django.utils.translation import ugettext_lazy as _lazy
+
+# Generation counters are kept (almost) forever; 30 days is the longest
+# relative timeout memcached understands.
+GENERATION_TIMEOUT = 60 * 60 * 24 * 30
 
 def send_templated_mail(template_name, email_context, recipients, sender=None, bcc=None, fail_silently=False, files=None):
     """
@@ -45,14 +56,20 @@ def send_templated_mail(template_name, email_context, recipients, sender=None, b
     fail_silently is passed to Django's mail routine. Set to 'True' to ignore
         any errors at send time.
 
-    files can be a list of file paths to be attached, or it can be left blank.
-        eg ('/tmp/file1.txt', '/tmp/image.png')
+    files can be a list of Attachment's or file paths to be attached, or it
+        can be left blank. eg ('/tmp/file1.txt', '/tmp/image.png').
+        Attachments larger than settings.MAX_EMAIL_ATTACHMENT_SIZE are
+        listed with a link to download them rather than being attached.
 
+    With settings.HELPDESK_EMAIL_BACKGROUND on, the message is handed to a
+    background thread which reads in the attachments and sends it, so the
+    caller doesn't wait for either.
     """
     from django.conf import settings
     from django.core.mail import EmailMultiAlternatives
     from django.template import loader, Context
 
+    from helpdesk import settings as helpdesk_settings
     from helpdesk.models import EmailTemplate
     import os
 
@@ -88,6 +105,39 @@ def send_templated_mail(template_name, email_context, recipients, sender=None, b
         "%s{%% include '%s' %%}" % (t.plain_text, footer_file)
         ).render(context)
 
+    if files:
+        if type(files) != list:
+            files = [files,]
+    else:
+        files = []
+
+    max_size = getattr(settings, 'MAX_EMAIL_ATTACHMENT_SIZE', 512000)
+    attachments = []
+    linked = []
+    for file in files:
+        if isinstance(file, basestring):
+            attachments.append((os.path.basename(file), None, None, file))
+        elif file.size < max_size:
+            # Only files smaller than 512kb (or as defined in
+            # settings.MAX_EMAIL_ATTACHMENT_SIZE) are sent via email.
+            attachments.append((file.filename, file.mime_type, file.file.storage, file.file.name))
+        else:
+            linked.append(file)
+
+    if isinstance(recipients,(str,unicode)):
+        if recipients.find(','):
+            recipients = recipients.split(',')
+    elif type(recipients) != list:
+        recipients = [recipients,]
+
+    if linked:
+        from django.template.defaultfilters import filesizeformat
+        from django.utils.html import escape
+        from django.utils.translation import ugettext
+        links = [(a.filename, filesizeformat(a.size), attachment_link(a, recipients, bcc)) for a in linked]
+        heading = ugettext('These attachments were too large to send by e-mail:')
+        text_part += u'\n\n%s\n%s\n' % (heading, u'\n'.join([u'%s (%s): %s' % link for link in links]))
+
     email_html_base_file = os.path.join('helpdesk', locale, 'email_html_base.html')
 
 
@@ -103,16 +153,16 @@ def send_templated_mail(template_name, email_context, recipients, sender=None, b
         "{%% extends '%s' %%}{%% block title %%}%s{%% endblock %%}{%% block content %%}%s{%% endblock %%}" % (email_html_base_file, t.heading, t.html)
         ).render(context)
 
+    if linked:
+        html_part += u'<p>%s</p><ul>%s</ul>' % (
+            escape(heading),
+            u''.join([u"<li><a href='%s'>%s</a> (%s)</li>" % (escape(url), escape(name), size) for name, size, url in links]),
+            )
+
     subject_part = loader.get_template_from_string(
         "{{ ticket.ticket }} {{ ticket.title|safe }} %s" % t.subject
         ).render(context)
 
-    if isinstance(recipients,(str,unicode)):
-        if recipients.find(','):
-            recipients = recipients.split(',')
-    elif type(recipients) != list:
-        recipients = [recipients,]
-
     msg = EmailMultiAlternatives(   subject_part,
                                     text_part,
                                     sender,
@@ -120,16 +170,94 @@ def send_templated_mail(template_name, email_context, recipients, sender=None, b
                                     bcc=bcc)
     msg.attach_alternative(html_part, "text/html")
 
-    if files:
-        if type(files) != list:
-            files = [files,]
+    if helpdesk_settings.HELPDESK_EMAIL_BACKGROUND:
+        queue_mail(msg, attachments)
+        return len(msg.recipients())
+    return deliver_mail(msg, attachments, fail_silently)
+
+
+def attachment_link(attachment, recipients, bcc=None):
+    """
+    The link to an attachment for an e-mail to 'recipients'. Only an
+    e-mail to nobody but the ticket's submitter gets their own link, which
+    works without logging in; anybody else gets the staff link, so a
+    forwarded e-mail can't be used to read the ticket's attachments.
+    """
+    submitter = (attachment.followup.ticket.submitter_email or '').strip().lower()
+    if submitter and not bcc and [r.strip().lower() for r in recipients] == [submitter]:
+        return attachment.submitter_download_url
+    return attachment.download_url
 
-        for file in files:
-            msg.attach_file(file)
 
+def deliver_mail(msg, attachments, fail_silently=False):
+    """
+    Attach files to an EmailMessage and send it. attachments is a list of
+    (filename, mime type, storage, name) tuples; files are read from the
+    storage (or the filesystem, if storage is None) as the message is sent.
+    """
+    for filename, mime_type, storage, name in attachments:
+        if storage is None:
+            msg.attach_file(name)
+            continue
+        f = storage.open(name, 'rb')
+        try:
+            msg.attach(filename, f.read(), mime_type)
+        finally:
+            f.close()
     return msg.send(fail_silently)
 
 
+def queue_mail(msg, attachments):
+    """
+    Queue a message to be sent by deliver_mail() in the background.
+    """
+    queue_task(deliver_mail, msg, attachments)
+
+
+_task_queues = {}
+_task_queues_lock = threading.Lock()
+
+def queue_task(func, *args):
+    """
+    Queue func(*args) to be run by a background thread, starting the thread
+    the first time it is needed. Failures are logged. Anything still queued
+    when the process exits is lost, so this suits servers which keep their
+    processes running.
+    """
+    queue_task_on('tasks', func, *args)
+
+
+def queue_task_on(name, func, *args):
+    """
+    Like queue_task(), but run by the background thread for the queue
+    called 'name', so slow tasks (eg calls to outside services) can be
+    kept from holding up others (eg sending mail).
+    """
+    _task_queues_lock.acquire()
+    try:
+        task_queue = _task_queues.get(name)
+        if task_queue is None:
+            task_queue = _task_queues[name] = Queue.Queue()
+            worker = threading.Thread(target=_run_queued_tasks, args=(task_queue,), name='helpdesk-%s' % name)
+            worker.setDaemon(True)
+            worker.start()
+    finally:
+        _task_queues_lock.release()
+    task_queue.put((func, args))
+
+
+def _run_queued_tasks(task_queue):
+    from django.db import connection
+    while True:
+        func, args = task_queue.get()
+        try:
+            func(*args)
+        except Exception:
+            logger.exception('Background task %s failed' % func.__name__)
+        # Don't hold a database connection open between tasks.
+        connection.close()
+
+
 def query_to_dict(results, descriptions):
     """
     Replacement method for cursor.dictfetchall() as that method no longer
@@ -183,6 +311,95 @@ def apply_query(queryset, params):
     return queryset
 
 
+def _context_accessor(field, stringify):
+    """
+    Returns a function which reads 'field' from an object, calling it if
+    it's callable (and, if 'stringify' is set, converting the result to a
+    string).
+    """
+    def accessor(obj):
+        attr = getattr(obj, field, None)
+        if callable(attr):
+            if stringify:
+                return '%s' % attr()
+            return attr()
+        return attr
+    return accessor
+
+
+# The fields exposed by safe_template_context(), worked out once when this
+# module is loaded rather than every time a context is built.
+QUEUE_CONTEXT_FIELDS = dict([(field, _context_accessor(field, False)) for field in (
+    'title', 'slug', 'email_address', 'from_address', 'locale',
+    )])
+
+TICKET_CONTEXT_FIELDS = dict([(field, _context_accessor(field, True)) for field in (
+    'title', 'created', 'modified', 'submitter_email',
+    'status', 'get_status_display', 'on_hold', 'description',
+    'resolution', 'priority', 'get_priority_display',
+    'last_escalation', 'ticket', 'ticket_for_url',
+    'get_status', 'ticket_url', 'staff_url', '_get_assigned_to',
+    )])
+TICKET_CONTEXT_FIELDS['assigned_to'] = TICKET_CONTEXT_FIELDS['_get_assigned_to']
+
+
+class LazyContext(dict):
+    """
+    A dictionary which only works out each of its values the first time it
+    is looked up, using a table of accessor functions, and then remembers
+    it. Templates only look up the fields they actually use, so fields
+    that are expensive to build (such as ticket_url) are skipped when they
+    aren't needed.
+    """
+
+    def __init__(self, obj, accessors):
+        dict.__init__(self)
+        self._obj = obj
+        self._accessors = accessors
+
+    def __missing__(self, key):
+        if key not in self._accessors:
+            raise KeyError(key)
+        value = self._accessors[key](self._obj)
+        self[key] = value
+        return value
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self._accessors
+    has_key = __contains__
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def _resolve_all(self):
+        for key in self._accessors:
+            self[key]
+
+    def keys(self):
+        self._resolve_all()
+        return dict.keys(self)
+
+    def values(self):
+        self._resolve_all()
+        return dict.values(self)
+
+    def items(self):
+        self._resolve_all()
+        return dict.items(self)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
 def safe_template_context(ticket):
     """
     Return a dictionary that can be used as a template context to render
@@ -195,75 +412,906 @@ def safe_template_context(ticket):
     Ouch!
 
     The downside to this is that if we make changes to the model, we will also
-    have to update this code. Perhaps we can find a better way in the future.
+    have to update QUEUE_CONTEXT_FIELDS and TICKET_CONTEXT_FIELDS. Perhaps we
+    can find a better way in the future.
+
+    The 'queue' and 'ticket' entries are LazyContext dictionaries, so each
+    field is only worked out when a template first uses it.
     """
 
-    context = {
-        'queue': {},
-        'ticket': {},
+    queue_context = LazyContext(ticket.queue, QUEUE_CONTEXT_FIELDS)
+    ticket_context = LazyContext(ticket, TICKET_CONTEXT_FIELDS)
+    ticket_context['queue'] = queue_context
+
+    return {
+        'queue': queue_context,
+        'ticket': ticket_context,
         }
-    queue = ticket.queue
 
-    for field in (  'title', 'slug', 'email_address', 'from_address', 'locale'):
-        attr = getattr(queue, field, None)
-        if callable(attr):
-            context['queue'][field] = attr()
-        else:
-            context['queue'][field] = attr
-
-    for field in (  'title', 'created', 'modified', 'submitter_email',
-                    'status', 'get_status_display', 'on_hold', 'description',
-                    'resolution', 'priority', 'get_priority_display',
-                    'last_escalation', 'ticket', 'ticket_for_url',
-                    'get_status', 'ticket_url', 'staff_url', '_get_assigned_to'
-                 ):
-        attr = getattr(ticket, field, None)
-        if callable(attr):
-            context['ticket'][field] = '%s' % attr()
-        else:
-            context['ticket'][field] = attr
 
-    context['ticket']['queue'] = context['queue']
-    context['ticket']['assigned_to'] = context['ticket']['_get_assigned_to']
+# How often (in seconds) each process checks whether its URL prefixes are
+# out of date because a Site was changed, possibly by another process.
+URL_PREFIXES_CHECK_INTERVAL = 10
+
+# (the 'sites' generation they were built for, when that was last checked,
+# the prefixes). This is only ever replaced as a whole, never changed in
+# place, so other threads always see a complete set.
+_url_prefixes = (None, 0, None)
+
+
+def helpdesk_url_prefixes():
+    """
+    Returns a dictionary of the pieces needed to build ticket URL's: the
+    current Site's domain, the public ticket view and the staff ticket view
+    split either side of the ticket ID. These are worked out once per process
+    (and again after any Site is changed) so building a URL for a ticket
+    doesn't need a database query or a trip through the URL resolver.
+    """
+    global _url_prefixes
+    generation, checked, prefixes = _url_prefixes
+    now = time.time()
+    if prefixes is not None and now - checked < URL_PREFIXES_CHECK_INTERVAL:
+        return prefixes
+
+    current = get_generations(['sites'])[0]
+    if prefixes is None or current != generation:
+        from django.conf import settings
+        from django.contrib.sites.models import Site
+        from django.core.urlresolvers import reverse
+        staff_head, staff_tail = reverse('helpdesk_view', args=[0]).rsplit('0', 1)
+        prefixes = {
+            # Not get_current(), which caches the Site in each process.
+            'domain': Site.objects.get(id=settings.SITE_ID).domain,
+            'public_view': reverse('helpdesk_public_view'),
+            'staff_view': (staff_head, staff_tail),
+            }
+    _url_prefixes = (current, now, prefixes)
+    return prefixes
+
+
+def clear_url_prefixes(sender=None, **kwargs):
+    """
+    Signal handler to throw away the cached URL prefixes, eg when the Site
+    domain changes. Other processes notice within
+    URL_PREFIXES_CHECK_INTERVAL seconds.
+    """
+    global _url_prefixes
+    _url_prefixes = (None, 0, None)
+    bump_generations(['sites'])
+
 
-    return context
+def staff_ticket_path(ticket_id):
+    """
+    Equivalent to reverse('helpdesk_view', args=[ticket_id]).
+    """
+    head, tail = helpdesk_url_prefixes()['staff_view']
+    return u'%s%s%s' % (head, ticket_id, tail)
 
 
 def text_is_spam(text, request):
-    # Based on a blog post by 'sciyoshi':
-    # http://sciyoshi.com/blog/2008/aug/27/using-akismet-djangos-new-comments-framework/
-    # This will return 'True' is the given text is deemed to be spam, or
-    # False if it is not spam. If it cannot be checked for some reason, we
-    # assume it isn't spam.
-    from django.contrib.sites.models import Site
-    from django.conf import settings
+    """
+    Returns True if the given text, submitted with the given request, is
+    deemed to be spam, or False if it is not, using the spam backend in
+    settings.HELPDESK_SPAM_BACKEND. If it cannot be checked for some reason
+    (eg no API key is set, or the spam service can't be reached in time),
+    we assume it isn't spam.
+    """
+    from helpdesk.spam import get_spam_service, request_data, SpamCheckError
+    service = get_spam_service()
+    if service is None:
+        return False
     try:
-        from helpdesk.akismet import Akismet
-    except:
+        return service.is_spam(text, request_data(request))
+    except SpamCheckError, e:
+        logger.warning('Could not check for spam: %s' % e)
         return False
 
-    ak = Akismet(
-        blog_url='http://%s/' % Site.objects.get(pk=settings.SITE_ID).domain,
-        agent='django-helpdesk',
-    )
 
-    if hasattr(settings, 'TYPEPAD_ANTISPAM_API_KEY'):
-        ak.setAPIKey(key = settings.TYPEPAD_ANTISPAM_API_KEY)
-        ak.baseurl = 'api.antispam.typepad.com/1.1/'
-    elif hasattr(settings, 'AKISMET_API_KEY'):
-        ak.setAPIKey(key = settings.AKISMET_API_KEY)
+def _generation_key(name):
+    return 'helpdesk:generation:%s' % name
+
+
+def _new_generation():
+    # Seed counters from the clock so that a counter which has been evicted
+    # from the cache never restarts at a value that was already handed out.
+    return int(time.time() * 1000)
+
+
+def get_generations(names):
+    """
+    Return the current value of each named generation counter, as a list in
+    the same order as 'names'. Counters which don't exist yet are created.
+
+    A generation counter is bumped whenever the data it covers is written
+    to, so any cache key built from it is automatically invalidated. We use:
+        tickets: any ticket at all
+        queue:<id>: tickets in (or moved out of) one queue
+        assignee:<id>: tickets assigned to (or away from) one user, or
+            'assignee:none' for unassigned tickets
+        queues: any queue
+        users: any user
+        followups: any followup, change or attachment
+        followup:<id>: one followup, its changes and its attachments
+        api_tokens: any API token
+        blocking:<id>: one ticket's blocked flag, bumped when its
+            dependencies change or a ticket it depends on (directly or
+            not) changes between open and not open
+        blocking: any ticket's blocked flag
+        saved_searches: any saved search
+        user_settings:<id>: one user's UserSettings
+        sites: any Site (whose domain is used in ticket URL's)
+    """
+    keys = [_generation_key(name) for name in names]
+    values = cache.get_many(keys)
+    # Missing counters are all seeded in one round trip, from the clock, as
+    # _bump_generations() does for a counter that has been evicted.
+    seed = _new_generation()
+    missing = dict([(key, seed) for key in keys if values.get(key) is None])
+    if missing:
+        cache.set_many(missing, GENERATION_TIMEOUT)
+        values.update(missing)
+    return [values[key] for key in keys]
+
+
+def bump_generations(names):
+    """
+    Increment each named generation counter, invalidating everything that
+    was cached against its previous value.
+
+    Inside a transaction the counters are bumped again once it commits:
+    until then other requests still see the old data, and anything they
+    cache in the meantime would otherwise outlive the change.
+    """
+    _bump_generations(names)
+    if _in_transaction():
+        on_commit(_bump_generations, names)
+
+
+def _bump_generations(names):
+    for name in names:
+        key = _generation_key(name)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Not in the cache (yet, or any more).
+            cache.set(key, _new_generation(), GENERATION_TIMEOUT)
+
+
+_commit_hooks = threading.local()
+
+def _in_transaction():
+    from django.db import transaction
+    return transaction.is_managed()
+
+
+def on_commit(func, *args):
+    """
+    Call func(*args) once the changes made so far have been committed.
+
+    Outside a managed transaction Django commits each change as it is
+    made, so func is called straight away. Otherwise it is queued until
+    run_commit_hooks() is called: when the request finishes (after
+    TransactionMiddleware has committed), or by code which commits a
+    transaction of its own. Hooks queued by a request that raises an
+    exception are dropped along with its changes.
+    """
+    if not _in_transaction():
+        func(*args)
+        return
+    hooks = getattr(_commit_hooks, 'hooks', None)
+    if hooks is None:
+        hooks = _commit_hooks.hooks = []
+    hooks.append((func, args))
+
+
+def commit_hooks_mark():
+    """
+    The number of commit hooks queued so far, to pass to
+    discard_commit_hooks() if a savepoint is rolled back.
+    """
+    return len(getattr(_commit_hooks, 'hooks', None) or ())
+
+
+def discard_commit_hooks(mark=0):
+    """
+    Drop the commit hooks queued since commit_hooks_mark() returned 'mark'
+    (or all of them), as their changes have been rolled back.
+    """
+    hooks = getattr(_commit_hooks, 'hooks', None)
+    if hooks:
+        del hooks[mark:]
+
+
+def run_commit_hooks():
+    """
+    Call the commit hooks queued by on_commit(), now that their changes
+    have been committed, returning how many there were. An error in one
+    hook is logged and doesn't stop the others.
+    """
+    hooks = getattr(_commit_hooks, 'hooks', None) or []
+    _commit_hooks.hooks = []
+    for func, args in hooks:
+        try:
+            func(*args)
+        except Exception:
+            logger.exception('Error in helpdesk commit hook %s' % getattr(func, '__name__', func))
+    return len(hooks)
+
+
+def saved_search_ticket_ids(saved_search, query_params, queryset):
+    """
+    Return the ordered list of ticket ID's matched by a saved search, using a
+    cached copy where possible. 'queryset' should already have the query
+    applied to it (see apply_query()).
+
+    The cache key contains the generation counters of every queue the search
+    is restricted to (or of all tickets, if it isn't restricted by queue) so
+    any ticket write to an affected queue invalidates it.
+
+    Returns None if result caching is disabled or the result set is too big
+    to be worth caching; the caller should then use the queryset directly.
+    """
+    from django.utils.hashcompat import md5_constructor
+    from helpdesk import settings as helpdesk_settings
+
+    timeout = helpdesk_settings.HELPDESK_SAVED_SEARCH_CACHE_TIMEOUT
+    max_results = helpdesk_settings.HELPDESK_SAVED_SEARCH_CACHE_MAX_RESULTS
+    if not timeout:
+        return None
+
+    queue_ids = query_params.get('filtering', {}).get('queue__id__in', None)
+    if queue_ids:
+        generation_names = ['queue:%s' % q for q in sorted(queue_ids)]
     else:
-        return False
+        generation_names = ['tickets']
+
+    signature = md5_constructor('%s|%s|%s|%s' % (
+        saved_search.query,
+        query_params.get('sorting', None),
+        query_params.get('sortreverse', None),
+        get_generations(generation_names),
+        )).hexdigest()
+    key = 'helpdesk:saved_search:%s:%s' % (saved_search.id, signature)
 
-    if ak.verify_key():
-        ak_data = {
-            'user_ip': request.META.get('REMOTE_ADDR', '127.0.0.1'),
-            'user_agent': request.META.get('HTTP_USER_AGENT', ''),
-            'referrer': request.META.get('HTTP_REFERER', ''),
-            'comment_type': 'comment',
-            'comment_author': '',
+    ticket_ids = cache.get(key)
+    if ticket_ids is None:
+        ticket_ids = list(queryset.values_list('id', flat=True)[:max_results + 1])
+        if len(ticket_ids) > max_results:
+            return None
+        cache.set(key, ticket_ids, timeout)
+
+    return ticket_ids
+
+
+def hydrate_tickets(queryset, ticket_ids):
+    """
+    Load the tickets with the given ID's in a single query, returning them in
+    the same order as 'ticket_ids'. Tickets that have since been deleted are
+    silently skipped.
+    """
+    tickets = queryset.in_bulk(ticket_ids)
+    return [tickets[i] for i in ticket_ids if i in tickets]
+
+
+# The columns which can be shown on the ticket list, in the order they are
+# shown. Each is (name, heading, description, the Ticket fields it needs);
+# only those fields are loaded for the columns a user has chosen to see
+# (see ticket_list_queryset), so the large description and resolution text
+# is never read just to draw the list.
+TICKET_LIST_COLUMNS = (
+    ('priority', _lazy('Pr'), _lazy('Priority'), ('priority',)),
+    ('title', _lazy('Title'), _lazy('Title'), ('title',)),
+    ('queue', _lazy('Queue'), _lazy('Queue'), ('queue__title',)),
+    ('status', _lazy('Status'), _lazy('Status'), ('status', 'on_hold')),
+    ('created', _lazy('Created'), _lazy('Created'), ('created',)),
+    ('modified', _lazy('Last Update'), _lazy('Last Update'), ('modified',)),
+    ('submitter', _lazy('Submitter'), _lazy('Submitter E-Mail'), ('submitter_email',)),
+    ('assigned_to', _lazy('Owner'), _lazy('Owner'), ('assigned_to', 'assigned_to__username', 'assigned_to__first_name', 'assigned_to__last_name')),
+    )
+
+DEFAULT_TICKET_LIST_COLUMNS = ('priority', 'title', 'queue', 'status', 'created', 'assigned_to')
+
+# Every row links to its ticket, which needs the ID and queue slug.
+TICKET_LIST_REQUIRED_FIELDS = ('id', 'queue', 'queue__slug')
+
+
+def ticket_list_columns(user_settings):
+    """
+    The (name, heading) of each column a user has chosen to see on the
+    ticket list, or of the default columns if they haven't chosen any.
+    """
+    chosen = user_settings.get('ticket_list_columns') or DEFAULT_TICKET_LIST_COLUMNS
+    return [(name, heading) for name, heading, description, fields in TICKET_LIST_COLUMNS if name in chosen]
+
+
+def ticket_list_queryset(columns):
+    """
+    Tickets with just the fields needed to show the given columns (as
+    returned by ticket_list_columns) loaded, and only the related tables
+    those columns use joined in.
+    """
+    from helpdesk.models import Ticket
+    from helpdesk.settings import HAS_TAG_SUPPORT
+
+    names = [name for name, heading in columns]
+    fields = list(TICKET_LIST_REQUIRED_FIELDS)
+    for name, heading, description, column_fields in TICKET_LIST_COLUMNS:
+        if name in names:
+            fields.extend(column_fields)
+    if HAS_TAG_SUPPORT:
+        # Deferring the tags would hide the TagField's own descriptor.
+        fields.append('tags')
+
+    related = ['queue']
+    if 'assigned_to' in names:
+        related.append('assigned_to')
+    return Ticket.objects.select_related(*related).only(*fields)
+
+
+CUSTOM_FIELD_SPECS_KEY = 'helpdesk:custom_field_specs'
+
+def custom_field_specs():
+    """
+    Return a list of dictionaries describing each CustomField, in display
+    order, with everything needed to build a form field for it. The list is
+    cached until a CustomField is changed (see clear_custom_field_specs).
+    """
+    specs = cache.get(CUSTOM_FIELD_SPECS_KEY)
+    if specs is None:
+        from helpdesk.models import CustomField
+        specs = []
+        for field in CustomField.objects.all():
+            choices = None
+            if field.data_type == 'list':
+                choices = field.choices_as_array
+                if field.empty_selection_list:
+                    choices.insert(0, ('','---------' ) )
+            specs.append({
+                'id': field.id,
+                'name': field.name,
+                'label': field.label,
+                'help_text': field.help_text,
+                'required': field.required,
+                'staff_only': field.staff_only,
+                'data_type': field.data_type,
+                'max_length': field.max_length,
+                'decimal_places': field.decimal_places,
+                'choices': choices,
+                })
+        cache.set(CUSTOM_FIELD_SPECS_KEY, specs, GENERATION_TIMEOUT)
+    return specs
+
+
+def clear_custom_field_specs(sender=None, **kwargs):
+    cache.delete(CUSTOM_FIELD_SPECS_KEY)
+
+
+def queue_choices(public_only=False):
+    """
+    Return a list of (id, title) pairs for every queue (or only those which
+    allow public submission), for use as form choices. The list is cached
+    until a queue is changed.
+    """
+    generation = get_generations(['queues'])[0]
+    key = 'helpdesk:queue_choices:%s:%s' % (int(bool(public_only)), generation)
+    choices = cache.get(key)
+    if choices is None:
+        from helpdesk.models import Queue
+        queues = Queue.objects.all()
+        if public_only:
+            queues = queues.filter(allow_public_submission=True)
+        choices = list(queues.values_list('id', 'title'))
+        cache.set(key, choices, GENERATION_TIMEOUT)
+    return choices
+
+
+def user_choices(staff_only=False):
+    """
+    Return a list of (id, username) pairs for every active user (or only
+    active staff users), ordered by username, for use as form choices. The
+    list is cached until a user is changed.
+    """
+    generation = get_generations(['users'])[0]
+    key = 'helpdesk:user_choices:%s:%s' % (int(bool(staff_only)), generation)
+    choices = cache.get(key)
+    if choices is None:
+        from django.contrib.auth.models import User
+        users = User.objects.filter(is_active=True)
+        if staff_only:
+            users = users.filter(is_staff=True)
+        choices = list(users.order_by('username').values_list('id', 'username'))
+        cache.set(key, choices, GENERATION_TIMEOUT)
+    return choices
+
+
+def navigation_context(user):
+    """
+    Return the parts of the staff navigation bar which come from the
+    database, for one user, as a dictionary:
+        saved_queries: a dictionary (id, title, shared, user_id and
+            username) for each of the user's own saved queries and each
+            shared one
+        open_tickets: the number of open tickets assigned to the user, or
+            None if settings.HELPDESK_NAVIGATION_STATS_ENABLED is off
+
+    The navigation bar is on every staff page, so both are cached: the
+    saved queries until any saved query (or user) changes, the count until
+    a ticket assigned to the user changes.
+    """
+    from helpdesk import settings as helpdesk_settings
+
+    stats = helpdesk_settings.HELPDESK_NAVIGATION_STATS_ENABLED
+    searches_generation, users_generation, assignee_generation = get_generations(
+        ['saved_searches', 'users', 'assignee:%s' % user.id])
+    queries_key = 'helpdesk:navigation_queries:%s:%s:%s' % (user.id, searches_generation, users_generation)
+    count_key = 'helpdesk:navigation_open_tickets:%s:%s' % (user.id, assignee_generation)
+    values = cache.get_many([queries_key, count_key])
+
+    saved_queries = values.get(queries_key)
+    if saved_queries is None:
+        from django.db.models import Q
+        from helpdesk.models import SavedSearch
+        saved_queries = [{
+                'id': id,
+                'title': title,
+                'shared': shared,
+                'user_id': user_id,
+                'username': username,
+            } for id, title, shared, user_id, username in SavedSearch.objects.filter(
+                Q(user=user) | Q(shared__exact=True),
+            ).values_list('id', 'title', 'shared', 'user', 'user__username')]
+        cache.set(queries_key, saved_queries, GENERATION_TIMEOUT)
+
+    open_tickets = None
+    if stats:
+        open_tickets = values.get(count_key)
+        if open_tickets is None:
+            from helpdesk.models import Ticket
+            open_tickets = Ticket.objects.filter(assigned_to=user, status__in=OPEN_STATUSES).count()
+            cache.set(count_key, open_tickets, GENERATION_TIMEOUT)
+
+    return {
+        'saved_queries': saved_queries,
+        'open_tickets': open_tickets,
         }
 
-        return ak.comment_check(smart_str(text), data=ak_data)
 
+def followup_fragments(followups):
+    """
+    Return a dictionary mapping the ID of each of the given FollowUp's to the
+    parts of its display that don't depend on who is looking at it:
+        comment: the escaped, urlized comment with line breaks (num_to_link
+            isn't applied, as the status of linked tickets changes)
+        changes: a list of 'Changed x from y to z.' descriptions
+        attachments: a list of dictionaries describing each attachment
+
+    Fragments are cached against a per-followup generation counter, which
+    is bumped whenever the followup, its changes or its attachments are
+    saved or deleted, so rendering a long ticket is mostly cache reads.
+    Anything not in the cache is built with one query for all of the
+    changes and one for all of the attachments.
+    """
+    from django.template.defaultfilters import force_escape, urlizetrunc, linebreaksbr
+    from django.utils.html import escape
+    from django.utils.translation import get_language, ugettext
+    from helpdesk import settings as helpdesk_settings
+    from helpdesk.models import TicketChange, Attachment
+
+    if not followups:
+        return {}
+
+    timeout = helpdesk_settings.HELPDESK_FOLLOWUP_CACHE_TIMEOUT
+    fragments = {}
+    keys = {}
+    if timeout:
+        ids = [f.id for f in followups]
+        language = get_language()
+        generations = get_generations(['followup:%s' % i for i in ids])
+        keys = dict([(i, 'helpdesk:followup_fragment:%s:%s:%s' % (i, g, language)) for i, g in zip(ids, generations)])
+        cached = cache.get_many(keys.values())
+        for i, key in keys.items():
+            if key in cached:
+                fragments[i] = cached[key]
+
+    missing = [f for f in followups if f.id not in fragments]
+    if not missing:
+        return fragments
+    missing_ids = [f.id for f in missing]
+
+    changes = {}
+    for change in TicketChange.objects.filter(followup__in=missing_ids).order_by('id'):
+        changes.setdefault(change.followup_id, []).append(
+            ugettext('Changed %(field)s from %(old_value)s to %(new_value)s.') % {
+                'field': escape(change.field),
+                'old_value': escape(change.old_value),
+                'new_value': escape(change.new_value),
+                })
+
+    attachments = {}
+    for attachment in Attachment.objects.filter(followup__in=missing_ids).order_by('id'):
+        attachments.setdefault(attachment.followup_id, []).append({
+            'id': attachment.id,
+            'filename': attachment.filename,
+            'mime_type': attachment.mime_type,
+            'size': attachment.size,
+            })
+
+    new_fragments = {}
+    for followup in missing:
+        comment = u''
+        if followup.comment:
+            comment = linebreaksbr(urlizetrunc(force_escape(followup.comment), 50, autoescape=True), autoescape=True)
+        fragments[followup.id] = {
+            'comment': u'%s' % comment,
+            'changes': changes.get(followup.id, []),
+            'attachments': attachments.get(followup.id, []),
+            }
+        if timeout:
+            new_fragments[keys[followup.id]] = fragments[followup.id]
+
+    if new_fragments:
+        cache.set_many(new_fragments, timeout)
+
+    return fragments
+
+
+# How long (in seconds) a staff page can be served from the browser's cache
+# with its relative times ("5 minutes ago") unchanged.
+ETAG_TIME_BUCKET = 60
+
+# The generation counters covering the parts of every staff page other than
+# its tickets: the navigation bar, and the queues, owners and blocked flags
+# shown against tickets.
+STAFF_PAGE_GENERATIONS = ('queues', 'users', 'saved_searches', 'blocking', 'sites')
+
+def ticket_generations(queue_ids=None):
+    """
+    The names of the generation counters covering the tickets in the given
+    queues, or all tickets if no queues are given (see get_generations).
+    """
+    if queue_ids:
+        return ['queue:%s' % q for q in queue_ids]
+    return ['tickets']
+
+
+def messages_pending(request):
+    """
+    True if the user has messages waiting to be shown on the next page
+    they see, either from django.contrib.messages or the older
+    user.message_set.
+    """
+    storage = getattr(request, '_messages', None)
+    if storage is not None:
+        # len() doesn't mark the messages as seen, as iterating would.
+        return len(storage) > 0
+    user = getattr(request, 'user', None)
+    return bool(user and user.is_authenticated() and user.message_set.exists())
+
+
+def data_etag(request, generation_names):
+    """
+    An ETag for a response built from the helpdesk data covered by the
+    named generation counters (see get_generations), so that it only
+    changes when that data does. It covers everything else a response
+    depends on too: the user, the URL (including the query string), the
+    language and the CSRF token in any forms.
+
+    Responses show times relative to now ("5 minutes ago"), so the ETag also
+    changes every ETAG_TIME_BUCKET seconds.
+    """
+    from django.conf import settings
+    from django.utils.hashcompat import md5_constructor
+    from django.utils.translation import get_language
+    return md5_constructor('%s|%s|%s|%s|%s|%s' % (
+        ':'.join([str(g) for g in get_generations(generation_names)]),
+        int(time.time() // ETAG_TIME_BUCKET),
+        request.user.id,
+        smart_str(request.get_full_path()),
+        get_language(),
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+        )).hexdigest()
+
+
+def staff_page_etag(request, *args, **kwargs):
+    """
+    An ETag for use with django.views.decorators.http.condition on staff
+    pages, so that browsers refreshing them get a '304 Not Modified'
+    without the page being rebuilt until the tickets shown on them, or the
+    user's own settings, change. A page limited to some queues (by 'queue'
+    parameters, as on the ticket list) only changes with the tickets in
+    those queues.
+
+    Pages show any messages waiting for the user, and a 304 would leave
+    them unseen, so those pages get no ETag at all.
+    """
+    if messages_pending(request):
+        return None
+    try:
+        queue_ids = [int(q) for q in request.GET.getlist('queue')]
+    except ValueError:
+        queue_ids = None
+    return data_etag(request,
+        ticket_generations(queue_ids) +
+        list(STAFF_PAGE_GENERATIONS) +
+        ['user_settings:%s' % request.user.id])
+
+
+def save_attachment(followup, file, filename, mime_type=None):
+    """
+    Attach 'file' (an uploaded file or other Django File) to a followup as
+    'filename', returning the new Attachment. If the MIME type isn't given
+    it's guessed from the filename.
+
+    With settings.HELPDESK_ATTACHMENT_DEDUPLICATION on, the contents are
+    stored as an AttachmentBlob shared by every attachment with the same
+    contents, rather than being saved again for each one.
+    """
+    import mimetypes
+    from helpdesk import settings as helpdesk_settings
+    from helpdesk.models import Attachment, AttachmentBlob
+
+    if mime_type is None:
+        mime_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    a = Attachment(
+        followup=followup,
+        filename=filename,
+        mime_type=mime_type,
+        size=file.size,
+        )
+    if helpdesk_settings.HELPDESK_ATTACHMENT_DEDUPLICATION:
+        a.blob = AttachmentBlob.objects.store(file)
+        a.file = a.blob.file.name
+    else:
+        a.file.save(filename, file, save=False)
+    a.save()
+    return a
+
+
+OPEN_STATUSES = (1, 2) # Ticket.OPEN_STATUS, Ticket.REOPENED_STATUS
+
+def blocked_ticket_ids(ticket_ids):
+    """
+    Returns the set of the given tickets which can't be resolved yet,
+    because a ticket they depend on (directly, or through other tickets)
+    is still open.
+
+    Each ticket's flag is cached against its own 'blocking:<id>' generation,
+    which is bumped when its dependencies change, or a ticket it depends on
+    is opened or resolved (see dependent_ticket_ids()). Flags which aren't
+    in the cache are worked out together, a level of dependencies at a
+    time.
+    """
+    from helpdesk.models import TicketDependency
+
+    ticket_ids = list(set(ticket_ids))
+    if not ticket_ids:
+        return set()
+    generations = get_generations(['blocking:%s' % t for t in ticket_ids])
+    keys = dict([(t, 'helpdesk:blocked:%s:%s' % (t, g)) for t, g in zip(ticket_ids, generations)])
+    cached = cache.get_many(keys.values())
+    blocked = set([t for t in ticket_ids if cached.get(keys[t])])
+    missing = [t for t in ticket_ids if keys[t] not in cached]
+    if not missing:
+        return blocked
+
+    # roots maps each ticket reached so far to the missing tickets which
+    # depend on it; pending holds those still to be followed further.
+    roots = dict([(t, set([t])) for t in missing])
+    pending = dict(roots)
+    found = set()
+    while pending:
+        reached = {}
+        for ticket_id, depends_on_id, status in TicketDependency.objects.filter(
+                ticket__in=pending.keys()).values_list('ticket', 'depends_on', 'depends_on__status'):
+            from_roots = pending[ticket_id] - found
+            if status in OPEN_STATUSES:
+                found.update(from_roots)
+            else:
+                reached.setdefault(depends_on_id, set()).update(from_roots)
+        pending = {}
+        for ticket_id, from_roots in reached.items():
+            new_roots = from_roots - found - roots.setdefault(ticket_id, set())
+            if new_roots:
+                roots[ticket_id].update(new_roots)
+                pending[ticket_id] = new_roots
+
+    cache.set_many(dict([(keys[t], t in found) for t in missing]), GENERATION_TIMEOUT)
+    return blocked | found
+
+
+def dependent_ticket_ids(ticket_id):
+    """
+    Returns the set of ID's of the tickets which depend on ticket_id,
+    directly or through other tickets: those whose blocked flags (see
+    blocked_ticket_ids()) change when it is opened or resolved.
+    """
+    from helpdesk.models import TicketDependency
+    seen = set()
+    frontier = set([ticket_id])
+    while frontier:
+        frontier = set(TicketDependency.objects.filter(
+            depends_on__in=frontier).values_list('ticket', flat=True)) - seen
+        seen.update(frontier)
+    return seen
+
+
+def _for_update():
+    """
+    The clause which locks the rows a SELECT reads until the end of the
+    transaction, or '' on databases without row locks (SQLite).
+    """
+    from django.db import connection
+    if connection.vendor in ('postgresql', 'mysql', 'oracle'):
+        return ' FOR UPDATE'
+    return ''
+
+
+def _lock_tickets(ticket_ids):
+    """
+    Lock the given tickets' rows until the end of the transaction.
+    """
+    from django.db import connection
+    from helpdesk.models import Ticket
+    if not _for_update():
+        return
+    qn = connection.ops.quote_name
+    connection.cursor().execute('SELECT %s FROM %s WHERE %s IN (%s)%s' % (
+        qn('id'), qn(Ticket._meta.db_table), qn('id'),
+        ', '.join(['%s'] * len(ticket_ids)), _for_update()), ticket_ids)
+
+
+def _locked_dependencies(ticket_ids):
+    """
+    Lock the given tickets, and return the ID's of the tickets they depend
+    on, including any dependencies committed by whoever held those locks
+    before us.
+    """
+    from django.db import connection
+    from helpdesk.models import TicketDependency
+    _lock_tickets(ticket_ids)
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    # A locking read, so that MySQL reads the latest rows rather than the
+    # transaction's snapshot.
+    cursor.execute('SELECT %s FROM %s WHERE %s IN (%s)%s' % (
+        qn('depends_on_id'), qn(TicketDependency._meta.db_table), qn('ticket_id'),
+        ', '.join(['%s'] * len(ticket_ids)), _for_update()), ticket_ids)
+    return [row[0] for row in cursor.fetchall()]
+
+
+def creates_dependency_cycle(ticket_id, depends_on_id):
+    """
+    Returns True if making ticket_id depend on depends_on_id would create a
+    cycle, ie depends_on_id already depends (directly or through other
+    tickets) on ticket_id, or they are the same ticket.
+
+    This reads the dependencies from the database, a level at a time,
+    locking each ticket whose dependencies it reads (see
+    add_ticket_dependency()).
+    """
+    seen = set([depends_on_id])
+    frontier = [depends_on_id]
+    while frontier:
+        if ticket_id in frontier:
+            return True
+        frontier = [t for t in _locked_dependencies(frontier) if t not in seen]
+        seen.update(frontier)
     return False
+
+
+def add_ticket_dependency(dependency):
+    """
+    Save a new TicketDependency unless it would create a cycle, returning
+    True if it was saved. This runs in the current transaction, or in one
+    of its own if there isn't one, and never commits anybody else's work.
+
+    Two dependencies added at the same time could each be fine on their
+    own but make a cycle together. So the ticket gaining the dependency is
+    locked before it is saved, and the check then locks every ticket whose
+    dependencies it reads. If two new dependencies would close a cycle,
+    one check reaches the ticket the other has locked, and waits to see
+    the other's dependency once it has committed. (SQLite has no row locks,
+    but lets only one transaction write at a time, which it holds from the
+    save until the end of the transaction.) A dependency which closes a
+    cycle is deleted again before the transaction ends, so nobody else
+    ever sees it.
+    """
+    if transaction.is_managed():
+        return _add_ticket_dependency(dependency)
+    return _add_ticket_dependency_in_transaction(dependency)
+
+
+def _add_ticket_dependency(dependency):
+    if dependency.ticket_id == dependency.depends_on_id:
+        return False
+    _lock_tickets([dependency.ticket_id])
+    dependency.save()
+    if creates_dependency_cycle(dependency.ticket_id, dependency.depends_on_id):
+        dependency.delete()
+        return False
+    return True
+_add_ticket_dependency_in_transaction = transaction.commit_on_success(_add_ticket_dependency)
+
+
+def _kb_vote_keys(item_id):
+    return ('helpdesk:kb_votes:%s' % item_id, 'helpdesk:kb_recommendations:%s' % item_id)
+
+
+def _cache_increment(key):
+    cache.add(key, 0, GENERATION_TIMEOUT)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Dropped from the cache since it was added.
+        cache.set(key, 1, GENERATION_TIMEOUT)
+
+
+def record_kb_vote(item_id, recommended):
+    """
+    Count a vote for a knowledgebase item. The counts are added to in the
+    database with a single UPDATE, so no votes are lost when two people
+    vote at once and the rest of the row isn't rewritten. With
+    settings.HELPDESK_KB_VOTE_BUFFER, votes are instead added up in the
+    cache until flush_kb_votes() writes them to the database.
+    """
+    from helpdesk import settings as helpdesk_settings
+
+    if helpdesk_settings.HELPDESK_KB_VOTE_BUFFER:
+        votes_key, recommendations_key = _kb_vote_keys(item_id)
+        _cache_increment(votes_key)
+        if recommended:
+            _cache_increment(recommendations_key)
+    else:
+        from django.db.models import F
+        from helpdesk.models import KBItem
+        KBItem.objects.filter(id=item_id).update(
+            votes=F('votes') + 1,
+            recommendations=F('recommendations') + (recommended and 1 or 0),
+            )
+
+
+def flush_kb_votes(batch_size=500):
+    """
+    Write the knowledgebase votes buffered in the cache (see
+    record_kb_vote) to the database, looking up the counts for
+    'batch_size' items at a time. Returns the number of votes written.
+
+    Each count is taken off in the cache by the number written rather than
+    being reset, so votes cast while this runs are kept for the next flush.
+    The cache is only changed once an item's UPDATE has been committed, so
+    a failure never loses votes; a crash between the two can count them
+    twice, though.
+    """
+    from helpdesk.models import KBItem
+
+    item_ids = list(KBItem.objects.values_list('id', flat=True))
+    total = 0
+    for start in range(0, len(item_ids), batch_size):
+        keys = dict([(item_id, _kb_vote_keys(item_id)) for item_id in item_ids[start:start + batch_size]])
+        counts = cache.get_many([key for pair in keys.values() for key in pair])
+        for item_id, (votes_key, recommendations_key) in keys.items():
+            votes = int(counts.get(votes_key) or 0)
+            recommendations = int(counts.get(recommendations_key) or 0)
+            if not (votes or recommendations):
+                continue
+            _write_kb_votes(item_id, votes, recommendations)
+            for key, count in ((votes_key, votes), (recommendations_key, recommendations)):
+                if count:
+                    try:
+                        cache.decr(key, count)
+                    except ValueError:
+                        # Dropped from the cache since we read it.
+                        pass
+            total += votes
+    return total
+
+
+def _write_kb_votes(item_id, votes, recommendations):
+    from django.db.models import F
+    from helpdesk.models import KBItem
+    KBItem.objects.filter(id=item_id).update(
+        votes=F('votes') + votes,
+        recommendations=F('recommendations') + recommendations,
+        )
+_write_kb_votes = transaction.commit_on_success(_write_kb_votes)
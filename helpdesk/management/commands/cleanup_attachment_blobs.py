@@ -0,0 +1,61 @@
+#!/usr/bin/python
+"""
+django-helpdesk - A Django powered ticket tracker for small enterprise.
+
+See LICENSE for details.
+
+cleanup_attachment_blobs.py - Delete deduplicated attachment contents (see
+                              models.AttachmentBlob) that no attachment
+                              refers to any more. Designed to be run from
+                              cron or similar.
+"""
+
+from datetime import datetime, timedelta
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from helpdesk.models import AttachmentBlob
+
+
+class Command(BaseCommand):
+    "cleanup_attachment_blobs command"
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--min-age',
+            type='int',
+            default=24,
+            help='Only delete blobs not stored for at least this many hours, '
+                 'so uploads still being saved are left alone (default: 24)'),
+        make_option(
+            '--dry-run',
+            action='store_true',
+            default=False,
+            help='List the blobs that would be deleted without deleting them'),
+        )
+    help = 'Delete attachment blobs which no attachment refers to.'
+
+    def handle(self, *args, **options):
+        "handle command line"
+        if options['min_age'] < 0:
+            raise CommandError('--min-age cannot be negative')
+
+        before = datetime.now() - timedelta(hours=options['min_age'])
+        count = 0
+        size = 0
+        for blob in AttachmentBlob.objects.unused(before).iterator():
+            if int(options['verbosity']) > 1:
+                self.stdout.write('%s\n' % blob.file.name)
+            if not options['dry_run']:
+                # The blob may have been stored again for a new attachment
+                # since it was listed, so only delete it if it is still
+                # unused, and only delete the file if the row went.
+                if not AttachmentBlob.objects.delete_if_unused(blob, before):
+                    continue
+                blob.file.delete(save=False)
+            count += 1
+            size += blob.size
+
+        self.stdout.write('%s blobs (%s bytes) %s.\n' % (
+            count, size, options['dry_run'] and 'would be deleted' or 'deleted'))
@@ -0,0 +1,35 @@
+#!/usr/bin/python
+"""
+django-helpdesk - A Django powered ticket tracker for small enterprise.
+
+See LICENSE for details.
+
+create_api_token.py - Create a token that lets a user call the JSON API
+                      (api/v2/) without sending their password.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+
+from helpdesk.models import APIToken
+
+class Command(BaseCommand):
+    "create_api_token command"
+
+    args = '<username> <token name>'
+    help = ('Create an API token for the given user and print it. The '
+            'token is only stored in hashed form, so it cannot be shown '
+            'again later.')
+
+    def handle(self, *args, **options):
+        "handle command line"
+        if len(args) < 2:
+            raise CommandError('Usage: create_api_token %s' % self.args)
+
+        try:
+            user = User.objects.get(username=args[0])
+        except User.DoesNotExist:
+            raise CommandError('No such user: %s' % args[0])
+
+        token, key = APIToken.create_token(user, ' '.join(args[1:]))
+        self.stdout.write('%s\n' % key)
@@ -0,0 +1,38 @@
+#!/usr/bin/python
+"""
+django-helpdesk - A Django powered ticket tracker for small enterprise.
+
+See LICENSE for details.
+
+flush_kb_votes.py - Write the knowledgebase votes added up in the cache
+                    (when settings.HELPDESK_KB_VOTE_BUFFER is on) to the
+                    database. Designed to be run from cron or similar.
+"""
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from helpdesk.lib import flush_kb_votes
+
+
+class Command(BaseCommand):
+    "flush_kb_votes command"
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--batch-size',
+            type='int',
+            default=500,
+            help='How many items to look up votes for at a time (default: 500)'),
+        )
+    help = 'Write buffered knowledgebase votes to the database.'
+
+    def handle(self, *args, **options):
+        "handle command line"
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        count = flush_kb_votes(options['batch_size'])
+        if int(options['verbosity']) > 0:
+            self.stdout.write('%s votes written.\n' % count)
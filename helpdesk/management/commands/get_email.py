@@ -27,7 +27,7 @@ from django.db.models import Q
 from django.utils.translation import ugettext as _
 from django.conf import settings
 
-from helpdesk.lib import send_templated_mail, safe_template_context
+from helpdesk.lib import send_templated_mail, safe_template_context, save_attachment
 from helpdesk.models import Queue, Ticket, FollowUp, Attachment, IgnoreEmail
 
 
@@ -327,14 +327,7 @@ def ticket_from_message(message, queue, quiet):
         if file['content']:
             filename = file['filename'].encode('ascii', 'replace').replace(' ', '_')
             filename = re.sub('[^a-zA-Z0-9._-]+', '', filename)
-            a = Attachment(
-                followup=f,
-                filename=filename,
-                mime_type=file['type'],
-                size=len(file['content']),
-                )
-            a.file.save(filename, ContentFile(file['content']), save=False)
-            a.save()
+            save_attachment(f, ContentFile(file['content']), filename, file['type'])
             if not quiet:
                 print "    - %s" % filename
 
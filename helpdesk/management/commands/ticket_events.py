@@ -0,0 +1,51 @@
+#!/usr/bin/python
+"""
+django-helpdesk - A Django powered ticket tracker for small enterprise.
+
+See LICENSE for details.
+
+ticket_events.py - Print the ticket events logged by the DatabaseBroker
+                   after a given event ID, one JSON object per line, so that
+                   other systems can keep up with changes to tickets without
+                   re-reading every ticket.
+"""
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import simplejson
+
+from helpdesk.events import DatabaseBroker, event_log_enabled
+
+
+class Command(BaseCommand):
+    "ticket_events command"
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--after',
+            type='int',
+            default=0,
+            help='Only print events with an ID greater than this (default: 0)'),
+        make_option(
+            '--limit',
+            type='int',
+            default=500,
+            help='Maximum number of events to print (default: 500)'),
+        )
+    help = ('Print logged ticket events as JSON, one per line. Run it again '
+            'with --after set to the ID of the last event printed to get '
+            'the next batch.')
+
+    def handle(self, *args, **options):
+        "handle command line"
+        if options['limit'] < 1:
+            raise CommandError('--limit must be at least 1')
+        if not event_log_enabled():
+            raise CommandError('The ticket event log is not enabled: set '
+                'HELPDESK_EVENTS_ENABLED, and HELPDESK_EVENT_BROKER to '
+                "'helpdesk.events.DatabaseBroker'")
+
+        events = DatabaseBroker().events_after(options['after'], limit=options['limit'])
+        for event in events:
+            self.stdout.write('%s\n' % simplejson.dumps(event))
@@ -0,0 +1,66 @@
+#!/usr/bin/python
+"""
+django-helpdesk - A Django powered ticket tracker for small enterprise.
+
+See LICENSE for details.
+
+train_spam_classifier.py - Mark tickets as spam or not spam, and rebuild the
+                           local spam classifier's model from every ticket
+                           marked so far.
+"""
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from helpdesk import settings as helpdesk_settings
+from helpdesk.models import Ticket, SpamLabel
+from helpdesk.spam import NaiveBayesClassifier
+
+
+class Command(BaseCommand):
+    "train_spam_classifier command"
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--spam',
+            help='Comma-separated ID\'s of tickets to mark as spam'),
+        make_option(
+            '--ham',
+            help='Comma-separated ID\'s of tickets to mark as not spam'),
+        make_option(
+            '--no-train',
+            action='store_true',
+            default=False,
+            help='Only mark the tickets, without rebuilding the model'),
+        )
+    help = ('Mark tickets as spam or not spam, then rebuild the model used '
+            'by helpdesk.spam.NaiveBayesClassifier from all marked tickets.')
+
+    def handle(self, *args, **options):
+        "handle command line"
+        for option, is_spam in (('spam', True), ('ham', False)):
+            if not options[option]:
+                continue
+            try:
+                ids = [int(i) for i in options[option].split(',') if i.strip()]
+            except ValueError:
+                raise CommandError('--%s must be a comma-separated list of ticket ID\'s' % option)
+            tickets = Ticket.objects.filter(id__in=ids)
+            missing = set(ids) - set([t.id for t in tickets])
+            if missing:
+                raise CommandError('No such ticket(s): %s' % ', '.join([str(i) for i in sorted(missing)]))
+            for ticket in tickets:
+                SpamLabel.for_ticket(ticket, is_spam)
+
+        if options['no_train']:
+            return
+
+        path = helpdesk_settings.HELPDESK_SPAM_MODEL_FILE
+        if not path:
+            raise CommandError('Set HELPDESK_SPAM_MODEL_FILE to say where to keep the model.')
+
+        labels = SpamLabel.objects.values_list('text', 'is_spam')
+        tokens = NaiveBayesClassifier.train(path, labels.iterator())
+        self.stdout.write('Trained on %s tickets (%s spam); the model has %s tokens.\n' % (
+            labels.count(), labels.filter(is_spam=True).count(), tokens))
@@ -10,10 +10,13 @@ models.py - Model (and hence database) definitions. This is the core of the
 from datetime import datetime
 
 from django.contrib.auth.models import User
+from django.contrib.sites.models import Site
+from django.core.signals import request_started, request_finished, got_request_exception
 from django.db import models
 from django.conf import settings
 from django.utils.translation import ugettext_lazy as _, ugettext
 from helpdesk.settings import HAS_TAG_SUPPORT
+from helpdesk.storage import attachment_path, blob_path, attachment_storage
 
 if HAS_TAG_SUPPORT:
     from tagging.fields import TagField
@@ -393,12 +396,11 @@ class Ticket(models.Model):
         Returns a publicly-viewable URL for this ticket, used when giving
         a URL to the submitter of a ticket.
         """
-        from django.contrib.sites.models import Site
-        from django.core.urlresolvers import reverse
-        site = Site.objects.get_current()
+        from helpdesk.lib import helpdesk_url_prefixes
+        prefixes = helpdesk_url_prefixes()
         return u"http://%s%s?ticket=%s&email=%s" % (
-            site.domain,
-            reverse('helpdesk_public_view'),
+            prefixes['domain'],
+            prefixes['public_view'],
             self.ticket_for_url,
             self.submitter_email
             )
@@ -409,13 +411,10 @@ class Ticket(models.Model):
         Returns a staff-only URL for this ticket, used when giving a URL to
         a staff member (in emails etc)
         """
-        from django.contrib.sites.models import Site
-        from django.core.urlresolvers import reverse
-        site = Site.objects.get_current()
+        from helpdesk.lib import helpdesk_url_prefixes, staff_ticket_path
         return u"http://%s%s" % (
-            site.domain,
-            reverse('helpdesk_view',
-            args=[self.id])
+            helpdesk_url_prefixes()['domain'],
+            staff_ticket_path(self.id),
             )
     staff_url = property(_get_staff_url)
 
@@ -423,10 +422,13 @@ class Ticket(models.Model):
         """
         Returns a boolean.
         True = any dependencies are resolved
-        False = There are non-resolved dependencies
+        False = There are non-resolved dependencies, directly or through
+                the tickets this one depends on
         """
-        OPEN_STATUSES = (Ticket.OPEN_STATUS, Ticket.REOPENED_STATUS)
-        return TicketDependency.objects.filter(ticket=self).filter(depends_on__status__in=OPEN_STATUSES).count() == 0
+        if not hasattr(self, '_blocked'):
+            from helpdesk.lib import blocked_ticket_ids
+            self._blocked = self.id in blocked_ticket_ids([self.id])
+        return not self._blocked
     can_be_resolved = property(_can_be_resolved)
 
     if HAS_TAG_SUPPORT:
@@ -439,8 +441,8 @@ class Ticket(models.Model):
         return u'%s' % self.title
 
     def get_absolute_url(self):
-        return ('helpdesk_view', (self.id,))
-    get_absolute_url = models.permalink(get_absolute_url)
+        from helpdesk.lib import staff_ticket_path
+        return staff_ticket_path(self.id)
 
     def save(self, *args, **kwargs):
         if not self.id:
@@ -582,19 +584,120 @@ class TicketChange(models.Model):
         return str
 
 
-def attachment_path(instance, filename):
+class AttachmentBlobManager(models.Manager):
+    def store(self, file):
+        """
+        Return the blob holding the contents of 'file' (a Django File, eg
+        an upload), saving it first if there isn't one yet. The file is
+        hashed a chunk at a time, and is only written out if its contents
+        are new.
+        """
+        import hashlib
+        from django.db import IntegrityError, transaction
+
+        digest = hashlib.sha256()
+        size = 0
+        for chunk in file.chunks():
+            digest.update(chunk)
+            size += len(chunk)
+        digest = digest.hexdigest()
+
+        if self.filter(sha256=digest).update(last_used=datetime.now()):
+            blob = self.get(sha256=digest)
+            if not blob.file.storage.exists(blob.file.name):
+                # The file has gone missing; store the contents again.
+                from helpdesk.lib import logger
+                logger.warning('Attachment blob %s was missing its file; storing it again' % digest)
+                blob.file.save(digest, file, save=False)
+                self.filter(id=blob.id).update(file=blob.file.name)
+            return blob
+
+        blob = self.model(sha256=digest, size=size)
+        blob.file.save(digest, file, save=False)
+        sid = transaction.savepoint()
+        try:
+            blob.save()
+            transaction.savepoint_commit(sid)
+        except IntegrityError:
+            # Somebody else stored the same contents at the same time.
+            transaction.savepoint_rollback(sid)
+            blob.file.delete(save=False)
+            blob = self.get(sha256=digest)
+        return blob
+
+    def unused(self, before):
+        """
+        Blobs which no attachment refers to, and which haven't been stored
+        again since 'before'.
+        """
+        return self.filter(attachment__isnull=True, last_used__lt=before)
+
+    def delete_if_unused(self, blob, before):
+        """
+        Delete the row for 'blob' if it is still unused (see unused()),
+        returning True if it was deleted. This is a single conditional
+        DELETE, so an attachment saved for the blob in the meantime keeps
+        it, and it never cascades to delete attachments. The caller
+        deletes the file.
+        """
+        from django.db import connection, transaction
+        qn = connection.ops.quote_name
+        cursor = connection.cursor()
+        cursor.execute("""
+            DELETE FROM %(blob)s
+                WHERE id = %%s
+                AND last_used < %%s
+                AND NOT EXISTS (SELECT 1 FROM %(attachment)s WHERE blob_id = %%s)
+            """ % {
+                'blob': qn(self.model._meta.db_table),
+                'attachment': qn(Attachment._meta.db_table),
+            }, [blob.id, before, blob.id])
+        deleted = cursor.rowcount > 0
+        transaction.commit_unless_managed()
+        return deleted
+
+
+class AttachmentBlob(models.Model):
     """
-    Provide a file path that will help prevent files being overwritten, by
-    putting attachments in a folder off attachments for ticket/followup_id/.
+    The contents of an attachment, stored once however many attachments
+    share them when settings.HELPDESK_ATTACHMENT_DEDUPLICATION is on. A
+    blob's reference count is the number of Attachment rows pointing at
+    it; blobs with none are removed by the cleanup_attachment_blobs
+    command.
     """
-    import os
-    from django.conf import settings
-    os.umask(0)
-    path = 'helpdesk/attachments/%s/%s' % (instance.followup.ticket.ticket_for_url, instance.followup.id )
-    att_path = os.path.join(settings.MEDIA_ROOT, path)
-    if not os.path.exists(att_path):
-        os.makedirs(att_path, 0777)
-    return os.path.join(path, filename)
+
+    sha256 = models.CharField(
+        _('SHA-256'),
+        max_length=64,
+        unique=True,
+        )
+
+    file = models.FileField(
+        _('File'),
+        upload_to=blob_path,
+        storage=attachment_storage,
+        max_length=255,
+        )
+
+    size = models.IntegerField(
+        _('Size'),
+        help_text=_('Size of this file in bytes'),
+        )
+
+    last_used = models.DateTimeField(
+        _('Last Used'),
+        default=datetime.now,
+        help_text=_('When this blob was last stored for an attachment.'),
+        )
+
+    objects = AttachmentBlobManager()
+
+    def __unicode__(self):
+        return u'%s' % self.sha256
+
+    class Meta:
+        verbose_name = _('Attachment Blob')
+        verbose_name_plural = _('Attachment Blobs')
 
 
 class Attachment(models.Model):
@@ -608,9 +711,20 @@ class Attachment(models.Model):
         verbose_name=_('Follow-up'),
         )
 
+    blob = models.ForeignKey(
+        AttachmentBlob,
+        verbose_name=_('Blob'),
+        blank=True,
+        null=True,
+        help_text=_('The shared copy of this file, if attachments are '
+            'being deduplicated. file then points to the blob\'s file, '
+            'which is left alone when the attachment is deleted.'),
+        )
+
     file = models.FileField(
         _('File'),
         upload_to=attachment_path,
+        storage=attachment_storage,
         )
 
     filename = models.CharField(
@@ -633,9 +747,38 @@ class Attachment(models.Model):
         if not self.id:
             return u''
         return u'helpdesk/attachments/%s/%s' % (
-            self.followup.ticket.ticket_for_url,
-            self.followup.id
+            self.followup.ticket_id,
+            self.followup_id
+            )
+
+    def _get_download_url(self):
+        """
+        Returns a URL from which staff can download this attachment (after
+        logging in), used in e-mails to anybody but the submitter.
+        """
+        from django.core.urlresolvers import reverse
+        from helpdesk.lib import helpdesk_url_prefixes
+        return u"http://%s%s" % (
+            helpdesk_url_prefixes()['domain'],
+            reverse('helpdesk_attachment', args=[self.id]),
             )
+    download_url = property(_get_download_url)
+
+    def _get_submitter_download_url(self):
+        """
+        Returns a URL from which the submitter of the ticket can download
+        this attachment without logging in. It carries their e-mail
+        address, like the public ticket view's URL, so it must only be sent
+        to them.
+        """
+        from django.utils.http import urlquote
+        ticket = self.followup.ticket
+        return u"%s?ticket=%s&email=%s" % (
+            self.download_url,
+            ticket.ticket_for_url,
+            urlquote(ticket.submitter_email or ''),
+            )
+    submitter_download_url = property(_get_submitter_download_url)
 
     def __unicode__(self):
         return u'%s' % self.filename
@@ -1268,3 +1411,459 @@ class TicketDependency(models.Model):
 
     class Meta:
         unique_together = ('ticket', 'depends_on')
+
+
+
+class TicketEventManager(models.Manager):
+    def sequenced(self):
+        """
+        Events which have been given their sequence number (see
+        helpdesk.events.DatabaseBroker.relay), and so can be handed out.
+        """
+        return self.filter(sequence__isnull=False)
+
+
+class TicketEvent(models.Model):
+    """
+    An append-only log of ticket events (see helpdesk.events), written by
+    the DatabaseBroker in the same transaction as the change it describes.
+
+    Transactions can commit in a different order from the ID's they were
+    given, so consumers don't read by ID. Instead each committed event is
+    given the next number in 'sequence' (see DatabaseBroker.relay), which
+    consumers use as a cursor, reading the events after the last one they
+    saw.
+
+    ticket_id isn't a foreign key, so that events outlive their tickets.
+    """
+
+    ticket_id = models.IntegerField(
+        _('Ticket ID'),
+        db_index=True,
+        )
+
+    event_type = models.CharField(
+        _('Event Type'),
+        max_length=20,
+        )
+
+    data = models.TextField(
+        _('Data'),
+        help_text=_('The event, as a JSON object.'),
+        )
+
+    created = models.DateTimeField(
+        _('Created'),
+        default=datetime.now,
+        db_index=True,
+        )
+
+    sequence = models.IntegerField(
+        _('Sequence'),
+        blank=True,
+        null=True,
+        unique=True,
+        help_text=_('Position of the event in the log, given once it has '
+            'been committed.'),
+        )
+
+    objects = TicketEventManager()
+
+    def __unicode__(self):
+        return u'%s %s' % (self.event_type, self.ticket_id)
+
+    def as_event(self):
+        from django.utils import simplejson
+        event = simplejson.loads(self.data)
+        event['id'] = self.sequence
+        return event
+
+    class Meta:
+        ordering = ['id']
+        verbose_name = _('Ticket Event')
+        verbose_name_plural = _('Ticket Events')
+
+
+class APIToken(models.Model):
+    """
+    A token that lets a user call the JSON API (see views/api.py) without
+    sending their password, which would otherwise need a slow password hash
+    check on every request. Only a SHA-256 hash of the token is stored; the
+    token itself is shown once, when it is created with create_token().
+    """
+
+    user = models.ForeignKey(
+        User,
+        verbose_name=_('User'),
+        )
+
+    name = models.CharField(
+        _('Name'),
+        max_length=100,
+        help_text=_('What this token is used for, eg the name of the '
+            'application that uses it.'),
+        )
+
+    key_hash = models.CharField(
+        _('Key Hash'),
+        max_length=64,
+        unique=True,
+        editable=False,
+        )
+
+    created = models.DateTimeField(
+        _('Created'),
+        default=datetime.now,
+        )
+
+    active = models.BooleanField(
+        _('Active?'),
+        default=True,
+        help_text=_('Untick this to revoke the token.'),
+        )
+
+    def __unicode__(self):
+        return u'%s (%s)' % (self.name, self.user)
+
+    def hash_key(key):
+        import hashlib
+        from django.utils.encoding import smart_str
+        return hashlib.sha256(smart_str(key)).hexdigest()
+    hash_key = staticmethod(hash_key)
+
+    def create_token(cls, user, name):
+        """
+        Create a new token for the user, returning a tuple of the APIToken
+        and the token to give to the user.
+        """
+        import os
+        key = os.urandom(20).encode('hex')
+        token = cls.objects.create(user=user, name=name, key_hash=cls.hash_key(key))
+        return token, key
+    create_token = classmethod(create_token)
+
+    class Meta:
+        verbose_name = _('API Token')
+        verbose_name_plural = _('API Tokens')
+
+
+
+class SpamLabel(models.Model):
+    """
+    A submission that staff have marked as spam or not spam, used to train
+    the local spam classifier (see spam.NaiveBayesClassifier and the
+    train_spam_classifier command). The text is copied from the ticket, so
+    the ticket can be deleted once it has been marked.
+    """
+
+    ticket_id = models.IntegerField(
+        _('Ticket ID'),
+        blank=True,
+        null=True,
+        db_index=True,
+        )
+
+    text = models.TextField(
+        _('Text'),
+        )
+
+    is_spam = models.BooleanField(
+        _('Spam?'),
+        default=False,
+        )
+
+    created = models.DateTimeField(
+        _('Created'),
+        default=datetime.now,
+        )
+
+    def __unicode__(self):
+        return u'%s %s' % (self.is_spam and 'spam' or 'ham', self.ticket_id or '')
+
+    def for_ticket(cls, ticket, is_spam):
+        """
+        Mark a ticket as spam (or not), replacing any earlier mark.
+        """
+        cls.objects.filter(ticket_id=ticket.id).delete()
+        return cls.objects.create(
+            ticket_id=ticket.id,
+            text=u'%s\n%s' % (ticket.title, ticket.description or ''),
+            is_spam=is_spam,
+            )
+    for_ticket = classmethod(for_ticket)
+
+    class Meta:
+        verbose_name = _('Spam Label')
+        verbose_name_plural = _('Spam Labels')
+
+# The fields of a User which the helpdesk shows or depends on.
+USER_SHOWN_FIELDS = ('username', 'first_name', 'last_name', 'email', 'is_active', 'is_staff', 'is_superuser')
+
+def remember_user_state(sender, instance, **kwargs):
+    instance._helpdesk_state = [instance.__dict__.get(f, None) for f in USER_SHOWN_FIELDS]
+
+
+def user_shown_fields_changed(instance, created=None, **kwargs):
+    """
+    False for a save which only changed fields of a User that the helpdesk
+    doesn't use, such as the last_login set each time somebody logs in, so
+    that doesn't invalidate every cached page. New and deleted users count
+    as changes.
+    """
+    if created is None or created:
+        return True
+    return getattr(instance, '_helpdesk_state', None) != [instance.__dict__.get(f, None) for f in USER_SHOWN_FIELDS]
+
+models.signals.post_init.connect(remember_user_state, sender=User)
+
+
+def run_commit_hooks(sender, **kwargs):
+    """
+    The request's transaction has been committed (by TransactionMiddleware,
+    if it is used), so run anything waiting for that (see
+    helpdesk.lib.on_commit). Django has already closed the database
+    connection for this request, so close any that the hooks reopened.
+    """
+    from helpdesk.lib import run_commit_hooks
+    if run_commit_hooks():
+        from django.db import connection
+        connection.close()
+
+
+def discard_commit_hooks(sender, **kwargs):
+    """
+    Hooks left over from an earlier request, or queued by one which failed
+    (and so was rolled back), must not run.
+    """
+    from helpdesk.lib import discard_commit_hooks
+    discard_commit_hooks()
+
+request_started.connect(discard_commit_hooks, dispatch_uid='helpdesk_discard_commit_hooks')
+got_request_exception.connect(discard_commit_hooks, dispatch_uid='helpdesk_discard_commit_hooks')
+request_finished.connect(run_commit_hooks, dispatch_uid='helpdesk_run_commit_hooks')
+
+def remember_ticket_state(sender, instance, **kwargs):
+    """
+    Keep a note of the queue, owner and status a ticket was loaded with, so
+    that when it is moved to another queue or owner we can invalidate cached
+    data for both, and so we can tell what kind of change was made.
+    """
+    instance._original_queue_id = instance.__dict__.get('queue_id', None)
+    instance._original_assigned_to_id = instance.__dict__.get('assigned_to_id', None)
+    instance._original_status = instance.__dict__.get('status', None)
+
+
+def publish_ticket_event(sender, instance, created=False, **kwargs):
+    """
+    Publish a 'created', 'closed', 'assigned' or 'updated' event for the
+    staff event stream (see helpdesk.events). This has to run before
+    ticket_changed(), which resets the remembered state.
+    """
+    from helpdesk.events import publish, ticket_event
+    if created:
+        event_type = 'created'
+    elif instance.status != getattr(instance, '_original_status', None) and instance.status in (Ticket.RESOLVED_STATUS, Ticket.CLOSED_STATUS):
+        event_type = 'closed'
+    elif instance.assigned_to_id != getattr(instance, '_original_assigned_to_id', None):
+        event_type = 'assigned'
+    else:
+        event_type = 'updated'
+    publish(ticket_event(event_type, instance))
+
+
+def publish_followup_event(sender, instance, created=False, **kwargs):
+    """
+    A new follow-up is an update to its ticket.
+    """
+    if created:
+        from helpdesk.events import publish, ticket_event
+        publish(ticket_event('updated', instance.ticket, followup=instance.id))
+
+
+def publish_ticketchange_event(sender, instance, created=False, **kwargs):
+    """
+    Publish a 'changed' event for each field changed in a follow-up, so
+    that integrations reading the event log see exactly what changed.
+    """
+    if created:
+        from django.utils.encoding import force_unicode
+        from helpdesk.events import publish, ticket_event
+        publish(ticket_event('changed', instance.followup.ticket,
+            followup=instance.followup_id,
+            field=force_unicode(instance.field, strings_only=True),
+            old_value=force_unicode(instance.old_value, strings_only=True),
+            new_value=force_unicode(instance.new_value, strings_only=True),
+            ))
+
+
+def publish_ticket_deleted_event(sender, instance, **kwargs):
+    from helpdesk.events import publish, ticket_event
+    publish(ticket_event('deleted', instance))
+
+
+def publish_followup_deleted_event(sender, instance, **kwargs):
+    """
+    When a ticket is deleted its follow-ups go with it, and the ticket's
+    'deleted' event covers them.
+    """
+    from helpdesk.events import publish, ticket_event
+    try:
+        ticket = Ticket.objects.get(id=instance.ticket_id)
+    except Ticket.DoesNotExist:
+        return
+    publish(ticket_event('followup_deleted', ticket, followup=instance.id))
+
+
+def ticket_changed(sender, instance, **kwargs):
+    """
+    Bump the generation counters covering this ticket, which invalidates
+    cached saved search results and feeds (see helpdesk.lib.get_generations).
+    """
+    from helpdesk.lib import bump_generations, dependent_ticket_ids
+    queue_ids = set([instance.queue_id, getattr(instance, '_original_queue_id', None)])
+    assignee_ids = set([instance.assigned_to_id, getattr(instance, '_original_assigned_to_id', None)])
+    names = (['tickets'] +
+        ['queue:%s' % q for q in queue_ids if q] +
+        ['assignee:%s' % (u or 'none') for u in assignee_ids])
+    original_status = getattr(instance, '_original_status', instance.status)
+    if (original_status in (Ticket.OPEN_STATUS, Ticket.REOPENED_STATUS)) != (instance.status in (Ticket.OPEN_STATUS, Ticket.REOPENED_STATUS)):
+        # Tickets which depend on this one may now be blocked, or not.
+        dependents = dependent_ticket_ids(instance.id)
+        if dependents:
+            names.extend(['blocking'] + ['blocking:%s' % t for t in dependents])
+    bump_generations(names)
+    instance._original_queue_id = instance.queue_id
+    instance._original_assigned_to_id = instance.assigned_to_id
+    instance._original_status = instance.status
+
+
+def queue_changed(sender, instance, **kwargs):
+    """
+    Queue titles are used when sorting tickets by queue, and queues are
+    offered in forms from a cached list.
+    """
+    from helpdesk.lib import bump_generations
+    bump_generations(['tickets', 'queues', 'queue:%s' % instance.id])
+
+models.signals.post_init.connect(remember_ticket_state, sender=Ticket)
+models.signals.post_save.connect(publish_ticket_event, sender=Ticket)
+models.signals.post_save.connect(ticket_changed, sender=Ticket)
+models.signals.post_save.connect(publish_followup_event, sender=FollowUp)
+models.signals.post_save.connect(publish_ticketchange_event, sender=TicketChange)
+models.signals.post_delete.connect(publish_ticket_deleted_event, sender=Ticket)
+models.signals.post_delete.connect(publish_followup_deleted_event, sender=FollowUp)
+models.signals.post_delete.connect(ticket_changed, sender=Ticket)
+models.signals.post_save.connect(queue_changed, sender=Queue)
+models.signals.post_delete.connect(queue_changed, sender=Queue)
+
+
+def user_changed(sender, instance, **kwargs):
+    """
+    Users are offered as ticket owners and CC's from a cached list.
+    """
+    if user_shown_fields_changed(instance, **kwargs):
+        from helpdesk.lib import bump_generations
+        bump_generations(['users'])
+
+models.signals.post_save.connect(user_changed, sender=User)
+models.signals.post_delete.connect(user_changed, sender=User)
+
+
+def followup_changed(sender, instance, **kwargs):
+    """
+    Follow-ups are displayed from cached fragments, which include their
+    changes and attachments (see helpdesk.lib.followup_fragments).
+    """
+    from helpdesk.lib import bump_generations
+    if isinstance(instance, FollowUp):
+        followup_id = instance.id
+    else:
+        followup_id = instance.followup_id
+    bump_generations(['followups', 'followup:%s' % followup_id])
+
+models.signals.post_save.connect(followup_changed, sender=FollowUp)
+models.signals.post_delete.connect(followup_changed, sender=FollowUp)
+models.signals.post_save.connect(followup_changed, sender=TicketChange)
+models.signals.post_delete.connect(followup_changed, sender=TicketChange)
+models.signals.post_save.connect(followup_changed, sender=Attachment)
+models.signals.post_delete.connect(followup_changed, sender=Attachment)
+
+
+def keep_blob_file(sender, instance, **kwargs):
+    """
+    Deleting an attachment deletes its file once no other attachment uses
+    it, but a blob's file belongs to the blob (and is removed by the
+    cleanup_attachment_blobs command when nothing uses it), so clear the
+    attachment's reference to it first.
+    """
+    if instance.blob_id:
+        instance.file = ''
+
+models.signals.pre_delete.connect(keep_blob_file, sender=Attachment)
+
+
+def api_token_changed(sender, instance, **kwargs):
+    """
+    API token lookups are cached; this makes revoking a token take effect
+    immediately.
+    """
+    from helpdesk.lib import bump_generations
+    bump_generations(['api_tokens'])
+
+models.signals.post_save.connect(api_token_changed, sender=APIToken)
+models.signals.post_delete.connect(api_token_changed, sender=APIToken)
+
+def dependency_changed(sender, instance, **kwargs):
+    """
+    The ticket gaining or losing a dependency, and every ticket which
+    depends on it, may now be blocked, or not.
+    """
+    from helpdesk.lib import bump_generations, dependent_ticket_ids
+    ticket_ids = dependent_ticket_ids(instance.ticket_id)
+    ticket_ids.add(instance.ticket_id)
+    bump_generations(['blocking'] + ['blocking:%s' % t for t in ticket_ids])
+
+models.signals.post_save.connect(dependency_changed, sender=TicketDependency)
+models.signals.post_delete.connect(dependency_changed, sender=TicketDependency)
+
+def usersettings_changed(sender, instance, **kwargs):
+    """
+    Staff pages are laid out by the user's settings (see
+    helpdesk.lib.staff_page_etag).
+    """
+    from helpdesk.lib import bump_generations
+    bump_generations(['user_settings:%s' % instance.user_id])
+
+models.signals.post_save.connect(usersettings_changed, sender=UserSettings)
+models.signals.post_delete.connect(usersettings_changed, sender=UserSettings)
+
+def saved_search_changed(sender, instance, **kwargs):
+    """
+    The saved queries in the navigation bar are cached.
+    """
+    from helpdesk.lib import bump_generations
+    bump_generations(['saved_searches'])
+
+models.signals.post_save.connect(saved_search_changed, sender=SavedSearch)
+models.signals.post_delete.connect(saved_search_changed, sender=SavedSearch)
+
+def custom_field_changed(sender, instance, **kwargs):
+    """
+    Form fields are built from cached CustomField specs.
+    """
+    from helpdesk.lib import clear_custom_field_specs
+    clear_custom_field_specs()
+
+models.signals.post_save.connect(custom_field_changed, sender=CustomField)
+models.signals.post_delete.connect(custom_field_changed, sender=CustomField)
+
+
+def site_changed(sender, instance, **kwargs):
+    """
+    The Site domain is baked into the cached ticket URL prefixes.
+    """
+    from helpdesk.lib import clear_url_prefixes
+    clear_url_prefixes()
+
+models.signals.post_save.connect(site_changed, sender=Site)
+models.signals.post_delete.connect(site_changed, sender=Site)
@@ -43,6 +43,11 @@ HELPDESK_KB_ENABLED = getattr(settings, 'HELPDESK_KB_ENABLED', True)
 # show knowledgebase links on staff view?
 HELPDESK_KB_ENABLED_STAFF = getattr(settings, 'HELPDESK_KB_ENABLED_STAFF', False)
 
+# add up knowledgebase votes in the cache, and only write them to the database
+# when the flush_kb_votes command is run (eg from cron)? until then the vote
+# counts shown are out of date, and votes are lost if the cache is cleared.
+HELPDESK_KB_VOTE_BUFFER = getattr(settings, 'HELPDESK_KB_VOTE_BUFFER', False)
+
 # show extended navigation by default, to all users, irrespective of staff status?
 HELPDESK_NAVIGATION_ENABLED = getattr(settings, 'HELPDESK_NAVIGATION_ENABLED', False)
 
@@ -100,12 +105,142 @@ HELPDESK_SHOW_HOLD_BUTTON_TICKET_TOP = getattr(settings, 'HELPDESK_SHOW_HOLD_BUT
 # make all updates public by default? this will hide the 'is this update public' checkbox
 HELPDESK_UPDATE_PUBLIC_DEFAULT = getattr(settings, 'HELPDESK_UPDATE_PUBLIC_DEFAULT', True)
 
+# how long (in seconds) to cache the status of tickets linked to from comments
+# using '#1234'. keep this short, as the link styling shows the ticket status.
+HELPDESK_TICKET_LINK_CACHE_TIMEOUT = getattr(settings, 'HELPDESK_TICKET_LINK_CACHE_TIMEOUT', 60)
+
+# how long (in seconds) to cache the rendered comment, changes and attachments
+# of each follow-up. these are invalidated when they change, so this can be
+# long. set to 0 to disable caching.
+HELPDESK_FOLLOWUP_CACHE_TIMEOUT = getattr(settings, 'HELPDESK_FOLLOWUP_CACHE_TIMEOUT', 60 * 60 * 24)
+
 # only show staff users in ticket owner drop-downs 
 HELPDESK_STAFF_ONLY_TICKET_OWNERS = getattr(settings, 'HELPDESK_STAFF_ONLY_TICKET_OWNERS', False)
 
 # only show staff users in ticket cc drop-down 
 HELPDESK_STAFF_ONLY_TICKET_CC = getattr(settings, 'HELPDESK_STAFF_ONLY_TICKET_CC', False)
 
+# maximum number of users suggested when typing a ticket owner's name
+HELPDESK_USER_AUTOCOMPLETE_LIMIT = getattr(settings, 'HELPDESK_USER_AUTOCOMPLETE_LIMIT', 20)
+
+
+
+''' options for the API '''
+# how long (in seconds) to cache the user each API token belongs to. changes
+# to users and tokens invalidate this immediately.
+HELPDESK_API_TOKEN_CACHE_TIMEOUT = getattr(settings, 'HELPDESK_API_TOKEN_CACHE_TIMEOUT', 300)
+
+# maximum number of operations accepted by a single call to the batch method.
+# a batch runs in one transaction, so keep it short.
+HELPDESK_API_BATCH_MAX_OPERATIONS = getattr(settings, 'HELPDESK_API_BATCH_MAX_OPERATIONS', 100)
+
+# maximum number of tickets returned by each call to list_tickets (and the
+# number fetched at a time when streaming them).
+HELPDESK_API_LIST_MAX_RESULTS = getattr(settings, 'HELPDESK_API_LIST_MAX_RESULTS', 500)
+
+
+
+''' options for the live ticket event stream '''
+# publish ticket events (created, updated, assigned, closed) for the staff
+# event stream, which updates the dashboard and ticket list as they happen,
+# and for the ticket event log. each dashboard or ticket list left open holds
+# a server thread or process for HELPDESK_EVENT_STREAM_DURATION seconds at a
+# time, so make sure your server has enough of them before turning this on.
+# the streams in each process share one query of the event log a second.
+HELPDESK_EVENTS_ENABLED = getattr(settings, 'HELPDESK_EVENTS_ENABLED', False)
+
+# class used to store and share ticket events between server processes. the
+# default keeps them in the database, where integrations can also read them
+# (see the ticket_events command). brokers which can't share events between
+# processes, like 'helpdesk.events.InMemoryBroker', are refused.
+HELPDESK_EVENT_BROKER = getattr(settings, 'HELPDESK_EVENT_BROKER', 'helpdesk.events.DatabaseBroker')
+
+# how long (in seconds) each connection to the event stream is held open
+# before the browser is asked to reconnect. each open stream ties up a
+# server thread or process.
+HELPDESK_EVENT_STREAM_DURATION = getattr(settings, 'HELPDESK_EVENT_STREAM_DURATION', 30)
+
+
+
+''' options for RSS feeds '''
+# maximum number of tickets (or follow-ups) shown in each feed.
+HELPDESK_FEED_MAX_ITEMS = getattr(settings, 'HELPDESK_FEED_MAX_ITEMS', 50)
+
+# order of the tickets in the ticket feeds, as arguments to order_by().
+HELPDESK_FEED_ORDERING = getattr(settings, 'HELPDESK_FEED_ORDERING', ('-created',))
+
+# how long (in seconds) to cache each rendered feed. feeds are invalidated
+# when the tickets in them change, so this can be fairly long. set to 0 to
+# disable caching.
+HELPDESK_FEED_CACHE_TIMEOUT = getattr(settings, 'HELPDESK_FEED_CACHE_TIMEOUT', 600)
+
+
+
+''' options for attachments '''
+# store each distinct attachment once, under a hash of its contents, however
+# many tickets and e-mails it's attached to. files nobody refers to any more
+# are removed by the cleanup_attachment_blobs command.
+HELPDESK_ATTACHMENT_DEDUPLICATION = getattr(settings, 'HELPDESK_ATTACHMENT_DEDUPLICATION', False)
+
+# storage class for attachments, eg an object store backend from
+# django-storages. None uses DEFAULT_FILE_STORAGE. to keep them on the local
+# disk, with controlled folder permissions, use
+# 'helpdesk.storage.AttachmentFileSystemStorage'.
+HELPDESK_ATTACHMENT_STORAGE = getattr(settings, 'HELPDESK_ATTACHMENT_STORAGE', None)
+
+# permissions given to the folders AttachmentFileSystemStorage creates.
+HELPDESK_ATTACHMENT_DIRECTORY_PERMISSIONS = getattr(settings, 'HELPDESK_ATTACHMENT_DIRECTORY_PERMISSIONS', 0755)
+
+# have the web server send attachment downloads rather than django: set to
+# 'X-Sendfile' (apache mod_xsendfile, lighttpd) or 'X-Accel-Redirect'
+# (nginx). None sends them from django, a chunk at a time.
+HELPDESK_ATTACHMENT_SENDFILE = getattr(settings, 'HELPDESK_ATTACHMENT_SENDFILE', None)
+
+# with X-Accel-Redirect, the internal nginx location that maps to
+# MEDIA_ROOT. attachment paths are added to the end of it.
+HELPDESK_ATTACHMENT_ACCEL_REDIRECT_PREFIX = getattr(settings, 'HELPDESK_ATTACHMENT_ACCEL_REDIRECT_PREFIX', '/helpdesk-media/')
+
+
+''' options for spam checks '''
+# class used to check public submissions for spam: 'helpdesk.spam.AkismetService'
+# or 'helpdesk.spam.NaiveBayesClassifier' (see helpdesk/spam.py).
+HELPDESK_SPAM_BACKEND = getattr(settings, 'HELPDESK_SPAM_BACKEND', 'helpdesk.spam.AkismetService')
+
+# public submissions are checked with Akismet (settings.AKISMET_API_KEY) or
+# TypePad AntiSpam (settings.TYPEPAD_ANTISPAM_API_KEY). the URL of the
+# service's API can be changed, eg to a local stand-in for testing.
+HELPDESK_AKISMET_URL = getattr(settings, 'HELPDESK_AKISMET_URL', None)
+
+# how long (in seconds) to wait for the spam service. submissions which
+# can't be checked in time are accepted.
+HELPDESK_SPAM_CHECK_TIMEOUT = getattr(settings, 'HELPDESK_SPAM_CHECK_TIMEOUT', 2)
+
+# how long (in seconds) to remember whether the API key is valid.
+HELPDESK_SPAM_KEY_CACHE_TIMEOUT = getattr(settings, 'HELPDESK_SPAM_KEY_CACHE_TIMEOUT', 60 * 60 * 24)
+
+# check submissions in a background thread instead of making the submitter
+# wait. new tickets are kept on hold, and nobody is e-mailed about them,
+# until they pass; spam is deleted.
+HELPDESK_SPAM_CHECK_BACKGROUND = getattr(settings, 'HELPDESK_SPAM_CHECK_BACKGROUND', False)
+
+# where NaiveBayesClassifier keeps its model. the train_spam_classifier
+# command writes it; every server process must be able to read it.
+HELPDESK_SPAM_MODEL_FILE = getattr(settings, 'HELPDESK_SPAM_MODEL_FILE', None)
+
+# how likely (from 0 to 1) NaiveBayesClassifier must think a submission is
+# to be spam before it's rejected.
+HELPDESK_SPAM_THRESHOLD = getattr(settings, 'HELPDESK_SPAM_THRESHOLD', 0.9)
+
+
+''' options for staff.ticket_list view '''
+# how long (in seconds) to cache the list of tickets matched by a saved query.
+# the cache is invalidated whenever a ticket in an affected queue changes, so
+# this can be fairly long. set to 0 to disable caching.
+HELPDESK_SAVED_SEARCH_CACHE_TIMEOUT = getattr(settings, 'HELPDESK_SAVED_SEARCH_CACHE_TIMEOUT', 600)
+
+# saved queries matching more tickets than this are never cached.
+HELPDESK_SAVED_SEARCH_CACHE_MAX_RESULTS = getattr(settings, 'HELPDESK_SAVED_SEARCH_CACHE_MAX_RESULTS', 10000)
+
 
 
 ''' options for staff.create_ticket view '''
@@ -121,6 +256,9 @@ HELPDESK_DASHBOARD_SHOW_DELETE_UNASSIGNED = getattr(settings, 'HELPDESK_DASHBOAR
 # hide empty queues in dashboard overview?
 HELPDESK_DASHBOARD_HIDE_EMPTY_QUEUES = getattr(settings, 'HELPDESK_DASHBOARD_HIDE_EMPTY_QUEUES', True)
 
+# most tickets to show in each list on the dashboard. the rest are linked to.
+HELPDESK_DASHBOARD_SECTION_SIZE = getattr(settings, 'HELPDESK_DASHBOARD_SECTION_SIZE', 25)
+
 
 
 ''' options for footer '''
@@ -131,6 +269,11 @@ HELPDESK_FOOTER_SHOW_API_LINK = getattr(settings, 'HELPDESK_FOOTER_SHOW_API_LINK
 HELPDESK_FOOTER_SHOW_CHANGE_LANGUAGE_LINK = getattr(settings, 'HELPDESK_FOOTER_SHOW_CHANGE_LANGUAGE_LINK', False)
 
 ''' email options '''
+# send e-mail from a background thread, so requests don't wait for the mail
+# server or for attachments to be read in. mail still queued when a server
+# process exits is lost.
+HELPDESK_EMAIL_BACKGROUND = getattr(settings, 'HELPDESK_EMAIL_BACKGROUND', False)
+
 # default Queue email submission settings
 QUEUE_EMAIL_BOX_TYPE = getattr(settings, 'QUEUE_EMAIL_BOX_TYPE', None)
 QUEUE_EMAIL_BOX_SSL = getattr(settings, 'QUEUE_EMAIL_BOX_SSL', None)
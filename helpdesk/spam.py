@@ -0,0 +1,396 @@
+"""
+django-helpdesk - A Django powered ticket tracker for small enterprise.
+
+(c) Copyright 2008 Jutda. All Rights Reserved. See LICENSE for details.
+
+spam.py - Checks tickets submitted through the public form for spam.
+
+The check is made by the backend class named in
+settings.HELPDESK_SPAM_BACKEND, which is either:
+    AkismetService: asks Akismet or TypePad AntiSpam. It keeps one HTTP
+        connection open per thread, checks the API key once (caching the
+        answer), and gives up after settings.HELPDESK_SPAM_CHECK_TIMEOUT
+        seconds. Set HELPDESK_AKISMET_URL to point it at a local stand-in
+        for the service when testing.
+    NaiveBayesClassifier: scores the text locally, with a model trained from
+        the tickets staff have marked as spam or not (see models.SpamLabel
+        and the train_spam_classifier command).
+or any other class with the same from_settings() and is_spam() methods.
+"""
+
+import httplib
+import math
+import os
+import re
+import socket
+import threading
+import time
+import zlib
+from urllib import urlencode
+from urlparse import urlsplit
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import simplejson
+from django.utils.encoding import smart_str
+from django.utils.hashcompat import md5_constructor
+from django.utils.importlib import import_module
+
+from helpdesk import settings as helpdesk_settings
+from helpdesk.lib import logger, on_commit, queue_task_on
+
+AKISMET_URL = 'http://rest.akismet.com/1.1/'
+TYPEPAD_ANTISPAM_URL = 'http://api.antispam.typepad.com/1.1/'
+
+
+class SpamCheckError(Exception):
+    """The spam service couldn't be reached, or gave an unexpected answer."""
+
+
+class SpamBackend(object):
+    """
+    The interface spam backends provide. Subclasses define
+    is_spam(text, data), which returns True if 'text' is spam. 'data' holds
+    the other details of the submission (see request_data()). It raises
+    SpamCheckError if it can't tell.
+    """
+
+    def from_settings(cls):
+        """
+        Returns a backend set up from the Django settings, or None if it
+        can't be used (eg no API key is set).
+        """
+        return cls()
+    from_settings = classmethod(from_settings)
+
+
+class AkismetService(SpamBackend):
+    """
+    A client for the Akismet API (which TypePad AntiSpam also provides).
+    The key is sent with each request rather than in the host name, so
+    'url' can be any server speaking the API.
+    """
+
+    def __init__(self, key, blog_url, url=AKISMET_URL, timeout=2, agent='django-helpdesk'):
+        self.key = key
+        self.blog_url = blog_url
+        self.timeout = timeout
+        self.agent = agent
+        parts = urlsplit(url)
+        self.scheme = parts[0]
+        self.host = parts[1]
+        self.path = parts[2].rstrip('/') + '/'
+        self.local = threading.local()
+        self.key_valid = None
+        self.key_checked = 0
+
+    def _connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            if self.scheme == 'https':
+                connection = httplib.HTTPSConnection(self.host, timeout=self.timeout)
+            else:
+                connection = httplib.HTTPConnection(self.host, timeout=self.timeout)
+            self.local.connection = connection
+        return connection
+
+    def _post(self, method, data):
+        """
+        POST 'data' to an API method, returning the body of the response.
+        The connection is reused between calls; if the server has closed
+        it, the request is tried once more on a new connection.
+        """
+        body = urlencode(dict([(k, smart_str(v)) for k, v in data.items()]))
+        headers = {
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'User-Agent': self.agent,
+            }
+        for attempt in (1, 2):
+            connection = self._connection()
+            try:
+                connection.request('POST', self.path + method, body, headers)
+                response = connection.getresponse()
+                content = response.read()
+            except (httplib.HTTPException, socket.error), e:
+                connection.close()
+                self.local.connection = None
+                if attempt == 2 or isinstance(e, socket.timeout):
+                    raise SpamCheckError('%s: %s' % (method, e))
+                continue
+            if response.status != 200:
+                raise SpamCheckError('%s: HTTP status %s' % (method, response.status))
+            return content.strip().lower()
+
+    def verify_key(self):
+        """
+        Returns True if the API key is valid. The answer is remembered by
+        this process and kept in the cache for
+        settings.HELPDESK_SPAM_KEY_CACHE_TIMEOUT seconds, so the service is
+        only asked once in that time rather than before every check.
+        """
+        timeout = helpdesk_settings.HELPDESK_SPAM_KEY_CACHE_TIMEOUT
+        if self.key_valid is None or time.time() - self.key_checked >= timeout:
+            cache_key = 'helpdesk:spam_key_valid:%s' % md5_constructor('%s|%s|%s%s' % (
+                self.key, self.blog_url, self.host, self.path)).hexdigest()
+            valid = cache.get(cache_key)
+            if valid is None:
+                valid = self._post('verify-key', {'key': self.key, 'blog': self.blog_url}) == 'valid'
+                cache.set(cache_key, valid, timeout)
+                if not valid:
+                    logger.warning('The spam check API key is not valid; spam checks are disabled.')
+            self.key_valid = valid
+            self.key_checked = time.time()
+        return self.key_valid
+
+    def comment_check(self, text, data):
+        """
+        Returns True if 'text' is spam, or False if it isn't or the key is
+        invalid. 'data' holds the other details of the submission (see
+        request_data()).
+        """
+        if not self.verify_key():
+            return False
+        params = {
+            'api_key': self.key,
+            'blog': self.blog_url,
+            'comment_type': 'comment',
+            'comment_content': text,
+            }
+        params.update(data)
+        result = self._post('comment-check', params)
+        if result == 'true':
+            return True
+        if result == 'false':
+            return False
+        raise SpamCheckError('comment-check: unexpected response %r' % result[:100])
+
+    def is_spam(self, text, data):
+        return self.comment_check(text, data)
+
+    def from_settings(cls):
+        from django.contrib.sites.models import Site
+        if hasattr(settings, 'TYPEPAD_ANTISPAM_API_KEY'):
+            key, url = settings.TYPEPAD_ANTISPAM_API_KEY, TYPEPAD_ANTISPAM_URL
+        elif hasattr(settings, 'AKISMET_API_KEY'):
+            key, url = settings.AKISMET_API_KEY, AKISMET_URL
+        else:
+            return None
+        if not key:
+            return None
+        return cls(
+            key=key,
+            blog_url='http://%s/' % Site.objects.get_current().domain,
+            url=helpdesk_settings.HELPDESK_AKISMET_URL or url,
+            timeout=helpdesk_settings.HELPDESK_SPAM_CHECK_TIMEOUT,
+            )
+    from_settings = classmethod(from_settings)
+
+
+TOKEN_RE = re.compile(r"[a-z0-9$][a-z0-9$'_.@-]{1,30}")
+
+# The most tokens a trained model keeps; rarer ones are dropped.
+MAX_MODEL_TOKENS = 50000
+
+
+def tokenize(text):
+    """
+    The distinct words (and e-mail addresses, URL parts and prices) in
+    some text.
+    """
+    return set(TOKEN_RE.findall(smart_str(text).lower()))
+
+
+class NaiveBayesClassifier(SpamBackend):
+    """
+    Scores text with a naive Bayes model of how often each token appears
+    in spam and in other tickets. The model is a zlib-compressed JSON file
+    (settings.HELPDESK_SPAM_MODEL_FILE), written by train() and loaded once
+    per process; it's loaded again if the file changes. Scoring only looks
+    up the text's tokens in a dictionary.
+
+    The loaded model is held as one (mtime, weights, prior) tuple, replaced
+    in a single assignment, so threads scoring while it is reloaded see
+    either the old model or the new one, never a mix.
+    """
+
+    def __init__(self, path, threshold=0.9):
+        self.path = path
+        self.threshold = threshold
+        self.model = (None, {}, 0.0)
+        self.lock = threading.Lock()
+
+    def from_settings(cls):
+        path = helpdesk_settings.HELPDESK_SPAM_MODEL_FILE
+        if not path:
+            return None
+        return cls(path, helpdesk_settings.HELPDESK_SPAM_THRESHOLD)
+    from_settings = classmethod(from_settings)
+
+    def load(self):
+        """
+        Load the model if it has changed since it was last loaded, and
+        return it. Returns None if there is no model yet.
+        """
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return None
+        if self.model[0] == mtime:
+            return self.model
+        self.lock.acquire()
+        try:
+            # Another thread may have loaded it while we waited.
+            if self.model[0] == mtime:
+                return self.model
+            f = open(self.path, 'rb')
+            try:
+                data = simplejson.loads(zlib.decompress(f.read()))
+            finally:
+                f.close()
+            spam_docs, ham_docs = data['spam'], data['ham']
+            # Each token's weight is how much more likely it is to appear in
+            # spam than in ham (as a log ratio, with add-one smoothing).
+            weights = dict([
+                (token, math.log((s + 1.0) / (spam_docs + 2)) - math.log((h + 1.0) / (ham_docs + 2)))
+                for token, (s, h) in data['tokens'].items()])
+            prior = math.log((spam_docs + 1.0) / (ham_docs + 1.0))
+            self.model = (mtime, weights, prior)
+            return self.model
+        finally:
+            self.lock.release()
+
+    def score(self, text):
+        """
+        The probability (from 0 to 1) that 'text' is spam.
+        """
+        model = self.load()
+        if model is None:
+            return 0.0
+        mtime, weights, total = model
+        for token in tokenize(text):
+            total += weights.get(token, 0.0)
+        if total > 50:
+            return 1.0
+        return 1.0 - 1.0 / (1.0 + math.exp(total))
+
+    def is_spam(self, text, data):
+        return self.score(text) >= self.threshold
+
+    def train(cls, path, labels):
+        """
+        Build a model from (text, is_spam) pairs and write it to 'path',
+        replacing any earlier model in one step. Returns the number of
+        tokens in the model.
+        """
+        counts = {}
+        spam_docs = ham_docs = 0
+        for text, is_spam in labels:
+            if is_spam:
+                spam_docs += 1
+                index = 0
+            else:
+                ham_docs += 1
+                index = 1
+            for token in tokenize(text):
+                counts.setdefault(token, [0, 0])[index] += 1
+
+        if len(counts) > MAX_MODEL_TOKENS:
+            kept = sorted(counts.items(), key=lambda (t, c): c[0] + c[1], reverse=True)[:MAX_MODEL_TOKENS]
+            counts = dict(kept)
+
+        data = zlib.compress(simplejson.dumps({
+            'spam': spam_docs,
+            'ham': ham_docs,
+            'tokens': counts,
+            }, separators=(',', ':')), 9)
+        temp_path = '%s.%s.tmp' % (path, os.getpid())
+        f = open(temp_path, 'wb')
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        os.rename(temp_path, path)
+        return len(counts)
+    train = classmethod(train)
+
+def request_data(request):
+    """
+    The details of a request that the spam service uses as well as the
+    text itself. This is a plain dictionary so it can be kept after the
+    request has finished.
+    """
+    return {
+        'user_ip': request.META.get('REMOTE_ADDR', '127.0.0.1'),
+        'user_agent': request.META.get('HTTP_USER_AGENT', ''),
+        'referrer': request.META.get('HTTP_REFERER', ''),
+        }
+
+
+_service = []
+
+def get_spam_service():
+    """
+    Returns the spam backend (settings.HELPDESK_SPAM_BACKEND) for this
+    process, or None if it isn't set up.
+    """
+    if not _service:
+        path = helpdesk_settings.HELPDESK_SPAM_BACKEND
+        module_name, class_name = path.rsplit('.', 1)
+        try:
+            backend_class = getattr(import_module(module_name), class_name)
+        except (ImportError, AttributeError), e:
+            raise ImproperlyConfigured('Error loading helpdesk spam backend %s: %s' % (path, e))
+        _service.append(backend_class.from_settings())
+    return _service[0]
+
+
+def check_ticket_later(ticket, text, request):
+    """
+    Check a ticket for spam in the background. The ticket should have been
+    saved on hold, without sending any e-mail. If it turns out to be spam
+    it's deleted; otherwise it's taken off hold and the usual new ticket
+    e-mails are sent. If the check fails, or the ticket can't be deleted,
+    it is treated as not being spam, so no ticket is left on hold unseen.
+
+    The check is queued once the ticket has been committed, so the
+    background thread can always see it, and runs on its own thread so a
+    slow spam service doesn't hold up other background tasks.
+    """
+    on_commit(queue_task_on, 'spam', _apply_spam_verdict, ticket.id, text, request_data(request))
+
+
+def _apply_spam_verdict(ticket_id, text, data):
+    from helpdesk.forms import notify_new_public_ticket
+    from helpdesk.models import Ticket, Attachment
+
+    is_spam = False
+    try:
+        service = get_spam_service()
+        if service is not None:
+            is_spam = service.is_spam(text, data)
+    except SpamCheckError, e:
+        logger.warning('Could not check ticket %s for spam: %s' % (ticket_id, e))
+    except Exception:
+        logger.exception('Could not check ticket %s for spam' % ticket_id)
+
+    try:
+        ticket = Ticket.objects.select_related('queue').get(id=ticket_id)
+    except Ticket.DoesNotExist:
+        # Deleted by staff while it was being checked.
+        logger.info('Ticket %s was deleted before its spam check finished' % ticket_id)
+        return
+
+    if is_spam:
+        try:
+            ticket.delete()
+            logger.info('Deleted ticket %s as spam' % ticket_id)
+            return
+        except Exception:
+            logger.exception('Could not delete spam ticket %s; releasing it instead' % ticket_id)
+
+    try:
+        ticket.on_hold = False
+        ticket.save()
+    finally:
+        notify_new_public_ticket(ticket, list(Attachment.objects.filter(followup__ticket=ticket)))
@@ -0,0 +1,84 @@
+"""
+django-helpdesk - A Django powered ticket tracker for small enterprise.
+
+(c) Copyright 2008 Jutda. All Rights Reserved. See LICENSE for details.
+
+storage.py - Where attachments are stored. Attachments are saved through
+             attachment_storage, which is the storage class named by
+             settings.HELPDESK_ATTACHMENT_STORAGE (Django's default file
+             storage if that isn't set), so they can live on the local disk
+             or in any object store with a Django storage backend.
+"""
+
+import errno
+import os
+
+from django.core.files.storage import FileSystemStorage, get_storage_class
+from django.utils.functional import LazyObject
+
+from helpdesk import settings as helpdesk_settings
+
+
+def attachment_path(instance, filename):
+    """
+    Provide a file path that will help prevent files being overwritten, by
+    putting attachments in a folder off attachments for ticket/followup_id/.
+    Only ID's are used, so no extra queries are needed to work it out.
+    """
+    return 'helpdesk/attachments/%s/%s/%s' % (
+        instance.followup.ticket_id,
+        instance.followup_id,
+        filename,
+        )
+
+
+def blob_path(instance, filename):
+    """
+    Attachment blobs are stored under their hash, split over two levels of
+    folders so no one folder gets too large.
+    """
+    return 'helpdesk/blobs/%s/%s/%s' % (instance.sha256[:2], instance.sha256[2:4], instance.sha256)
+
+
+class AttachmentFileSystemStorage(FileSystemStorage):
+    """
+    Local disk storage which creates folders with the permissions in
+    settings.HELPDESK_ATTACHMENT_DIRECTORY_PERMISSIONS, without changing the
+    process-wide umask.
+
+    Pointing 'location' at a scratch folder makes this a stand-in for an
+    object store when developing or testing.
+    """
+
+    def __init__(self, location=None, base_url=None, directory_permissions=None):
+        FileSystemStorage.__init__(self, location, base_url)
+        if directory_permissions is None:
+            directory_permissions = helpdesk_settings.HELPDESK_ATTACHMENT_DIRECTORY_PERMISSIONS
+        self.directory_permissions = directory_permissions
+
+    def make_directory(self, directory):
+        """
+        Create 'directory' (and any missing parents) if it doesn't exist.
+        Another process creating it at the same time is not an error.
+        """
+        try:
+            os.makedirs(directory)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        else:
+            # makedirs() applies the umask, so set the permissions
+            # explicitly on the folder we made.
+            if self.directory_permissions is not None:
+                os.chmod(directory, self.directory_permissions)
+
+    def _save(self, name, content):
+        self.make_directory(os.path.dirname(self.path(name)))
+        return FileSystemStorage._save(self, name, content)
+
+
+class AttachmentStorage(LazyObject):
+    def _setup(self):
+        self._wrapped = get_storage_class(helpdesk_settings.HELPDESK_ATTACHMENT_STORAGE)()
+
+attachment_storage = AttachmentStorage()
@@ -9,13 +9,9 @@ from django.template import Library
 from helpdesk import settings as helpdesk_settings_config
 
 def load_helpdesk_settings(request):
-    try:
-        return helpdesk_settings_config
-    except Exception, e:
-        import sys
-        print >> sys.stderr,  "'load_helpdesk_settings' template tag (django-helpdesk) crashed with following error:"
-        print >> sys.stderr,  e
-        return ''
+    # The settings module is loaded once, when this module is imported;
+    # there's nothing to work out per request.
+    return helpdesk_settings_config
 
 register = Library()
 register.filter('load_helpdesk_settings', load_helpdesk_settings)
@@ -4,22 +4,29 @@ django-helpdesk - A Django powered ticket tracker for small enterprise.
 templatetags/saved_queries.py - This template tag returns previously saved 
                                 queries. Therefore you don't need to modify
                                 any views.
+
+The navigation_context filter returns the saved queries along with the
+other cached parts of the navigation bar (see lib.navigation_context).
 """
 
 from django.template import Library
-from django.db.models import Q
-from helpdesk.models import SavedSearch
+from helpdesk.lib import logger, navigation_context as get_navigation_context
 
 
-def saved_queries(request):
+def navigation_context(request):
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated():
+        return {'saved_queries': [], 'open_tickets': None}
     try:
-        user_saved_queries = SavedSearch.objects.filter(Q(user=request.user) | Q(shared__exact=True))
-        return user_saved_queries
-    except Exception, e:
-        import sys
-        print >> sys.stderr,  "'saved_queries' template tag (django-helpdesk) crashed with following error:"
-        print >> sys.stderr,  e
-        return ''
+        return get_navigation_context(user)
+    except Exception:
+        logger.exception("'navigation_context' template tag (django-helpdesk) crashed")
+        return {'saved_queries': [], 'open_tickets': None}
+
+
+def saved_queries(request):
+    return navigation_context(request)['saved_queries']
 
 register = Library()
+register.filter('navigation_context', navigation_context)
 register.filter('saved_queries', saved_queries)
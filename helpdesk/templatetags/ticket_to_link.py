@@ -14,46 +14,90 @@ templatetags/ticket_to_link.py - Used in ticket comments to allow wiki-style
 import re
 
 from django import template
-from django.core.urlresolvers import reverse
+from django.core.cache import cache
 from django.utils.safestring import mark_safe
 
+from helpdesk import settings as helpdesk_settings
+from helpdesk.lib import staff_ticket_path
 from helpdesk.models import Ticket
 
+# A ticket number is a '#' followed by digits, but not the '&#39;' style
+# HTML entities produced by escaping the comment first.
+TICKET_NUMBER_RE = re.compile(r"(?<!&)#(\d+)\b")
 
-class ReverseProxy:
-    def __init__(self, sequence):
-        self.sequence = sequence
+STATUS_DISPLAY = dict(Ticket.STATUS_CHOICES)
 
-    def __iter__(self):
-        length = len(self.sequence)
-        i = length
-        while i > 0:
-            i = i - 1
-            yield self.sequence[i]
+def _status_cache_key(ticket_id):
+    return 'helpdesk:ticket_link_status:%s' % ticket_id
+
+
+def get_ticket_statuses(ticket_ids):
+    """
+    Returns a dictionary mapping each of the given ticket ID's to the status
+    of that ticket, or to 0 if there is no such ticket. Statuses are kept in
+    a short-lived cache, and any that aren't cached are loaded with a single
+    query.
+    """
+    ticket_ids = set([int(i) for i in ticket_ids])
+    if not ticket_ids:
+        return {}
+
+    keys = dict([(_status_cache_key(i), i) for i in ticket_ids])
+    statuses = dict([(keys[k], v) for k, v in cache.get_many(keys.keys()).items()])
+
+    missing = [i for i in ticket_ids if i not in statuses]
+    if missing:
+        found = dict(Ticket.objects.filter(id__in=missing).values_list('id', 'status'))
+        for i in missing:
+            statuses[i] = found.get(i, 0)
+        cache.set_many(
+            dict([(_status_cache_key(i), statuses[i]) for i in missing]),
+            helpdesk_settings.HELPDESK_TICKET_LINK_CACHE_TIMEOUT,
+            )
+
+    return statuses
+
+
+def preload_ticket_links(texts):
+    """
+    Look up every ticket referenced in any of the given texts in one go, so
+    that num_to_link() finds them all cached. Views should call this with
+    all of the comments on a page before rendering it.
+    """
+    ticket_ids = set()
+    for text in texts:
+        if text:
+            ticket_ids.update(TICKET_NUMBER_RE.findall(text))
+    get_ticket_statuses(ticket_ids)
 
 
 def num_to_link(text):
     if text == '':
         return text
 
-    matches = []
-    for match in re.finditer(r"(?:[^&]|\b|^)#(\d+)\b", text):
-        matches.append(match)
-
-    for match in ReverseProxy(matches):
-        start = match.start()
-        end = match.end()
-        number = match.groups()[0]
-        url = reverse('helpdesk_view', args=[number])
-        try:
-            ticket = Ticket.objects.get(id=number)
-        except Ticket.DoesNotExist:
-            ticket = None
-
-        if ticket:
-            style = ticket.get_status_display()
-            text = "%s <a href='%s' class='ticket_link_status ticket_link_status_%s'>#%s</a>%s" % (text[:match.start()], url, style, match.groups()[0], text[match.end():])
-    return mark_safe(text)
+    matches = list(TICKET_NUMBER_RE.finditer(text))
+    if not matches:
+        return mark_safe(text)
+
+    statuses = get_ticket_statuses([match.group(1) for match in matches])
+
+    output = []
+    position = 0
+    for match in matches:
+        number = match.group(1)
+        status = statuses.get(int(number), 0)
+        if not status:
+            continue
+        output.append(text[position:match.start()])
+        output.append(u"<a href='%s' class='ticket_link_status ticket_link_status_%s'>#%s</a>" % (
+            staff_ticket_path(number),
+            STATUS_DISPLAY[status],
+            number,
+            ))
+        position = match.end()
+    output.append(text[position:])
+
+    return mark_safe(u''.join(output))
 
 register = template.Library()
 register.filter(num_to_link)
@@ -0,0 +1,314 @@
+"""
+django-helpdesk - A Django powered ticket tracker for small enterprise.
+
+(c) Copyright 2008 Jutda. All Rights Reserved. See LICENSE for details.
+
+tests.py - Tests for the helpdesk application.
+"""
+
+from datetime import datetime
+
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.db.models import AutoField
+from django.test import TestCase, TransactionTestCase
+from django.utils import simplejson
+
+from helpdesk import settings as helpdesk_settings
+from helpdesk.events import DatabaseBroker, set_broker
+from helpdesk.lib import add_ticket_dependency, blocked_ticket_ids
+from helpdesk.models import Queue, Ticket, TicketDependency, TicketEvent, APIToken, UserSettings
+
+
+def insert_tickets(tickets):
+    """
+    Insert the given unsaved Tickets with a single executemany(). This skips
+    Ticket.save() and the signals it sends, so large fixtures can be built
+    quickly.
+    """
+    qn = connection.ops.quote_name
+    fields = [f for f in Ticket._meta.local_fields if not isinstance(f, AutoField)]
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+        qn(Ticket._meta.db_table),
+        ', '.join([qn(f.column) for f in fields]),
+        ', '.join(['%s'] * len(fields)),
+        )
+    rows = [[f.get_db_prep_save(f.pre_save(t, True), connection=connection) for f in fields] for t in tickets]
+    connection.cursor().executemany(sql, rows)
+    transaction.commit_unless_managed()
+
+
+class DashboardQueryTest(TestCase):
+    """
+    The dashboard's lists of tickets are each fetched in one query, with the
+    queue joined in, and cut short, so the number of queries it makes
+    doesn't grow with the number of tickets.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('staff', 'staff@example.com', 'password')
+        self.user.is_staff = True
+        self.user.save()
+        self.queue = Queue.objects.create(title='Queue', slug='queue')
+        self.client.login(username='staff', password='password')
+
+    def make_tickets(self, count):
+        # Tickets of every kind shown on the dashboard: assigned to the user
+        # and open, assigned to them and closed, and unassigned. All of them
+        # were submitted by the user.
+        now = datetime.now()
+        tickets = []
+        for i in range(count):
+            for assigned_to, status in (
+                    (self.user, Ticket.OPEN_STATUS),
+                    (self.user, Ticket.CLOSED_STATUS),
+                    (None, Ticket.OPEN_STATUS),
+                    ):
+                tickets.append(Ticket(
+                    title='Ticket %s' % i,
+                    queue=self.queue,
+                    created=now,
+                    modified=now,
+                    submitter_email=self.user.email,
+                    assigned_to=assigned_to,
+                    status=status,
+                    priority=3,
+                    ))
+        return tickets
+
+    def get_dashboard(self):
+        # Start from an empty cache each time, so every request does the
+        # same work.
+        cache.clear()
+        response = self.client.get(reverse('helpdesk_dashboard'))
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def count_queries(self, func):
+        old_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        start = len(connection.queries)
+        try:
+            func()
+        finally:
+            connection.use_debug_cursor = old_debug_cursor
+        return len(connection.queries) - start
+
+    def test_queries_dont_grow_with_tickets(self):
+        for ticket in self.make_tickets(1):
+            ticket.save()
+        self.get_dashboard()
+        queries = self.count_queries(self.get_dashboard)
+
+        # 10,000 more tickets of each kind.
+        insert_tickets(self.make_tickets(10000))
+        self.assertNumQueries(queries, self.get_dashboard)
+        self.assertContains(self.get_dashboard(), reverse('helpdesk_dashboard_section', args=['assigned']))
+
+
+class BatchAPITest(TransactionTestCase):
+    """
+    E-mails about the operations in a batch are only sent once the batch
+    has been committed, and never for changes which were rolled back. (A
+    TransactionTestCase, as TestCase turns rollbacks into no-ops.)
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('staff', 'staff@example.com', 'password')
+        self.user.is_staff = True
+        self.user.save()
+        self.queue = Queue.objects.create(title='Queue', slug='queue', new_ticket_cc='cc@example.com')
+        token, self.key = APIToken.create_token(self.user, 'Tests')
+
+    def batch(self, operations):
+        response = self.client.post(
+            reverse('helpdesk_api_v2', args=['batch']),
+            simplejson.dumps({'operations': operations}),
+            content_type='application/json',
+            HTTP_AUTHORIZATION='Token %s' % self.key,
+            )
+        return simplejson.loads(response.content)
+
+    def create_ticket(self, title):
+        return {'method': 'create_ticket', 'params': {
+            'queue': self.queue.id,
+            'title': title,
+            'submitter_email': 'submitter@example.com',
+            'body': 'Something is broken.',
+            'priority': 3,
+            }}
+
+    def test_mail_sent_after_commit(self):
+        response = self.batch([self.create_ticket('First'), self.create_ticket('Second')])
+        self.assertTrue(response['ok'])
+        self.assertEqual([r['ok'] for r in response['result']], [True, True])
+        self.assertEqual(Ticket.objects.count(), 2)
+        # The submitter and the queue's CC address, for each ticket.
+        self.assertEqual(len(mail.outbox), 4)
+
+    def test_no_mail_for_rolled_back_tickets(self):
+        # The second operation raises an error (the ticket ID isn't a
+        # number) after the first has created a ticket.
+        response = self.batch([
+            self.create_ticket('First'),
+            {'method': 'add_followup', 'params': {'ticket': 'x', 'message': 'Hello'}},
+            ])
+        if connection.features.uses_savepoints:
+            # Only the failed operation is rolled back.
+            self.assertEqual([r['ok'] for r in response['result']], [True, False])
+            self.assertEqual(Ticket.objects.count(), 1)
+            self.assertEqual(len(mail.outbox), 2)
+        else:
+            # The whole batch is rolled back.
+            self.assertFalse(response['ok'])
+            self.assertEqual(Ticket.objects.count(), 0)
+            self.assertEqual(len(mail.outbox), 0)
+
+
+class TicketDependencyTest(TestCase):
+    """
+    Blocked flags follow dependencies through other tickets, and are
+    updated when a ticket anywhere down the chain is opened or resolved.
+    Dependencies which would make a cycle are refused.
+    """
+
+    def setUp(self):
+        # Ticket ID's are reused between tests, so drop their cached flags.
+        cache.clear()
+        queue = Queue.objects.create(title='Queue', slug='queue')
+        self.a, self.b, self.c = [Ticket.objects.create(title=t, queue=queue) for t in 'abc']
+        # a depends on b, which depends on c.
+        self.assertTrue(add_ticket_dependency(TicketDependency(ticket=self.a, depends_on=self.b)))
+        self.assertTrue(add_ticket_dependency(TicketDependency(ticket=self.b, depends_on=self.c)))
+
+    def test_blocked_through_other_tickets(self):
+        ids = [self.a.id, self.b.id, self.c.id]
+        self.assertEqual(blocked_ticket_ids(ids), set([self.a.id, self.b.id]))
+
+        self.b.status = Ticket.RESOLVED_STATUS
+        self.b.save()
+        # a is still waiting for c, through b.
+        self.assertEqual(blocked_ticket_ids(ids), set([self.a.id, self.b.id]))
+
+        self.c.status = Ticket.CLOSED_STATUS
+        self.c.save()
+        self.assertEqual(blocked_ticket_ids(ids), set())
+        self.assertTrue(Ticket.objects.get(id=self.a.id).can_be_resolved)
+
+        self.c.status = Ticket.REOPENED_STATUS
+        self.c.save()
+        self.assertEqual(blocked_ticket_ids(ids), set([self.a.id, self.b.id]))
+
+    def test_ticket_list(self):
+        user = User.objects.create_user('staff', 'staff@example.com', 'password')
+        user.is_staff = True
+        user.save()
+        self.client.login(username='staff', password='password')
+        response = self.client.get(reverse('helpdesk_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "class='ticket_blocked'", count=2)
+
+    def test_cycles_refused(self):
+        self.assertFalse(add_ticket_dependency(TicketDependency(ticket=self.c, depends_on=self.a)))
+        self.assertFalse(add_ticket_dependency(TicketDependency(ticket=self.c, depends_on=self.c)))
+        self.assertEqual(TicketDependency.objects.count(), 2)
+
+
+class StaffPageETagTest(TestCase):
+    """
+    A staff page's ETag only changes with the data shown on it: the tickets
+    in the queues it is limited to, and the user's own settings. Pages with
+    messages waiting for the user get none.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('staff', 'staff@example.com', 'password')
+        self.user.is_staff = True
+        self.user.save()
+        self.queue = Queue.objects.create(title='Queue', slug='queue')
+        self.other_queue = Queue.objects.create(title='Other', slug='other')
+        self.ticket = Ticket.objects.create(title='Ticket', queue=self.queue)
+        self.client.login(username='staff', password='password')
+
+    def etag(self):
+        response = self.client.get(reverse('helpdesk_list'), {'queue': self.queue.id})
+        self.assertEqual(response.status_code, 200)
+        return response.get('ETag', None)
+
+    def test_other_queues_ignored(self):
+        etag = self.etag()
+        self.assertTrue(etag)
+        Ticket.objects.create(title='Elsewhere', queue=self.other_queue)
+        self.assertEqual(self.etag(), etag)
+        Ticket.objects.create(title='Here', queue=self.queue)
+        self.assertNotEqual(self.etag(), etag)
+
+    def test_user_settings(self):
+        etag = self.etag()
+        usersettings = UserSettings.objects.get(user=self.user)
+        usersettings.settings = dict(usersettings.settings, tickets_per_page=50)
+        usersettings.save()
+        self.assertNotEqual(self.etag(), etag)
+
+    def test_pending_messages(self):
+        etag = self.etag()
+        self.user.message_set.create(message='Hello')
+        self.assertEqual(self.etag(), None)
+        self.user.message_set.all().delete()
+        self.assertEqual(self.etag(), etag)
+
+
+class TicketEventLogTest(TransactionTestCase):
+    """
+    Events are logged in the same transaction as the change they describe,
+    and readers get them in the order they were committed.
+    """
+
+    def setUp(self):
+        self.events_enabled = helpdesk_settings.HELPDESK_EVENTS_ENABLED
+        helpdesk_settings.HELPDESK_EVENTS_ENABLED = True
+        self.broker = DatabaseBroker()
+        set_broker(self.broker)
+        self.queue = Queue.objects.create(title='Queue', slug='queue')
+
+    def tearDown(self):
+        helpdesk_settings.HELPDESK_EVENTS_ENABLED = self.events_enabled
+        set_broker(None)
+
+    def create_ticket(self, fail=False):
+        Ticket.objects.create(title='Ticket', queue=self.queue)
+        if fail:
+            raise ValueError
+    create_ticket = transaction.commit_on_success(create_ticket)
+
+    def test_logged_with_change(self):
+        self.create_ticket()
+        self.assertEqual(TicketEvent.objects.filter(event_type='created').count(), 1)
+        self.assertRaises(ValueError, self.create_ticket, fail=True)
+        self.assertEqual(TicketEvent.objects.filter(event_type='created').count(), 1)
+
+    def test_late_commit_not_skipped(self):
+        TicketEvent.objects.create(id=10, ticket_id=1, event_type='created', data='{}')
+        events = self.broker.events_after(0)
+        self.assertEqual(len(events), 1)
+        # An event given a lower ID, whose transaction committed later.
+        TicketEvent.objects.create(id=5, ticket_id=2, event_type='created', data='{}')
+        events = self.broker.events_after(events[-1]['id'])
+        self.assertEqual(len(events), 1)
+        self.assertEqual(TicketEvent.objects.get(sequence=events[0]['id']).id, 5)
+
+    def test_streams_share_one_poll(self):
+        self.broker.poll_interval = 60
+        # The first wait sets where polling starts from.
+        self.assertEqual(self.broker.events_after(0, timeout=0.1), [])
+        Ticket.objects.create(title='Ticket', queue=self.queue)
+        self.broker.next_poll = 0
+        events = self.broker.events_after(0, timeout=1)
+        self.assertEqual([e['type'] for e in events], ['created'])
+        # Other streams waiting for the same events are given them without
+        # reading the table again.
+        self.assertNumQueries(0, self.broker.events_after, 0, timeout=1)
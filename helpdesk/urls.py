@@ -10,10 +10,10 @@ urls.py - Mapping of URL's to our various views. Note we always used NAMED
 from django.conf import settings
 from django.conf.urls.defaults import *
 from django.contrib.auth.decorators import login_required
-from django.contrib.syndication.views import feed as django_feed
+from django.views.decorators.http import condition
 
 from helpdesk import settings as helpdesk_settings
-from helpdesk.views.feeds import feed_setup
+from helpdesk.views.feeds import feed_setup, cached_feed, feed_etag
 
 
 urlpatterns = patterns('helpdesk.views.staff',
@@ -21,6 +21,10 @@ urlpatterns = patterns('helpdesk.views.staff',
         'dashboard',
         name='helpdesk_dashboard'),
 
+    url(r'^dashboard/(?P<section>[a-z]+)/$',
+        'dashboard_section',
+        name='helpdesk_dashboard_section'),
+
     url(r'^tickets/$',
         'ticket_list',
         name='helpdesk_list'),
@@ -85,6 +89,14 @@ urlpatterns = patterns('helpdesk.views.staff',
         'attachment_del',
         name='helpdesk_attachment_del'),
 
+    url(r'^events/$',
+        'event_stream',
+        name='helpdesk_event_stream'),
+
+    url(r'^users/autocomplete/$',
+        'user_autocomplete',
+        name='helpdesk_user_autocomplete'),
+
     url(r'^raw/(?P<type>\w+)/$',
         'raw_details',
         name='helpdesk_raw'),
@@ -142,10 +154,18 @@ urlpatterns += patterns('helpdesk.views.public',
 
 urlpatterns += patterns('',
     url(r'^rss/(?P<url>.*)/$',
-        login_required(django_feed),
+        login_required(condition(etag_func=feed_etag)(cached_feed)),
         {'feed_dict': feed_setup},
         name='helpdesk_rss'),
 
+    url(r'^attachments/(?P<attachment_id>[0-9]+)/$',
+        'helpdesk.views.attachments.download_attachment',
+        name='helpdesk_attachment'),
+
+    url(r'^api/v2/(?P<method>[a-z_-]+)/$',
+        'helpdesk.views.api.api_v2',
+        name='helpdesk_api_v2'),
+
     url(r'^api/(?P<method>[a-z_-]+)/$',
         'helpdesk.views.api.api',
         name='helpdesk_api'),
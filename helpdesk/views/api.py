@@ -16,15 +16,21 @@ from datetime import datetime
 from django import forms
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
-from django.http import HttpResponse
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Q
+from django.http import HttpResponse, HttpResponseNotModified
 from django.shortcuts import render_to_response
 from django.template import loader, Context
 from django.utils import simplejson
+from django.utils.http import parse_etags, quote_etag
 from django.views.decorators.csrf import csrf_exempt
 
+from helpdesk.events import DatabaseBroker, event_log_enabled
 from helpdesk.forms import TicketForm
-from helpdesk.lib import send_templated_mail, safe_template_context
-from helpdesk.models import Ticket, Queue, FollowUp
+from helpdesk.lib import send_templated_mail, safe_template_context, queue_choices, user_choices, get_generations, apply_query, data_etag, ticket_generations, commit_hooks_mark, discard_commit_hooks
+from helpdesk.models import Ticket, Queue, FollowUp, APIToken
+from helpdesk import settings as helpdesk_settings
 
 STATUS_OK = 200
 
@@ -33,6 +39,19 @@ STATUS_ERROR_NOT_FOUND = 404
 STATUS_ERROR_PERMISSIONS = 403
 STATUS_ERROR_BADMETHOD = 405
 
+# Ticket fields that list_tickets and get_ticket can return. Foreign keys
+# (queue, assigned_to) are returned as ID's.
+TICKET_API_FIELDS = ('id', 'title', 'queue', 'created', 'modified',
+    'submitter_email', 'assigned_to', 'status', 'on_hold', 'description',
+    'resolution', 'priority', 'due_date', 'last_escalation')
+
+DEFAULT_TICKET_API_FIELDS = ('id', 'title', 'queue', 'created', 'modified',
+    'assigned_to', 'status', 'priority')
+
+# API methods which don't change anything, and so can be called with a GET
+# in API v2.
+API_READ_METHODS = ('list_queues', 'find_user', 'list_tickets', 'get_ticket')
+
 
 @csrf_exempt
 def api(request, method):
@@ -46,6 +65,8 @@ def api(request, method):
           must be valid users
         * The method must match one of the public methods of the API class.
 
+    New integrations should use api_v2(), which doesn't need a password
+    check on every request.
     """
 
     if method == 'help':
@@ -54,7 +75,6 @@ def api(request, method):
     if request.method != 'POST':
         return api_return(STATUS_ERROR_BADMETHOD)
 
-    # TODO: Move away from having the username & password in every request.
     request.user = authenticate(
         username=request.POST.get('user', False),
         password=request.POST.get('password'),
@@ -70,6 +90,92 @@ def api(request, method):
     return api_return(STATUS_ERROR)
 
 
+@csrf_exempt
+def api_v2(request, method):
+    """
+    Version 2 of the API provides the same methods as api(), but:
+        * The user is identified by an API token (see models.APIToken),
+          sent in an 'Authorization: Token <token>' header, rather than a
+          username and password.
+        * The request body is a JSON object of the method's parameters.
+        * The response is always a JSON object, with an 'ok' flag and
+          either a 'result' or an 'error'.
+        * Methods which only read data (see API_READ_METHODS) can also be
+          called with a GET, passing their parameters in the query string.
+          These responses carry an ETag, and a conditional GET is
+          answered with '304 Not Modified' until the data they were built
+          from changes.
+    """
+
+    if request.method not in ('GET', 'POST') or (request.method == 'GET' and method not in API_READ_METHODS):
+        return api_json_return(STATUS_ERROR_BADMETHOD, error='Invalid request method')
+
+    request.user = token_user(request.META.get('HTTP_AUTHORIZATION', ''))
+    if request.user is None:
+        return api_json_return(STATUS_ERROR_PERMISSIONS, error='Invalid API token')
+
+    if request.method == 'GET':
+        api = API(request, params=request.GET, json=True)
+        etag = data_etag(request, api.read_generations(method))
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            return HttpResponseNotModified()
+
+        response = getattr(api, 'api_public_%s' % method)()
+        if response.status_code == STATUS_OK:
+            response['ETag'] = quote_etag(etag)
+        return response
+
+    try:
+        params = simplejson.loads(request.raw_post_data or '{}')
+    except ValueError:
+        return api_json_return(STATUS_ERROR, error='Invalid JSON in request body')
+    if not isinstance(params, dict):
+        return api_json_return(STATUS_ERROR, error='Request body must be a JSON object')
+
+    api = API(request, params=params, json=True)
+    if hasattr(api, 'api_public_%s' % method):
+        return getattr(api, 'api_public_%s' % method)()
+
+    return api_json_return(STATUS_ERROR_NOT_FOUND, error='Invalid method')
+
+
+def token_user(authorization):
+    """
+    Returns the active user identified by an 'Authorization: Token <token>'
+    header, or None. Tokens are looked up by their hash, and the ID of the
+    token's user (and whether they are active) is cached until any user or
+    token changes; only the ID is kept, never the user's password hash.
+    """
+    parts = authorization.split()
+    if len(parts) != 2 or parts[0].lower() != 'token':
+        return None
+
+    key_hash = APIToken.hash_key(parts[1])
+    cache_key = 'helpdesk:api_token:%s:%s' % (
+        key_hash,
+        ':'.join([str(g) for g in get_generations(['users', 'api_tokens'])]),
+        )
+
+    cached = cache.get(cache_key)
+    if cached is None:
+        try:
+            token = APIToken.objects.select_related('user').get(key_hash=key_hash, active=True)
+        except APIToken.DoesNotExist:
+            return None
+        cache.set(cache_key, (token.user_id, token.user.is_active), helpdesk_settings.HELPDESK_API_TOKEN_CACHE_TIMEOUT)
+        if not token.user.is_active:
+            return None
+        return token.user
+
+    user_id, is_active = cached
+    if not is_active:
+        return None
+    try:
+        return User.objects.get(pk=user_id, is_active=True)
+    except User.DoesNotExist:
+        return None
+
+
 def api_return(status, text='', json=False):
     content_type = 'text/plain'
     if status == STATUS_OK and json:
@@ -95,90 +201,154 @@ def api_return(status, text='', json=False):
     return r
 
 
+def api_json_return(status, result=None, error=None):
+    body = {'ok': status == STATUS_OK}
+    if result is not None:
+        body['result'] = result
+    if error:
+        body['error'] = error
+
+    r = HttpResponse(status=status, content=simplejson.dumps(body), content_type='application/json')
+
+    if status == STATUS_ERROR_BADMETHOD:
+        r['Allow'] = 'POST'
+
+    return r
+
+
 class API:
-    def __init__(self, request):
+    def __init__(self, request, params=None, json=False, notify=True, collect=False):
+        """
+        'params' are the parameters of the call (the POST data, unless
+        given). If 'json' is set, every response is a JSON object (see
+        api_v2). If 'notify' is False, no e-mails are sent. If 'collect'
+        is set, methods return a dictionary describing their outcome
+        instead of a HttpResponse, and e-mails are kept in 'outbox' to be
+        sent once the changes are committed (see api_public_batch).
+        """
         self.request = request
+        if params is None:
+            params = request.POST
+        self.params = params
+        self.json = json
+        self.notify = notify
+        self.collect = collect
+        self.outbox = []
+
+
+    def send_mail(self, *args, **kwargs):
+        """
+        send_templated_mail(), or, for a batched call, keep the e-mail to
+        send later.
+        """
+        if self.collect:
+            self.outbox.append((args, kwargs))
+        else:
+            send_templated_mail(*args, **kwargs)
+
+
+    def respond(self, status, text='', result=None):
+        """
+        Legacy calls get 'text' back as plain text, or 'result' as JSON if
+        there's no text. v2 calls get a JSON object holding the result or,
+        on failure, the text as its error. Batched calls get the same, but
+        as a dictionary.
+        """
+        if self.collect:
+            item = {'ok': status == STATUS_OK, 'status': status}
+            if result is not None:
+                item['result'] = result
+            if status != STATUS_OK:
+                item['error'] = text
+            return item
+        if self.json:
+            if status == STATUS_OK:
+                return api_json_return(status, result=result)
+            return api_json_return(status, error=text)
+        if result is not None and not text:
+            return api_return(status, simplejson.dumps(result), json=True)
+        return api_return(status, text)
 
 
     def api_public_create_ticket(self):
-        form = TicketForm(self.request.POST)
-        form.fields['queue'].choices = [[q.id, q.title] for q in Queue.objects.all()]
-        form.fields['assigned_to'].choices = [[u.id, u.username] for u in User.objects.filter(is_active=True)]
+        form = TicketForm(self.params)
+        form.fields['queue'].choices = queue_choices()
+        form.fields['assigned_to'].choices = user_choices()
 
         if form.is_valid():
-            ticket = form.save(user=self.request.user)
-            return api_return(STATUS_OK, "%s" % ticket.id)
+            ticket = form.save(user=self.request.user, notify=self.notify, send_mail=self.send_mail)
+            return self.respond(STATUS_OK, "%s" % ticket.id, result=ticket.id)
         else:
-            return api_return(STATUS_ERROR, text=form.errors.as_text())
+            return self.respond(STATUS_ERROR, form.errors.as_text())
 
 
     def api_public_list_queues(self):
-        return api_return(STATUS_OK, simplejson.dumps([{"id": "%s" % q.id, "title": "%s" % q.title} for q in Queue.objects.all()]), json=True)
+        return self.respond(STATUS_OK, result=[{"id": "%s" % q_id, "title": "%s" % q_title} for q_id, q_title in queue_choices()])
 
 
     def api_public_find_user(self):
-        username = self.request.POST.get('username', False)
+        username = self.params.get('username', False)
 
         try:
             u = User.objects.get(username=username)
-            return api_return(STATUS_OK, "%s" % u.id)
+            return self.respond(STATUS_OK, "%s" % u.id, result=u.id)
 
         except User.DoesNotExist:
-            return api_return(STATUS_ERROR, "Invalid username provided")
+            return self.respond(STATUS_ERROR, "Invalid username provided")
 
 
     def api_public_delete_ticket(self):
-        if not self.request.POST.get('confirm', False):
-            return api_return(STATUS_ERROR, "No confirmation provided")
+        if not self.params.get('confirm', False):
+            return self.respond(STATUS_ERROR, "No confirmation provided")
 
         try:
-            ticket = Ticket.objects.get(id=self.request.POST.get('ticket', False))
+            ticket = Ticket.objects.get(id=self.params.get('ticket', False))
         except Ticket.DoesNotExist:
-            return api_return(STATUS_ERROR, "Invalid ticket ID")
+            return self.respond(STATUS_ERROR, "Invalid ticket ID")
 
         ticket.delete()
 
-        return api_return(STATUS_OK)
+        return self.respond(STATUS_OK)
 
 
     def api_public_hold_ticket(self):
         try:
-            ticket = Ticket.objects.get(id=self.request.POST.get('ticket', False))
+            ticket = Ticket.objects.get(id=self.params.get('ticket', False))
         except Ticket.DoesNotExist:
-            return api_return(STATUS_ERROR, "Invalid ticket ID")
+            return self.respond(STATUS_ERROR, "Invalid ticket ID")
 
         ticket.on_hold = True
         ticket.save()
 
-        return api_return(STATUS_OK)
+        return self.respond(STATUS_OK)
 
 
     def api_public_unhold_ticket(self):
         try:
-            ticket = Ticket.objects.get(id=self.request.POST.get('ticket', False))
+            ticket = Ticket.objects.get(id=self.params.get('ticket', False))
         except Ticket.DoesNotExist:
-            return api_return(STATUS_ERROR, "Invalid ticket ID")
+            return self.respond(STATUS_ERROR, "Invalid ticket ID")
 
         ticket.on_hold = False
         ticket.save()
 
-        return api_return(STATUS_OK)
+        return self.respond(STATUS_OK)
 
 
     def api_public_add_followup(self):
         try:
-            ticket = Ticket.objects.get(id=self.request.POST.get('ticket', False))
+            ticket = Ticket.objects.get(id=self.params.get('ticket', False))
         except Ticket.DoesNotExist:
-            return api_return(STATUS_ERROR, "Invalid ticket ID")
+            return self.respond(STATUS_ERROR, "Invalid ticket ID")
 
-        message = self.request.POST.get('message', None)
-        public = self.request.POST.get('public', 'n')
+        message = self.params.get('message', None)
+        public = self.params.get('public', 'n')
 
         if public not in ['y', 'n']:
-            return api_return(STATUS_ERROR, "Invalid 'public' flag")
+            return self.respond(STATUS_ERROR, "Invalid 'public' flag")
 
         if not message:
-            return api_return(STATUS_ERROR, "Blank message")
+            return self.respond(STATUS_ERROR, "Blank message")
 
         f = FollowUp(
             ticket=ticket,
@@ -196,64 +366,65 @@ class API:
         context = safe_template_context(ticket)
         context['comment'] = f.comment
         
-        messages_sent_to = []
-
-        if public and ticket.submitter_email:
-            send_templated_mail(
-                'updated_submitter',
-                context,
-                recipients=ticket.submitter_email,
-                sender=ticket.queue.from_address,
-                fail_silently=True,
-                )
-            messages_sent_to.append(ticket.submitter_email)
-
-        if public:
-            for cc in ticket.ticketcc_set.all():
-                if cc.email_address not in messages_sent_to:
-                    send_templated_mail(
-                        'updated_submitter',
-                        context,
-                        recipients=cc.email_address,
-                        sender=ticket.queue.from_address,
-                        fail_silently=True,
-                        )
-                    messages_sent_to.append(cc.email_address)
-
-        if ticket.queue.updated_ticket_cc and ticket.queue.updated_ticket_cc not in messages_sent_to:
-            send_templated_mail(
-                'updated_cc',
-                context,
-                recipients=ticket.queue.updated_ticket_cc,
-                sender=ticket.queue.from_address,
-                fail_silently=True,
-                )
-            messages_sent_to.append(ticket.queue.updated_ticket_cc)
-
-        if ticket.assigned_to and self.request.user != ticket.assigned_to and getattr(ticket.assigned_to.usersettings.settings, 'email_on_ticket_apichange', False) and ticket.assigned_to.email and ticket.assigned_to.email not in messages_sent_to:
-            send_templated_mail(
-                'updated_owner',
-                context,
-                recipients=ticket.assigned_to.email,
-                sender=ticket.queue.from_address,
-                fail_silently=True,
-                )
+        if self.notify:
+            messages_sent_to = []
+
+            if public and ticket.submitter_email:
+                self.send_mail(
+                    'updated_submitter',
+                    context,
+                    recipients=ticket.submitter_email,
+                    sender=ticket.queue.from_address,
+                    fail_silently=True,
+                    )
+                messages_sent_to.append(ticket.submitter_email)
+
+            if public:
+                for cc in ticket.ticketcc_set.all():
+                    if cc.email_address not in messages_sent_to:
+                        self.send_mail(
+                            'updated_submitter',
+                            context,
+                            recipients=cc.email_address,
+                            sender=ticket.queue.from_address,
+                            fail_silently=True,
+                            )
+                        messages_sent_to.append(cc.email_address)
+
+            if ticket.queue.updated_ticket_cc and ticket.queue.updated_ticket_cc not in messages_sent_to:
+                self.send_mail(
+                    'updated_cc',
+                    context,
+                    recipients=ticket.queue.updated_ticket_cc,
+                    sender=ticket.queue.from_address,
+                    fail_silently=True,
+                    )
+                messages_sent_to.append(ticket.queue.updated_ticket_cc)
+
+            if ticket.assigned_to and self.request.user != ticket.assigned_to and getattr(ticket.assigned_to.usersettings.settings, 'email_on_ticket_apichange', False) and ticket.assigned_to.email and ticket.assigned_to.email not in messages_sent_to:
+                self.send_mail(
+                    'updated_owner',
+                    context,
+                    recipients=ticket.assigned_to.email,
+                    sender=ticket.queue.from_address,
+                    fail_silently=True,
+                    )
 
         ticket.save()
 
-        return api_return(STATUS_OK)
+        return self.respond(STATUS_OK)
 
 
     def api_public_resolve(self):
         try:
-            ticket = Ticket.objects.get(id=self.request.POST.get('ticket', False))
+            ticket = Ticket.objects.get(id=self.params.get('ticket', False))
         except Ticket.DoesNotExist:
-            return api_return(STATUS_ERROR, "Invalid ticket ID")
+            return self.respond(STATUS_ERROR, "Invalid ticket ID")
 
-        resolution = self.request.POST.get('resolution', None)
+        resolution = self.params.get('resolution', None)
 
         if not resolution:
-            return api_return(STATUS_ERROR, "Blank resolution")
+            return self.respond(STATUS_ERROR, "Blank resolution")
 
         f = FollowUp(
             ticket=ticket,
@@ -270,52 +441,320 @@ class API:
 
         subject = '%s %s (Resolved)' % (ticket.ticket, ticket.title)
         
-        messages_sent_to = []
-
-        if ticket.submitter_email:
-            send_templated_mail(
-                'resolved_submitter',
-                context,
-                recipients=ticket.submitter_email,
-                sender=ticket.queue.from_address,
-                fail_silently=True,
-                )
-            messages_sent_to.append(ticket.submitter_email)
-
-            for cc in ticket.ticketcc_set.all():
-                if cc.email_address not in messages_sent_to:
-                    send_templated_mail(
-                        'resolved_submitter',
-                        context,
-                        recipients=cc.email_address,
-                        sender=ticket.queue.from_address,
-                        fail_silently=True,
-                        )
-                    messages_sent_to.append(cc.email_address)
-
-        if ticket.queue.updated_ticket_cc and ticket.queue.updated_ticket_cc not in messages_sent_to:
-            send_templated_mail(
-                'resolved_cc',
-                context,
-                recipients=ticket.queue.updated_ticket_cc,
-                sender=ticket.queue.from_address,
-                fail_silently=True,
-                )
-            messages_sent_to.append(ticket.queue.updated_ticket_cc)
-
-        if ticket.assigned_to and self.request.user != ticket.assigned_to and getattr(ticket.assigned_to.usersettings.settings, 'email_on_ticket_apichange', False) and ticket.assigned_to.email and ticket.assigned_to.email not in messages_sent_to:
-            send_templated_mail(
-                'resolved_resolved',
-                context,
-                recipients=ticket.assigned_to.email,
-                sender=ticket.queue.from_address,
-                fail_silently=True,
-                )
+        if self.notify:
+            messages_sent_to = []
+
+            if ticket.submitter_email:
+                self.send_mail(
+                    'resolved_submitter',
+                    context,
+                    recipients=ticket.submitter_email,
+                    sender=ticket.queue.from_address,
+                    fail_silently=True,
+                    )
+                messages_sent_to.append(ticket.submitter_email)
+
+                for cc in ticket.ticketcc_set.all():
+                    if cc.email_address not in messages_sent_to:
+                        self.send_mail(
+                            'resolved_submitter',
+                            context,
+                            recipients=cc.email_address,
+                            sender=ticket.queue.from_address,
+                            fail_silently=True,
+                            )
+                        messages_sent_to.append(cc.email_address)
+
+            if ticket.queue.updated_ticket_cc and ticket.queue.updated_ticket_cc not in messages_sent_to:
+                self.send_mail(
+                    'resolved_cc',
+                    context,
+                    recipients=ticket.queue.updated_ticket_cc,
+                    sender=ticket.queue.from_address,
+                    fail_silently=True,
+                    )
+                messages_sent_to.append(ticket.queue.updated_ticket_cc)
+
+            if ticket.assigned_to and self.request.user != ticket.assigned_to and getattr(ticket.assigned_to.usersettings.settings, 'email_on_ticket_apichange', False) and ticket.assigned_to.email and ticket.assigned_to.email not in messages_sent_to:
+                self.send_mail(
+                    'resolved_resolved',
+                    context,
+                    recipients=ticket.assigned_to.email,
+                    sender=ticket.queue.from_address,
+                    fail_silently=True,
+                    )
 
         ticket.resoltuion = f.comment
         ticket.status = Ticket.RESOLVED_STATUS
 
         ticket.save()
 
-        return api_return(STATUS_OK)
+        return self.respond(STATUS_OK)
+
+
+    def api_public_batch(self):
+        """
+        Run a list of operations, each a dictionary with the 'method' to
+        call and its 'params', in a single request and transaction. Each
+        operation runs in its own savepoint, so one that fails is rolled
+        back without affecting the others. Returns a list with the outcome
+        of each operation, in the same order.
+
+        Databases without savepoints (SQLite and MySQL, in this version of
+        Django) can't roll back a single operation, so there an operation
+        which raises an error rolls back the whole batch, and the call
+        fails.
+        """
+        operations = self.params.get('operations', None)
+        if isinstance(operations, basestring):
+            try:
+                operations = simplejson.loads(operations)
+            except ValueError:
+                return self.respond(STATUS_ERROR, "Invalid JSON in 'operations'")
+        if not isinstance(operations, list):
+            return self.respond(STATUS_ERROR, "No operations provided")
+        if len(operations) > helpdesk_settings.HELPDESK_API_BATCH_MAX_OPERATIONS:
+            return self.respond(STATUS_ERROR, "Too many operations (the maximum is %s)" % helpdesk_settings.HELPDESK_API_BATCH_MAX_OPERATIONS)
+
+        notify = self.params.get('notify', True)
+        if notify in ('n', 'false', '0'):
+            notify = False
+
+        try:
+            results = run_batch(self.request, operations, bool(notify))
+        except BatchAborted, e:
+            return self.respond(STATUS_ERROR, "%s" % e)
+        return self.respond(STATUS_OK, result=results)
+
+
+    def api_public_list_tickets(self):
+        """
+        List tickets in ID order, 'limit' at a time. Pass the 'next' value
+        from one page as 'after' to get the next page, or set 'format' to
+        'ndjson' to stream every matching ticket as one JSON object per line.
+        """
+        fields, error = self._ticket_fields()
+        if error:
+            return self.respond(STATUS_ERROR, error)
+
+        query_params = {
+            'filtering': {},
+            'other_filter': None,
+            'sorting': 'id',
+            }
+        try:
+            for param, lookup in (('queue', 'queue__id__in'), ('status', 'status__in'), ('assigned_to', 'assigned_to__id__in')):
+                values = self._int_list(param)
+                if values:
+                    query_params['filtering'][lookup] = values
+            after = int(self.params.get('after', 0) or 0)
+            limit = int(self.params.get('limit', 0) or helpdesk_settings.HELPDESK_API_LIST_MAX_RESULTS)
+        except (TypeError, ValueError):
+            return self.respond(STATUS_ERROR, "Invalid numeric parameter")
+        limit = max(1, min(limit, helpdesk_settings.HELPDESK_API_LIST_MAX_RESULTS))
+
+        if self.params.get('submitter_email', None):
+            query_params['filtering']['submitter_email'] = self.params['submitter_email']
+
+        q = self.params.get('q', None)
+        if q:
+            query_params['other_filter'] = (
+                Q(title__icontains=q) |
+                Q(description__icontains=q) |
+                Q(resolution__icontains=q) |
+                Q(submitter_email__icontains=q)
+                )
+
+        tickets = apply_query(Ticket.objects.all(), query_params).order_by('id').values(*fields)
+
+        if self.params.get('format', None) == 'ndjson' and not self.collect:
+            return HttpResponse(stream_tickets(tickets, after, limit), content_type='application/x-ndjson')
+
+        rows = [ticket_row(t) for t in tickets.filter(id__gt=after)[:limit]]
+        next_after = None
+        if len(rows) == limit:
+            next_after = rows[-1]['id']
+        return self.respond(STATUS_OK, result={'tickets': rows, 'next': next_after})
+
+
+    def api_public_get_ticket(self):
+        fields, error = self._ticket_fields()
+        if error:
+            return self.respond(STATUS_ERROR, error)
+
+        try:
+            ticket = Ticket.objects.filter(id=int(self.params.get('ticket', 0))).values(*fields)[0]
+        except (TypeError, ValueError, IndexError):
+            return self.respond(STATUS_ERROR_NOT_FOUND, "Invalid ticket ID")
+
+        return self.respond(STATUS_OK, result=ticket_row(ticket))
 
+
+    def api_public_ticket_events(self):
+        """
+        Return up to 'limit' events from the ticket event log (see
+        events.DatabaseBroker) with an ID greater than 'after'. Pass the
+        'next' value as 'after' in the following call to read on from
+        there.
+        """
+        try:
+            after = int(self.params.get('after', 0) or 0)
+            limit = int(self.params.get('limit', 0) or helpdesk_settings.HELPDESK_API_LIST_MAX_RESULTS)
+        except (TypeError, ValueError):
+            return self.respond(STATUS_ERROR, "Invalid numeric parameter")
+        limit = max(1, min(limit, helpdesk_settings.HELPDESK_API_LIST_MAX_RESULTS))
+
+        if not event_log_enabled():
+            return self.respond(STATUS_ERROR, "The ticket event log is not enabled")
+
+        events = DatabaseBroker().events_after(after, limit=limit)
+        if events:
+            after = events[-1]['id']
+        return self.respond(STATUS_OK, result={'events': events, 'next': after})
+
+
+    def _ticket_fields(self):
+        """
+        Returns a tuple of the ticket fields requested with the 'fields'
+        parameter (a list, or comma-separated string) and an error message.
+        The ticket ID is always included.
+        """
+        fields = self.params.get('fields', None)
+        if not fields:
+            return DEFAULT_TICKET_API_FIELDS, None
+        if isinstance(fields, basestring):
+            fields = fields.split(',')
+        fields = [f.strip() for f in fields if f.strip()]
+
+        invalid = [f for f in fields if f not in TICKET_API_FIELDS]
+        if invalid:
+            return None, "Invalid field(s): %s" % ', '.join(invalid)
+        if 'id' not in fields:
+            fields.insert(0, 'id')
+        return fields, None
+
+
+    def read_generations(self, method):
+        """
+        The names of the generation counters (see
+        helpdesk.lib.get_generations) covering the data returned by one of
+        the API_READ_METHODS, called with these parameters.
+        """
+        if method == 'list_queues':
+            return ['queues']
+        elif method == 'find_user':
+            return ['users']
+        elif method == 'list_tickets':
+            try:
+                return ticket_generations(self._int_list('queue'))
+            except (TypeError, ValueError):
+                return ticket_generations()
+        return ticket_generations() + ['followups']
+
+    def _int_list(self, param):
+        """
+        Returns a parameter given as a list, or a comma-separated string,
+        as a list of integers.
+        """
+        value = self.params.get(param, None)
+        if value in (None, ''):
+            return []
+        if isinstance(value, basestring):
+            value = value.split(',')
+        elif not isinstance(value, list):
+            value = [value]
+        return [int(v) for v in value]
+
+
+BATCH_METHODS = ('create_ticket', 'add_followup', 'resolve', 'hold_ticket', 'unhold_ticket', 'delete_ticket')
+
+
+class BatchAborted(Exception):
+    """
+    An operation in a batch failed on a database that can't roll back just
+    that operation, so the whole batch was rolled back.
+    """
+
+
+def run_batch(request, operations, notify):
+    """
+    Run the operations of a batch call (see API.api_public_batch),
+    returning the outcome of each. E-mails about the changes are only sent
+    once they have all been committed, and only for operations which
+    succeeded. Raises BatchAborted if the batch had to be rolled back.
+    """
+    mark = commit_hooks_mark()
+    try:
+        results, outbox = _run_batch(request, operations, notify)
+    except BatchAborted:
+        discard_commit_hooks(mark)
+        raise
+    for args, kwargs in outbox:
+        send_templated_mail(*args, **kwargs)
+    return results
+
+
+def _run_batch(request, operations, notify):
+    results = []
+    outbox = []
+    savepoints = connection.features.uses_savepoints
+    for operation in operations:
+        if not isinstance(operation, dict) or operation.get('method') not in BATCH_METHODS:
+            results.append({'ok': False, 'status': STATUS_ERROR, 'error': 'Invalid method'})
+            continue
+        params = operation.get('params', {})
+        if not isinstance(params, dict):
+            results.append({'ok': False, 'status': STATUS_ERROR, 'error': 'Invalid params'})
+            continue
+
+        api = API(request, params=params, notify=notify, collect=True)
+        # Cache invalidations (and events, unless the event broker saves
+        # them in the transaction) queued by an operation which is rolled
+        # back are dropped with it.
+        mark = commit_hooks_mark()
+        sid = transaction.savepoint()
+        try:
+            result = getattr(api, 'api_public_%s' % operation['method'])()
+        except Exception, e:
+            if not savepoints:
+                # Whatever the operation wrote before failing can't be
+                # undone on its own.
+                raise BatchAborted('Operation %s failed, so no changes were made: %s' % (len(results), e))
+            transaction.savepoint_rollback(sid)
+            discard_commit_hooks(mark)
+            result = {'ok': False, 'status': STATUS_ERROR, 'error': '%s' % e}
+        else:
+            if result['ok']:
+                transaction.savepoint_commit(sid)
+                outbox.extend(api.outbox)
+            elif savepoints:
+                transaction.savepoint_rollback(sid)
+                discard_commit_hooks(mark)
+        results.append(result)
+    return results, outbox
+_run_batch = transaction.commit_on_success(_run_batch)
+
+
+def ticket_row(ticket):
+    """
+    Make a row from Ticket.objects.values() serialisable as JSON.
+    """
+    for key, value in ticket.items():
+        if isinstance(value, datetime):
+            ticket[key] = value.isoformat()
+    return ticket
+
+
+def stream_tickets(tickets, after, batch_size):
+    """
+    Yield every ticket in 'tickets' with an ID above 'after' as a line of
+    JSON, fetching them 'batch_size' at a time so that a large result set
+    is never held in memory all at once.
+    """
+    while True:
+        rows = list(tickets.filter(id__gt=after)[:batch_size])
+        for row in rows:
+            yield simplejson.dumps(ticket_row(row)) + '\n'
+        if len(rows) < batch_size:
+            break
+        after = rows[-1]['id']
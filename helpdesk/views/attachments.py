@@ -0,0 +1,160 @@
+"""
+django-helpdesk - A Django powered ticket tracker for small enterprise.
+
+(c) Copyright 2008 Jutda. All Rights Reserved. See LICENSE for details.
+
+views/attachments.py - Serves attachments to staff and to the person who
+                       submitted the ticket, rather than leaving them open
+                       to anybody under MEDIA_URL.
+"""
+
+import re
+import time
+
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseNotModified
+from django.shortcuts import get_object_or_404
+from django.utils.http import http_date, parse_http_date_safe, parse_etags, quote_etag, urlquote
+
+from helpdesk import settings as helpdesk_settings
+from helpdesk.models import Attachment
+
+# Only a single range of bytes is supported; requests for several ranges
+# get the whole file, which HTTP allows.
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+CHUNK_SIZE = 64 * 1024
+
+# Control characters (including CR and LF), and the characters which would
+# end or escape a quoted filename.
+UNSAFE_FILENAME_RE = re.compile(r'[\x00-\x1f\x7f"\\]')
+
+
+def can_download(request, attachment):
+    """
+    Staff (or, with HELPDESK_ALLOW_NON_STAFF_TICKET_UPDATE, any active user)
+    may download any attachment. Anybody else must give the ticket's ID and
+    submitter e-mail address, as on the public ticket view, and can only
+    download attachments on public follow-ups.
+    """
+    user = request.user
+    if user.is_authenticated() and user.is_active and (user.is_staff or helpdesk_settings.HELPDESK_ALLOW_NON_STAFF_TICKET_UPDATE):
+        return True
+
+    ticket = attachment.followup.ticket
+    return (attachment.followup.public
+        and request.GET.get('ticket', '') == ticket.ticket_for_url
+        and request.GET.get('email', '').lower() == (ticket.submitter_email or '').lower()
+        and bool(ticket.submitter_email))
+
+
+def parse_range(header, size):
+    """
+    Returns the (first, last) byte positions asked for by a Range header,
+    None if the whole file should be sent, or False if the range can't be
+    satisfied.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first:
+        first = int(first)
+        if last:
+            last = min(int(last), size - 1)
+        else:
+            last = size - 1
+    else:
+        # A suffix range: the last N bytes.
+        first = max(size - int(last), 0)
+        last = size - 1
+    if first > last or first >= size:
+        return False
+    return first, last
+
+
+def content_disposition(filename):
+    """
+    A Content-Disposition header value which downloads the file as
+    'filename'. Unsafe characters are removed. Browsers which understand
+    RFC 2231 get the name in full through filename*, and others get
+    the closest plain ASCII name.
+    """
+    import unicodedata
+    from django.utils.encoding import force_unicode
+    name = UNSAFE_FILENAME_RE.sub('', force_unicode(filename)).strip() or u'attachment'
+    ascii_name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').strip() or 'attachment'
+    return "attachment; filename=\"%s\"; filename*=UTF-8''%s" % (ascii_name, urlquote(name, safe=''))
+
+
+def file_chunks(file, first, last):
+    """
+    Yield the bytes from 'first' to 'last' (inclusive) of a FieldFile, a
+    chunk at a time, so the file is never read into memory all at once.
+    """
+    file.open('rb')
+    try:
+        file.seek(first)
+        remaining = last - first + 1
+        while remaining > 0:
+            data = file.read(min(CHUNK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+    finally:
+        file.close()
+
+
+def download_attachment(request, attachment_id):
+    attachment = get_object_or_404(Attachment.objects.select_related('followup__ticket'), id=attachment_id)
+    if not can_download(request, attachment):
+        return HttpResponseForbidden()
+
+    # Attachments never change once saved, so the ID and size identify the
+    # contents.
+    etag = 'attachment-%s-%s' % (attachment.id, attachment.size)
+    last_modified = int(time.mktime(attachment.followup.date.timetuple()))
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH', None)
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    if (if_none_match and etag in parse_etags(if_none_match)) or (
+            not if_none_match and if_modified_since and if_modified_since >= last_modified):
+        return HttpResponseNotModified()
+
+    sendfile = helpdesk_settings.HELPDESK_ATTACHMENT_SENDFILE
+    if sendfile:
+        # The web server sends the file, and handles any Range itself.
+        response = HttpResponse(content_type=attachment.mime_type)
+        if sendfile.lower() == 'x-accel-redirect':
+            response['X-Accel-Redirect'] = helpdesk_settings.HELPDESK_ATTACHMENT_ACCEL_REDIRECT_PREFIX + urlquote(attachment.file.name)
+        else:
+            response[sendfile] = attachment.file.path
+    else:
+        size = attachment.size
+        byte_range = None
+        if_range = request.META.get('HTTP_IF_RANGE', None)
+        if 'HTTP_RANGE' in request.META and (not if_range or if_range in (quote_etag(etag), http_date(last_modified))):
+            byte_range = parse_range(request.META['HTTP_RANGE'], size)
+
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%s' % size
+            return response
+
+        if byte_range:
+            first, last = byte_range
+            response = HttpResponse(file_chunks(attachment.file, first, last), status=206, content_type=attachment.mime_type)
+            response['Content-Range'] = 'bytes %s-%s/%s' % (first, last, size)
+        else:
+            first, last = 0, size - 1
+            response = HttpResponse(file_chunks(attachment.file, first, last), content_type=attachment.mime_type)
+        response['Content-Length'] = str(last - first + 1)
+        response['Accept-Ranges'] = 'bytes'
+
+    # Always download rather than display, so an uploaded HTML file can't
+    # run scripts on the helpdesk's site.
+    response['Content-Disposition'] = content_disposition(attachment.filename)
+    response['X-Content-Type-Options'] = 'nosniff'
+    response['ETag'] = quote_etag(etag)
+    response['Last-Modified'] = http_date(last_modified)
+    return response
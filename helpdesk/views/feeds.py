@@ -9,11 +9,30 @@ views/feeds.py - A handful of staff-only RSS feeds to provide ticket details
 
 from django.contrib.auth.models import User
 from django.contrib.syndication.feeds import Feed
+from django.contrib.syndication.views import feed as django_feed
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.db.models import Q
-from django.utils.translation import ugettext as _
+from django.http import HttpResponse
+from django.utils.encoding import smart_str
+from django.utils.hashcompat import md5_constructor
+from django.utils.translation import ugettext as _, get_language
 
+from helpdesk.lib import get_generations, data_etag, ticket_generations, STAFF_PAGE_GENERATIONS
 from helpdesk.models import Ticket, FollowUp, Queue
+from helpdesk import settings as helpdesk_settings
+
+
+def feed_tickets(tickets):
+    """
+    Limit and order the tickets shown in a feed, loading their queue and
+    owner along with them as the item templates use both.
+    """
+    return tickets.select_related(
+            'queue', 'assigned_to'
+        ).order_by(
+            *helpdesk_settings.HELPDESK_FEED_ORDERING
+        )[:helpdesk_settings.HELPDESK_FEED_MAX_ITEMS]
 
 
 class OpenTicketsByUser(Feed):
@@ -67,19 +86,19 @@ class OpenTicketsByUser(Feed):
 
     def items(self, obj):
         if obj['queue']:
-            return Ticket.objects.filter(
+            return feed_tickets(Ticket.objects.filter(
                     assigned_to=obj['user']
                 ).filter(
                     queue=obj['queue']
                 ).filter(
                     Q(status=Ticket.OPEN_STATUS) | Q(status=Ticket.REOPENED_STATUS)
-                )
+                ))
         else:
-            return Ticket.objects.filter(
+            return feed_tickets(Ticket.objects.filter(
                     assigned_to=obj['user']
                 ).filter(
                     Q(status=Ticket.OPEN_STATUS) | Q(status=Ticket.REOPENED_STATUS)
-                )
+                ))
 
     def item_pubdate(self, item):
         return item.created
@@ -100,11 +119,11 @@ class UnassignedTickets(Feed):
     link = ''#%s?assigned_to=' % reverse('helpdesk_list')
 
     def items(self, obj):
-        return Ticket.objects.filter(
+        return feed_tickets(Ticket.objects.filter(
                 assigned_to__isnull=True
             ).filter(
                 Q(status=Ticket.OPEN_STATUS) | Q(status=Ticket.REOPENED_STATUS)
-            )
+            ))
 
     def item_pubdate(self, item):
         return item.created
@@ -126,7 +145,9 @@ class RecentFollowUps(Feed):
     link = '/tickets/' # reverse('helpdesk_list')
 
     def items(self):
-        return FollowUp.objects.order_by('-date')[:20]
+        return FollowUp.objects.select_related(
+                'ticket__queue', 'user'
+            ).order_by('-date')[:helpdesk_settings.HELPDESK_FEED_MAX_ITEMS]
 
 
 class OpenTicketsByQueue(Feed):
@@ -155,11 +176,11 @@ class OpenTicketsByQueue(Feed):
             )
 
     def items(self, obj):
-        return Ticket.objects.filter(
+        return feed_tickets(Ticket.objects.filter(
                 queue=obj
             ).filter(
                 Q(status=Ticket.OPEN_STATUS) | Q(status=Ticket.REOPENED_STATUS)
-            )
+            ))
 
     def item_pubdate(self, item):
         return item.created
@@ -178,3 +199,61 @@ feed_setup = {
     'unassigned': UnassignedTickets,
 }
 
+
+def feed_generations(url):
+    """
+    Returns the names of the generation counters (see
+    helpdesk.lib.get_generations) covering everything shown in the feed at
+    'url', or None if the feed doesn't exist.
+    """
+    bits = url.split('/')
+    if bits[0] == 'user' and len(bits) in (2, 3):
+        user_ids = User.objects.filter(username__exact=bits[1]).values_list('id', flat=True)
+        if not user_ids:
+            return None
+        return ['assignee:%s' % user_ids[0]]
+    elif bits[0] == 'queue' and len(bits) == 2:
+        queue_ids = Queue.objects.filter(slug__exact=bits[1]).values_list('id', flat=True)
+        if not queue_ids:
+            return None
+        return ['queue:%s' % queue_ids[0]]
+    elif url == 'unassigned':
+        return ['assignee:none']
+    elif url == 'recent_activity':
+        return ['followups', 'tickets']
+    return None
+
+
+def feed_etag(request, url, feed_dict=None):
+    """
+    An ETag for use with django.views.decorators.http.condition on feeds,
+    which only changes when the tickets (or follow-ups) in the feed do.
+    """
+    generation_names = feed_generations(url) or ticket_generations() + ['followups']
+    return data_etag(request, generation_names + list(STAFF_PAGE_GENERATIONS))
+
+
+def cached_feed(request, url, feed_dict=None):
+    """
+    A wrapper around Django's feed view which caches each rendered feed
+    until the tickets (or follow-ups) in it change, so that feed readers
+    polling a busy queue don't rebuild it every time.
+    """
+    timeout = helpdesk_settings.HELPDESK_FEED_CACHE_TIMEOUT
+    generation_names = feed_generations(url)
+    if not timeout or generation_names is None:
+        return django_feed(request, url, feed_dict)
+
+    key = 'helpdesk:feed:%s:%s' % (
+        md5_constructor('%s|%s' % (smart_str(url), get_language())).hexdigest(),
+        ':'.join([str(g) for g in get_generations(generation_names)]),
+        )
+    cached = cache.get(key)
+    if cached is not None:
+        content, content_type = cached
+        return HttpResponse(content, content_type=content_type)
+
+    response = django_feed(request, url, feed_dict)
+    if response.status_code == 200:
+        cache.set(key, (response.content, response['Content-Type']), timeout)
+    return response
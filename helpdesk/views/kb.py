@@ -16,6 +16,7 @@ from django.template import RequestContext
 from django.utils.translation import ugettext as _
 
 from helpdesk import settings as helpdesk_settings
+from helpdesk.lib import record_kb_vote
 from helpdesk.models import KBCategory, KBItem
 
 
@@ -50,13 +51,10 @@ def item(request, item):
 
 
 def vote(request, item):
-    item = get_object_or_404(KBItem, pk=item)
+    item = get_object_or_404(KBItem.objects.only('id'), pk=item)
     vote = request.GET.get('vote', None)
     if vote in ('up', 'down'):
-        item.votes += 1
-        if vote == 'up':
-            item.recommendations += 1
-        item.save()
+        record_kb_vote(item.id, vote == 'up')
 
     return HttpResponseRedirect(item.get_absolute_url())
 
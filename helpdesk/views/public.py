@@ -17,8 +17,9 @@ from django.utils.translation import ugettext as _
 
 from helpdesk import settings as helpdesk_settings
 from helpdesk.forms import PublicTicketForm
-from helpdesk.lib import send_templated_mail, text_is_spam
+from helpdesk.lib import send_templated_mail, text_is_spam, queue_choices
 from helpdesk.models import Ticket, Queue, UserSettings
+from helpdesk.spam import get_spam_service, check_ticket_later
 
 
 def homepage(request):
@@ -36,18 +37,23 @@ def homepage(request):
 
     if request.method == 'POST':
         form = PublicTicketForm(request.POST, request.FILES)
-        form.fields['queue'].choices = [('', '--------')] + [[q.id, q.title] for q in Queue.objects.filter(allow_public_submission=True)]
+        form.fields['queue'].choices = [('', '--------')] + queue_choices(public_only=True)
         if form.is_valid():
-            if text_is_spam(form.cleaned_data['body'], request):
+            if helpdesk_settings.HELPDESK_SPAM_CHECK_BACKGROUND and get_spam_service():
+                # Keep the ticket on hold, without e-mailing anybody, until
+                # it has been checked.
+                ticket = form.save(notify=False, on_hold=True)
+                check_ticket_later(ticket, form.cleaned_data['body'], request)
+            elif text_is_spam(form.cleaned_data['body'], request):
                 # This submission is spam. Let's not save it.
                 return render_to_response('helpdesk/public_spam.html', RequestContext(request, {}))
             else:
                 ticket = form.save()
-                return HttpResponseRedirect('%s?ticket=%s&email=%s'% (
-                    reverse('helpdesk_public_view'),
-                    ticket.ticket_for_url,
-                    ticket.submitter_email)
-                    )
+            return HttpResponseRedirect('%s?ticket=%s&email=%s'% (
+                reverse('helpdesk_public_view'),
+                ticket.ticket_for_url,
+                ticket.submitter_email)
+                )
     else:
         try:
             queue = Queue.objects.get(slug=request.GET.get('queue', None))
@@ -61,7 +67,7 @@ def homepage(request):
             initial_data['submitter_email'] = request.user.email
 
         form = PublicTicketForm(initial=initial_data)
-        form.fields['queue'].choices = [('', '--------')] + [[q.id, q.title] for q in Queue.objects.filter(allow_public_submission=True)]
+        form.fields['queue'].choices = [('', '--------')] + queue_choices(public_only=True)
 
     return render_to_response('helpdesk/public_homepage.html',
         RequestContext(request, {
@@ -9,6 +9,7 @@ views/staff.py - The bulk of the application - provides most business logic and
 
 from datetime import datetime
 import sys
+import time
 
 from django.conf import settings
 from django.contrib.auth.models import User
@@ -23,13 +24,17 @@ from django.http import HttpResponseRedirect, Http404, HttpResponse, HttpRespons
 from django.shortcuts import render_to_response, get_object_or_404
 from django.template import loader, Context, RequestContext
 from django.utils.translation import ugettext as _
+from django.utils import simplejson
 from django.utils.html import escape
+from django.views.decorators.http import condition
 from django import forms
 
+from helpdesk.events import get_broker
 from helpdesk.forms import TicketForm, UserSettingsForm, EmailIgnoreForm, EditTicketForm, TicketCCForm, EditFollowUpForm, TicketDependencyForm
-from helpdesk.lib import send_templated_mail, query_to_dict, apply_query, safe_template_context
+from helpdesk.lib import send_templated_mail, query_to_dict, apply_query, safe_template_context, saved_search_ticket_ids, hydrate_tickets, queue_choices, user_choices, followup_fragments, staff_page_etag, save_attachment, blocked_ticket_ids, add_ticket_dependency, ticket_list_columns, ticket_list_queryset, navigation_context
 from helpdesk.models import Ticket, Queue, FollowUp, TicketChange, PreSetReply, Attachment, SavedSearch, IgnoreEmail, TicketCC, TicketDependency
 from helpdesk.settings import HAS_TAG_SUPPORT
+from helpdesk.templatetags.ticket_to_link import preload_ticket_links
 from helpdesk import settings as helpdesk_settings
   
 if HAS_TAG_SUPPORT:
@@ -52,31 +57,15 @@ def dashboard(request):
     with options for them to 'Take' ownership of said tickets.
     """
 
-    # open & reopened tickets, assigned to current user
-    tickets = Ticket.objects.filter(
-            assigned_to=request.user,
-        ).exclude(
-            status__in = [Ticket.CLOSED_STATUS, Ticket.RESOLVED_STATUS],
-        )
-
-    # closed & resolved tickets, assigned to current user
-    tickets_closed_resolved =  Ticket.objects.filter(
-            assigned_to=request.user, 
-            status__in = [Ticket.CLOSED_STATUS, Ticket.RESOLVED_STATUS])
-
-    unassigned_tickets = Ticket.objects.filter(
-            assigned_to__isnull=True,
-        ).exclude(
-            status=Ticket.CLOSED_STATUS,
-        )
-
-    # all tickets, reported by current user
-    all_tickets_reported_by_current_user = ''
-    email_current_user = request.user.email
-    if email_current_user:
-        all_tickets_reported_by_current_user = Ticket.objects.filter(
-            submitter_email=email_current_user,
-        ).order_by('status')
+    # Each list of tickets is cut short at HELPDESK_DASHBOARD_SECTION_SIZE,
+    # with a link to the rest (see dashboard_section).
+    size = helpdesk_settings.HELPDESK_DASHBOARD_SECTION_SIZE
+    sections = {}
+    more = {}
+    for name, queryset in dashboard_querysets(request.user).items():
+        rows = list(queryset[:size + 1])
+        sections[name] = rows[:size]
+        more[name] = len(rows) > size
 
 
     # The following query builds a grid of queues & ticket statuses,
@@ -118,13 +107,85 @@ def dashboard(request):
 
     return render_to_response('helpdesk/dashboard.html',
         RequestContext(request, {
-            'user_tickets': tickets,
-            'user_tickets_closed_resolved': tickets_closed_resolved,
-            'unassigned_tickets': unassigned_tickets,
-            'all_tickets_reported_by_current_user': all_tickets_reported_by_current_user,
+            'user_tickets': sections['assigned'],
+            'user_tickets_closed_resolved': sections['closed'],
+            'unassigned_tickets': sections['unassigned'],
+            'all_tickets_reported_by_current_user': sections.get('submitted', ''),
+            'more': more,
             'dash_tickets': dash_tickets,
         }))
-dashboard = staff_member_required(dashboard)
+dashboard = staff_member_required(condition(etag_func=staff_page_etag)(dashboard))
+
+
+def dashboard_querysets(user):
+    """
+    The lists of tickets shown on the dashboard, by section name, each in
+    the order they are shown with the queue (which every row shows) joined
+    in.
+    """
+    done_statuses = [Ticket.CLOSED_STATUS, Ticket.RESOLVED_STATUS]
+    sections = {
+        # open & reopened tickets, assigned to current user
+        'assigned': Ticket.objects.filter(
+                assigned_to=user,
+            ).exclude(
+                status__in=done_statuses,
+            ).order_by('priority', '-modified'),
+
+        # closed & resolved tickets, assigned to current user
+        'closed': Ticket.objects.filter(
+                assigned_to=user,
+                status__in=done_statuses,
+            ).order_by('-modified'),
+
+        'unassigned': Ticket.objects.filter(
+                assigned_to__isnull=True,
+            ).exclude(
+                status=Ticket.CLOSED_STATUS,
+            ).order_by('priority', 'created'),
+        }
+
+    # all tickets, reported by current user
+    if user.email:
+        sections['submitted'] = Ticket.objects.filter(
+                submitter_email=user.email,
+            ).order_by('status', '-modified')
+
+    for name, queryset in sections.items():
+        sections[name] = queryset.select_related('queue')
+    return sections
+
+
+def dashboard_section(request, section):
+    """
+    All of the tickets in one of the dashboard's lists, a page at a time.
+    """
+    titles = {
+        'assigned': _('Open Tickets assigned to you (you are working on this ticket)'),
+        'closed': _('Closed & resolved Tickets you used to work on'),
+        'unassigned': _('Unassigned Tickets'),
+        'submitted': _('All Tickets submitted by you'),
+        }
+    sections = dashboard_querysets(request.user)
+    if section not in sections:
+        raise Http404
+
+    ticket_paginator = paginator.Paginator(sections[section], request.user.usersettings.settings.get('tickets_per_page') or 20)
+    try:
+        page = int(request.GET.get('page', '1'))
+    except ValueError:
+        page = 1
+    try:
+        tickets = ticket_paginator.page(page)
+    except (paginator.EmptyPage, paginator.InvalidPage):
+        tickets = ticket_paginator.page(ticket_paginator.num_pages)
+
+    return render_to_response('helpdesk/dashboard_section.html',
+        RequestContext(request, {
+            'title': titles[section],
+            'tickets': tickets,
+        }))
+dashboard_section = staff_member_required(condition(etag_func=staff_page_etag)(dashboard_section))
 
 
 def delete_ticket(request, ticket_id):
@@ -217,20 +278,23 @@ def view_ticket(request, ticket_id):
 
         return update_ticket(request, ticket_id)
 
-    if helpdesk_settings.HELPDESK_STAFF_ONLY_TICKET_OWNERS:
-        users = User.objects.filter(is_active=True, is_staff=True).order_by('username')
-    else:
-        users = User.objects.filter(is_active=True).order_by('username')
-
-
     # TODO: shouldn't this template get a form to begin with?
     form = TicketForm(initial={'due_date':ticket.due_date})
 
+    # Resolve every '#1234' style ticket link in the follow-ups at once,
+    # rather than one at a time as each comment is rendered.
+    followups = list(ticket.followup_set.select_related('user'))
+    preload_ticket_links([f.comment for f in followups])
+
+    fragments = followup_fragments(followups)
+    for followup in followups:
+        followup.fragment = fragments[followup.id]
+
     return render_to_response('helpdesk/ticket.html',
         RequestContext(request, {
             'ticket': ticket,
+            'followups': followups,
             'form': form,
-            'active_users': users,
             'priorities': Ticket.PRIORITY_CHOICES,
             'preset_replies': PreSetReply.objects.filter(Q(queues=ticket.queue) | Q(queues__isnull=True)),
             'tags_enabled': HAS_TAG_SUPPORT,
@@ -310,22 +374,8 @@ def update_ticket(request, ticket_id, public=False):
 
     files = []
     if request.FILES:
-        import mimetypes, os
         for file in request.FILES.getlist('attachment'):
-            filename = file.name.replace(' ', '_')
-            a = Attachment(
-                followup=f,
-                filename=filename,
-                mime_type=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
-                size=file.size,
-                )
-            a.file.save(file.name, file, save=False)
-            a.save()
-
-            if file.size < getattr(settings, 'MAX_EMAIL_ATTACHMENT_SIZE', 512000):
-                # Only files smaller than 512kb (or as defined in
-                # settings.MAX_EMAIL_ATTACHMENT_SIZE) are sent via email.
-                files.append(a.file.path)
+            files.append(save_attachment(f, file, file.name.replace(' ', '_')))
 
 
     if title != ticket.title:
@@ -687,24 +737,36 @@ def ticket_list(request):
         sortreverse = request.GET.get('sortreverse', None)
         query_params['sortreverse'] = sortreverse
 
+    columns = ticket_list_columns(request.user.usersettings.settings)
     try:
-        ticket_qs = apply_query(Ticket.objects.select_related(), query_params)
+        ticket_qs = apply_query(ticket_list_queryset(columns), query_params)
     except ValidationError:
         # invalid parameters in query, return default query
         query_params = {
             'filtering': {'status__in': [1, 2, 3]},
             'sorting': 'created',
         }
-        ticket_qs = apply_query(Ticket.objects.select_related(), query_params)
+        ticket_qs = apply_query(ticket_list_queryset(columns), query_params)
 
     ## TAG MATCHING
+    tags = []
     if HAS_TAG_SUPPORT:
         tags = request.GET.getlist('tags')
         if tags:
             ticket_qs = TaggedItem.objects.get_by_model(ticket_qs, tags)
             query_params['tags'] = tags
 
-    ticket_paginator = paginator.Paginator(ticket_qs, request.user.usersettings.settings.get('tickets_per_page') or 20)
+    # Shared saved queries are run over and over again by many users, so we
+    # page through a cached list of matching ticket ID's and only load the
+    # tickets on the current page.
+    ticket_ids = None
+    if saved_query and not tags:
+        ticket_ids = saved_search_ticket_ids(saved_query, query_params, ticket_qs)
+
+    if ticket_ids is not None:
+        ticket_paginator = paginator.Paginator(ticket_ids, request.user.usersettings.settings.get('tickets_per_page') or 20)
+    else:
+        ticket_paginator = paginator.Paginator(ticket_qs, request.user.usersettings.settings.get('tickets_per_page') or 20)
     try:
         page = int(request.GET.get('page', '1'))
     except ValueError:
@@ -715,6 +777,9 @@ def ticket_list(request):
     except (paginator.EmptyPage, paginator.InvalidPage):
         tickets = ticket_paginator.page(ticket_paginator.num_pages)
 
+    if ticket_ids is not None:
+        tickets.object_list = hydrate_tickets(ticket_list_queryset(columns), tickets.object_list)
+
     search_message = ''
     if context.has_key('query') and settings.DATABASE_ENGINE.startswith('sqlite'):
         search_message = _('<p><strong>Note:</strong> Your keyword search is case sensitive because of your database. This means the search will <strong>not</strong> be accurate. By switching to a different database system you will gain better searching! For more information, read the <a href="http://docs.djangoproject.com/en/dev/ref/databases/#sqlite-string-matching">Django Documentation on string matching in SQLite</a>.')
@@ -724,7 +789,7 @@ def ticket_list(request):
     from helpdesk.lib import b64encode
     urlsafe_query = b64encode(cPickle.dumps(query_params))
 
-    user_saved_queries = SavedSearch.objects.filter(Q(user=request.user) | Q(shared__exact=True))
+    user_saved_queries = navigation_context(request.user)['saved_queries']
 
     query_string = []
     for get_key, get_value in request.GET.iteritems():
@@ -741,6 +806,7 @@ def ticket_list(request):
             context,
             query_string="&".join(query_string),
             tickets=tickets,
+            columns=columns,
             user_choices=User.objects.filter(is_active=True),
             queue_choices=Queue.objects.all(),
             status_choices=Ticket.STATUS_CHOICES,
@@ -751,9 +817,10 @@ def ticket_list(request):
             from_saved_query=from_saved_query,
             saved_query=saved_query,
             search_message=search_message,
-            tags_enabled=HAS_TAG_SUPPORT
+            tags_enabled=HAS_TAG_SUPPORT,
+            blocked_ticket_ids=blocked_ticket_ids([t.id for t in tickets.object_list]),
         )))
-ticket_list = staff_member_required(ticket_list)
+ticket_list = staff_member_required(condition(etag_func=staff_page_etag)(ticket_list))
 
 
 def edit_ticket(request, ticket_id):
@@ -776,8 +843,8 @@ edit_ticket = staff_member_required(edit_ticket)
 def create_ticket(request):
     if request.method == 'POST':
         form = TicketForm(request.POST, request.FILES)
-        form.fields['queue'].choices = [('', '--------')] + [[q.id, q.title] for q in Queue.objects.all()]
-        form.fields['assigned_to'].choices = [('', '--------')] + [[u.id, u.username] for u in User.objects.filter(is_active=True).order_by('username')]
+        form.fields['queue'].choices = [('', '--------')] + queue_choices()
+        form.fields['assigned_to'].choices = [('', '--------')] + user_choices()
         if form.is_valid():
             ticket = form.save(user=request.user)
             return HttpResponseRedirect(ticket.get_absolute_url())
@@ -789,12 +856,8 @@ def create_ticket(request):
             initial_data['queue'] = request.GET['queue']
 
         form = TicketForm(initial=initial_data)
-        form.fields['queue'].choices = [('', '--------')] + [[q.id, q.title] for q in Queue.objects.all()]
-        if helpdesk_settings.HELPDESK_STAFF_ONLY_TICKET_OWNERS:
-            users = User.objects.filter(is_active=True, is_staff=True).order_by('username')
-        else:
-            users = User.objects.filter(is_active=True).order_by('username')
-        form.fields['assigned_to'].choices = [('', '--------')] + [[u.id, u.username] for u in users]
+        form.fields['queue'].choices = [('', '--------')] + queue_choices()
+        form.fields['assigned_to'].choices = [('', '--------')] + user_choices(staff_only=helpdesk_settings.HELPDESK_STAFF_ONLY_TICKET_OWNERS)
         if helpdesk_settings.HELPDESK_CREATE_TICKET_HIDE_ASSIGNED_TO:
             form.fields['assigned_to'].widget = forms.HiddenInput()
 
@@ -806,6 +869,65 @@ def create_ticket(request):
 create_ticket = staff_member_required(create_ticket)
 
 
+def user_autocomplete(request):
+    """
+    Returns a JSON list of active users whose username contains the 'term'
+    parameter, in the format expected by the jQuery UI autocomplete widget.
+    Used to pick a ticket owner without listing every user on the page.
+    """
+    term = request.GET.get('term', '').strip().lower()
+    users = user_choices(staff_only=helpdesk_settings.HELPDESK_STAFF_ONLY_TICKET_OWNERS)
+    limit = helpdesk_settings.HELPDESK_USER_AUTOCOMPLETE_LIMIT
+
+    matches = []
+    for user_id, username in users:
+        if term in username.lower():
+            matches.append({'id': user_id, 'label': username, 'value': username})
+            if len(matches) >= limit:
+                break
+
+    return HttpResponse(simplejson.dumps(matches), mimetype='application/json')
+user_autocomplete = staff_member_required(user_autocomplete)
+
+
+def event_stream(request):
+    """
+    A stream of ticket events (see helpdesk.events) in the text/event-stream
+    format read by the browser's EventSource, so the dashboard and ticket
+    list can tell when tickets change without reloading. The connection is
+    closed after HELPDESK_EVENT_STREAM_DURATION seconds, and the browser
+    reconnects, sending the ID of the last event it saw.
+    """
+    if not helpdesk_settings.HELPDESK_EVENTS_ENABLED:
+        raise Http404
+    broker = get_broker()
+    try:
+        last_id = int(request.META.get('HTTP_LAST_EVENT_ID', request.GET.get('after', '')))
+    except ValueError:
+        last_id = broker.latest_id()
+
+    response = HttpResponse(_event_stream(broker, last_id), mimetype='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    return response
+event_stream = staff_member_required(event_stream)
+
+
+def _event_stream(broker, last_id):
+    yield 'retry: 5000\n\n'
+    finish = time.time() + helpdesk_settings.HELPDESK_EVENT_STREAM_DURATION
+    while True:
+        remaining = finish - time.time()
+        if remaining <= 0:
+            break
+        events = broker.events_after(last_id, timeout=min(remaining, 10))
+        if not events:
+            # A comment, which keeps proxies from timing out the connection.
+            yield ': keepalive\n\n'
+        for event in events:
+            last_id = event['id']
+            yield 'id: %s\nevent: %s\ndata: %s\n\n' % (event['id'], event['type'], simplejson.dumps(event))
+
+
 def raw_details(request, type):
     # TODO: This currently only supports spewing out 'PreSetReply' objects,
     # in the future it needs to be expanded to include other items. All it
@@ -1173,9 +1295,10 @@ def ticket_dependency_add(request, ticket_id):
         if form.is_valid():
             ticketdependency = form.save(commit=False)
             ticketdependency.ticket = ticket
-            if ticketdependency.ticket <> ticketdependency.depends_on:
-                ticketdependency.save()
-            return HttpResponseRedirect(reverse('helpdesk_view', args=[ticket.id]))
+            if add_ticket_dependency(ticketdependency):
+                return HttpResponseRedirect(reverse('helpdesk_view', args=[ticket.id]))
+            form._errors['depends_on'] = form.error_class([
+                _('A ticket cannot depend on itself, either directly or through other tickets.')])
     else:
         form = TicketDependencyForm()
     return render_to_response('helpdesk/ticket_dependency_add.html',
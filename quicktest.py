@@ -0,0 +1,69 @@
+"""
+django-helpdesk - A Django powered ticket tracker for small enterprise.
+
+(c) Copyright 2008 Jutda. All Rights Reserved. See LICENSE for details.
+
+quicktest.py - Runs the helpdesk tests without a Django project, against an
+               in-memory SQLite database:
+
+    python quicktest.py
+"""
+
+import os
+import sys
+import tempfile
+
+from django.conf import settings
+
+
+def run_tests():
+    settings.configure(
+        DEBUG=False,
+        DATABASES={
+            'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': ':memory:',
+            },
+        },
+        INSTALLED_APPS=(
+            'django.contrib.auth',
+            'django.contrib.contenttypes',
+            'django.contrib.sessions',
+            'django.contrib.sites',
+            'django.contrib.admin',
+            'django.contrib.markup',
+            'django.contrib.staticfiles',
+            'helpdesk',
+        ),
+        MIDDLEWARE_CLASSES=(
+            'django.middleware.common.CommonMiddleware',
+            'django.contrib.sessions.middleware.SessionMiddleware',
+            'django.contrib.auth.middleware.AuthenticationMiddleware',
+        ),
+        TEMPLATE_CONTEXT_PROCESSORS=(
+            'django.contrib.auth.context_processors.auth',
+            'django.core.context_processors.debug',
+            'django.core.context_processors.i18n',
+            'django.core.context_processors.media',
+            'django.core.context_processors.static',
+            'django.core.context_processors.request',
+        ),
+        ROOT_URLCONF='helpdesk.urls',
+        SITE_ID=1,
+        STATIC_URL='/static/',
+        MEDIA_ROOT=tempfile.mkdtemp(),
+        CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            },
+        },
+    )
+
+    from django.test.utils import get_runner
+    test_runner = get_runner(settings)(verbosity=1, interactive=False)
+    failures = test_runner.run_tests(sys.argv[1:] or ['helpdesk'])
+    sys.exit(bool(failures))
+
+
+if __name__ == '__main__':
+    run_tests()